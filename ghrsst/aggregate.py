@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from pathlib import Path
+from typing import Union
+
+import dask.array as da
+import xarray as xr
+import zarr
+from botocore.exceptions import ClientError
+from odc.geo.geobox import GeoBox
+from s3path import S3Path
+
+from ghrsst.cogger import (
+    DEFAULT_PROFILE,
+    GHRSSTException,
+    _is_s3_path,
+    get_s3_client,
+    write_data,
+    write_stac,
+)
+from ghrsst.cube import (
+    APPEND_BLOCK,
+    CUBE_START,
+    _open_cube,
+    _require_array,
+    _storage_options,
+)
+from ghrsst.index import CONFLICT_CODES
+
+AGGREGATES_NAME = "aggregates.zarr"
+# Derived products go in a folder each, under this one
+DERIVED_FOLDER = "derived"
+# Variables to keep sums of. Their packed values are summed, so the means
+# are packed the same way.
+AGGREGATE_VARIABLES = ["analysed_sst"]
+# Day of the year goes by a leap year, so each day of the month has the
+# same index every year
+PERIODS = ["week", "month", "doy"]
+CLIMATOLOGY_DAYS = 366
+# Monday of the first week of MUR
+WEEK_START = CUBE_START - timedelta(days=CUBE_START.weekday())
+# Weeks and months run to the end of this year, so the arrays never have
+# to grow while other dates are being added
+AGGREGATES_END = datetime(2099, 12, 31)
+# The dates added to each period, and its lock, are kept in this folder
+STATE_FOLDER = "aggregates-state"
+# A lock older than a Lambda can run for was left by one that died
+LOCK_SECONDS = 15 * 60
+LOCK_WAIT_SECONDS = 1
+
+
+def get_aggregates_path(output_location: Union[Path, S3Path]) -> str:
+    if _is_s3_path(output_location):
+        return f"s3:/{output_location / AGGREGATES_NAME}"
+    return str(output_location / AGGREGATES_NAME)
+
+
+def get_derived_location(
+    output_location: Union[Path, S3Path], product: str
+) -> Union[Path, S3Path]:
+    return output_location / DERIVED_FOLDER / product
+
+
+def _period_index(period: str, date: datetime) -> int:
+    if period == "week":
+        return (date - WEEK_START).days // 7
+    if period == "month":
+        return (date.year - CUBE_START.year) * 12 + date.month - CUBE_START.month
+    return datetime(2000, date.month, date.day).timetuple().tm_yday - 1
+
+
+def _period_size(period: str) -> int:
+    if period == "doy":
+        return CLIMATOLOGY_DAYS
+    return _period_index(period, AGGREGATES_END) + 1
+
+
+def _period_dates(period: str, date: datetime) -> tuple[datetime, datetime]:
+    """The first and last days of the week or month a date is in"""
+    if period == "week":
+        start = date - timedelta(days=date.weekday())
+        return start, start + timedelta(days=6)
+    start = date.replace(day=1)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start, next_month - timedelta(days=1)
+
+
+def _state_path(
+    output_location: Union[Path, S3Path], var: str, period: str, index: int
+) -> Union[Path, S3Path]:
+    return output_location / STATE_FOLDER / f"{var}_{period}_{index}.json"
+
+
+def _read_state(path: Union[Path, S3Path]) -> dict:
+    """The dates added to a period, and one that's part way through"""
+    empty = {"dates": [], "pending": None}
+    if _is_s3_path(path):
+        try:
+            response = get_s3_client().get_object(Bucket=path.bucket, Key=path.key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return empty
+            raise
+        return json.loads(response["Body"].read())
+
+    if not path.exists():
+        return empty
+    return json.loads(path.read_text())
+
+
+def _write_state(path: Union[Path, S3Path], state: dict) -> None:
+    text = json.dumps(state)
+    if _is_s3_path(path):
+        get_s3_client().put_object(
+            Bucket=path.bucket,
+            Key=path.key,
+            Body=text,
+            ACL="bucket-owner-full-control",
+            ContentType="application/json",
+        )
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_text(text)
+        os.replace(temp_path, path)
+
+
+@contextmanager
+def _period_lock(path: Union[Path, S3Path]):
+    """Only let one writer add to a period at a time, from anywhere
+
+    On S3 the lock is an object that's only created if it isn't there, and
+    one that's older than LOCK_SECONDS is taken over.
+    """
+    lock_path = path.with_suffix(".lock")
+    if not _is_s3_path(lock_path):
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+        return
+
+    s3 = get_s3_client()
+    bucket, key = lock_path.bucket, lock_path.key
+    while True:
+        try:
+            s3.put_object(Bucket=bucket, Key=key, Body=b"", IfNoneMatch="*")
+            break
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in CONFLICT_CODES:
+                raise
+        try:
+            head = s3.head_object(Bucket=bucket, Key=key)
+        except ClientError:
+            # It was just released
+            continue
+        age = datetime.now(timezone.utc) - head["LastModified"]
+        if age.total_seconds() > LOCK_SECONDS:
+            # Only delete the lock we looked at, not a newer one
+            try:
+                s3.delete_object(Bucket=bucket, Key=key, IfMatch=head["ETag"])
+            except ClientError:
+                pass
+            continue
+        time.sleep(LOCK_WAIT_SECONDS)
+
+    try:
+        yield
+    finally:
+        s3.delete_object(Bucket=bucket, Key=key)
+
+
+def ensure_aggregates(
+    output_location: Union[Path, S3Path],
+    geobox: GeoBox,
+    variables: list[str],
+) -> zarr.Group:
+    """Get the accumulators, creating any that aren't there yet
+
+    There's an int32 sum of the packed values and an int16 count of valid
+    pixels for each variable and period, starting at zero, so chunks that
+    haven't been added to aren't stored. Each has a scratch copy, that new
+    sums are written to before they're copied over.
+    """
+    store = get_aggregates_path(output_location)
+    group = zarr.open_group(
+        store, mode="a", zarr_format=2, storage_options=_storage_options(store)
+    )
+
+    for var in variables:
+        for period in PERIODS:
+            for name, dtype in (
+                (f"{var}_{period}_sum", "int32"),
+                (f"{var}_{period}_count", "int16"),
+                (f"{var}_{period}_sum_scratch", "int32"),
+                (f"{var}_{period}_count_scratch", "int16"),
+            ):
+                array = _require_array(
+                    group,
+                    name,
+                    shape=(_period_size(period), *geobox.shape),
+                    chunks=(1, APPEND_BLOCK, APPEND_BLOCK),
+                    dtype=dtype,
+                    fill_value=0,
+                    attributes={"_ARRAY_DIMENSIONS": [period, "lat", "lon"]},
+                )
+                if tuple(array.shape[1:]) != tuple(geobox.shape):
+                    raise GHRSSTException(
+                        f"The accumulators at {store} have shape "
+                        f"{array.shape[1:]}, not {geobox.shape}"
+                    )
+
+    return group
+
+
+def _commit(group: zarr.Group, var: str, period: str, index: int) -> None:
+    """Copy a period's new sums over from scratch"""
+    names = [f"{var}_{period}_sum", f"{var}_{period}_count"]
+    region = (slice(index, index + 1), slice(None), slice(None))
+    da.store(
+        [da.from_zarr(group[f"{name}_scratch"])[index][None] for name in names],
+        [group[name] for name in names],
+        regions=[region] * len(names),
+        lock=False,
+    )
+
+
+def _add_to_period(
+    group: zarr.Group,
+    var: str,
+    period: str,
+    index: int,
+    key: str,
+    additions: dict[str, da.Array],
+    path: Union[Path, S3Path],
+) -> bool:
+    """Add a date's sum and count to a period, holding its lock
+
+    The new sums go to scratch, and the date is recorded as pending before
+    they're copied over, so a retry after a failure at any point either
+    finishes the copy or starts again, and never adds the date twice.
+
+    Returns:
+        bool: Whether the date was added, rather than there already
+    """
+    state = _read_state(path)
+    if state["pending"] is not None:
+        _commit(group, var, period, index)
+        state = {"dates": sorted(state["dates"] + [state["pending"]]), "pending": None}
+        _write_state(path, state)
+    if key in state["dates"]:
+        return False
+
+    region = (slice(index, index + 1), slice(None), slice(None))
+    sources, targets = [], []
+    for kind, addition in additions.items():
+        current = da.from_zarr(group[f"{var}_{period}_{kind}"])[index]
+        sources.append((current + addition)[None])
+        targets.append(group[f"{var}_{period}_{kind}_scratch"])
+    da.store(sources, targets, regions=[region] * len(targets), lock=False)
+
+    _write_state(path, {"dates": state["dates"], "pending": key})
+    _commit(group, var, period, index)
+    _write_state(path, {"dates": sorted(state["dates"] + [key]), "pending": None})
+    return True
+
+
+def accumulate_date(
+    data: xr.Dataset,
+    date: datetime,
+    output_location: Union[Path, S3Path],
+    log: Logger | None = None,
+) -> str:
+    """Add a date's valid pixels to the sums and counts of its week, month
+    and day of the year
+
+    Only the blocks of the date's week, month and day are read and written,
+    however many dates there are. Each period is locked while it's added
+    to, so dates can be added from many Lambdas at once, and a date that
+    was added already is skipped, so it's safe to repeat.
+    """
+    variables = [var for var in AGGREGATE_VARIABLES if var in data.data_vars]
+    group = ensure_aggregates(output_location, data.odc.geobox, variables)
+    key = f"{date:%Y-%m-%d}"
+
+    for var in variables:
+        pixels = da.asarray(data[var].isel(time=0).data).rechunk(APPEND_BLOCK)
+        valid = pixels != data[var].attrs["_FillValue"]
+        additions = {
+            "sum": da.where(valid, pixels, 0).astype("int32"),
+            "count": valid.astype("int16"),
+        }
+        for period in PERIODS:
+            index = _period_index(period, date)
+            path = _state_path(output_location, var, period, index)
+            with _period_lock(path):
+                added = _add_to_period(group, var, period, index, key, additions, path)
+            if log is not None and not added:
+                log.info(f"Already added {key} to {var} for {period} {index}")
+
+    if log is not None:
+        log.info(f"Accumulated {key} into {get_aggregates_path(output_location)}")
+
+    return get_aggregates_path(output_location)
+
+
+def _sums(group: zarr.Group, var: str, period: str, index: int):
+    total = da.from_zarr(group[f"{var}_{period}_sum"])[index]
+    return total, da.from_zarr(group[f"{var}_{period}_count"])[index]
+
+
+def _mean(total: da.Array, count: da.Array, fill) -> da.Array:
+    """The mean packed value, rounded to be cast back to the variable's type"""
+    mean = da.round(total.astype("float32") / da.maximum(count, 1))
+    return da.where(count > 0, mean, fill)
+
+
+def get_derived(
+    data: xr.Dataset,
+    date: datetime,
+    output_location: Union[Path, S3Path],
+) -> dict[str, tuple[datetime, datetime, xr.Dataset]]:
+    """The weekly and monthly means so far, and the anomaly from the day of
+    the year's climatology in the other years, for a date that's been
+    accumulated
+
+    Returns:
+        dict: For each product, its first and last days and its data
+    """
+    group = _open_cube(get_aggregates_path(output_location))
+    variables = [var for var in AGGREGATE_VARIABLES if var in data.data_vars]
+
+    derived = {}
+    for period, product in (("week", "weekly"), ("month", "monthly")):
+        index = _period_index(period, date)
+        means = {}
+        for var in variables:
+            fill = data[var].attrs["_FillValue"]
+            mean = _mean(*_sums(group, var, period, index), fill)
+            mean = mean.astype(data[var].dtype)
+            means[var] = data[var].copy(data=mean[None])
+        derived[product] = (*_period_dates(period, date), xr.Dataset(means))
+
+    anomalies = {}
+    for var in variables:
+        fill = data[var].attrs["_FillValue"]
+        pixels = da.asarray(data[var].isel(time=0).data)
+        valid = pixels != fill
+        # Leave the date out of its own climatology, which would otherwise
+        # pull every anomaly towards zero
+        total, count = _sums(group, var, "doy", _period_index("doy", date))
+        climatology = _mean(
+            total - da.where(valid, pixels, 0).astype("int32"),
+            count - valid.astype("int16"),
+            fill,
+        )
+        anomaly = da.where(valid & (climatology != fill), pixels - climatology, fill)
+        anomalies[var] = data[var].copy(data=anomaly.astype(data[var].dtype)[None])
+        # The offsets cancel out
+        anomalies[var].attrs["add_offset"] = 0.0
+    derived["anomaly"] = (date, date, xr.Dataset(anomalies))
+
+    return derived
+
+
+def aggregate_date(
+    data: xr.Dataset,
+    date: datetime,
+    output_location: Union[Path, S3Path],
+    log: Logger | None = None,
+    profile: str = DEFAULT_PROFILE,
+) -> dict[str, Union[Path, S3Path]]:
+    """Accumulate a date, and write the derived products it changes, each
+    with a STAC item, under DERIVED_FOLDER
+
+    Weekly and monthly means are named for the first day of their period,
+    and are rewritten as each of its dates is added.
+
+    Returns:
+        dict: The STAC item of each product
+    """
+    accumulate_date(data, date, output_location, log=log)
+
+    items = {}
+    for product, (start, end, dataset) in get_derived(
+        data, date, output_location
+    ).items():
+        location = get_derived_location(output_location, product)
+        written_files = write_data(
+            dataset, start, location, overwrite=True, log=log, profile=profile
+        )
+        item = write_stac(
+            dataset,
+            written_files,
+            start,
+            location,
+            log=log,
+            geobox=data.odc.geobox,
+            end_date=end,
+        )
+        items[product] = item.self_href
+
+    return items
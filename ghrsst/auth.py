@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from threading import Lock
+
+import boto3
+from earthaccess import get_edl_token, login
+
+from ghrsst.cogger import GHRSSTException
+
+# Where to keep the token between processes: a file, like
+# /tmp/earthdata-token.json, or secretsmanager:<secret name>
+TOKEN_CACHE_ENV = "EARTHDATA_TOKEN_CACHE"
+SECRETS_MANAGER_PREFIX = "secretsmanager:"
+# Get a new token once the one we have has less than this left
+REFRESH_BEFORE = timedelta(days=1)
+# Earthdata gives the day a token expires. If it doesn't, assume this, which
+# is well short of the 60 days its tokens last
+DEFAULT_LIFETIME = timedelta(days=2)
+EXPIRY_FORMAT = "%m/%d/%Y"
+
+log = logging.getLogger(__name__)
+
+# Shared by every request in the process, so warm Lambdas and batches of
+# dates only log in when the token is about to expire
+_TOKEN = None
+_TOKEN_LOCK = Lock()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_token(token: dict) -> dict:
+    """Keep the access token and when it expires, from Earthdata's response"""
+    try:
+        expires = datetime.strptime(token["expiration_date"], EXPIRY_FORMAT)
+        expires = expires.replace(tzinfo=timezone.utc)
+    except (KeyError, ValueError):
+        expires = _now() + DEFAULT_LIFETIME
+
+    return {"access_token": token["access_token"], "expires": expires.isoformat()}
+
+
+def _is_fresh(cached: dict | None) -> bool:
+    if cached is None:
+        return False
+    expires = datetime.fromisoformat(cached["expires"])
+    return expires - _now() > REFRESH_BEFORE
+
+
+def _login() -> dict:
+    auth = login(strategy="environment")
+    if not auth.authenticated:
+        raise GHRSSTException("Failed to authenticate with Earthdata")
+
+    return _parse_token(get_edl_token())
+
+
+def _secrets_client():
+    return boto3.client("secretsmanager")
+
+
+def _valid_cache(cached) -> bool:
+    """Whether a cached token has the access token and when it expires"""
+    if not isinstance(cached, dict) or not isinstance(cached.get("access_token"), str):
+        return False
+    try:
+        expires = datetime.fromisoformat(cached["expires"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return expires.tzinfo is not None
+
+
+def _read_cache(location: str) -> dict | None:
+    try:
+        if location.startswith(SECRETS_MANAGER_PREFIX):
+            secret_id = location[len(SECRETS_MANAGER_PREFIX) :]
+            response = _secrets_client().get_secret_value(SecretId=secret_id)
+            cached = json.loads(response["SecretString"])
+        else:
+            cached = json.loads(Path(location).read_text())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A cache we can't read is the same as an empty one
+        log.warning(f"Couldn't read the Earthdata token from {location}: {e}")
+        return None
+
+    if not _valid_cache(cached):
+        log.warning(f"Ignoring an invalid Earthdata token cache at {location}")
+        return None
+    return cached
+
+
+def _write_cache(location: str, cached: dict) -> None:
+    text = json.dumps(cached)
+    try:
+        if location.startswith(SECRETS_MANAGER_PREFIX):
+            secret_id = location[len(SECRETS_MANAGER_PREFIX) :]
+            client = _secrets_client()
+            try:
+                client.put_secret_value(SecretId=secret_id, SecretString=text)
+            except client.exceptions.ResourceNotFoundException:
+                client.create_secret(Name=secret_id, SecretString=text)
+        else:
+            # Only readable by us, and swapped in whole so readers never
+            # see half a token
+            temp_path = f"{location}.{os.getpid()}.tmp"
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(temp_path, location)
+    except Exception as e:
+        log.warning(f"Couldn't save the Earthdata token to {location}: {e}")
+
+
+def get_token() -> str:
+    """Get an Earthdata token, logging in with EARTHDATA_USERNAME and
+    EARTHDATA_PASSWORD only when there isn't a fresh one in memory or in
+    the cache at EARTHDATA_TOKEN_CACHE
+    """
+    global _TOKEN
+
+    with _TOKEN_LOCK:
+        if _is_fresh(_TOKEN):
+            return _TOKEN["access_token"]
+
+        location = os.environ.get(TOKEN_CACHE_ENV)
+        if location:
+            cached = _read_cache(location)
+            if _is_fresh(cached):
+                _TOKEN = cached
+                return _TOKEN["access_token"]
+
+        _TOKEN = _login()
+        log.info(f"Logged in to Earthdata, with a token until {_TOKEN['expires']}")
+        if location:
+            _write_cache(location, _TOKEN)
+
+        return _TOKEN["access_token"]
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from datetime import datetime, timedelta
+from logging import Logger
+from multiprocessing import get_context as get_mp_context
+from pathlib import Path
+from typing import Union
+
+from s3path import S3Path
+
+from ghrsst.auth import TOKEN_CACHE_ENV
+from ghrsst.cogger import (
+    cache_data,
+    environ,
+    get_cache_path,
+    get_context,
+    get_input_path,
+    get_logger,
+    get_roi_location,
+    process_date,
+)
+from ghrsst.index import filter_done, read_index, rebuild_index
+
+DATE_FORMAT = "%Y-%m-%d"
+# Threads each process gives dask, so that processes don't fight over cores
+THREADS_PER_PROCESS = 2
+# GDAL's block cache, in MB, per process
+GDAL_CACHEMAX = 256
+TOKEN_CACHE_FILE = Path(tempfile.gettempdir()) / "ghrsst-earthdata-token.json"
+# Inputs to have ready ahead of the processes at most. With cache_local each
+# is a file of about 400 MB in /tmp.
+MAX_PREFETCH = 4
+# Roughly the peak memory of a process on a full MUR date, which builds a
+# variable's 1.3 GB array, and its COG, at a time. Processes are limited to
+# as many as fit in the machine's memory.
+MEMORY_PER_PROCESS = 6 * 2**30
+
+# Each process sets up its logger once, as get_logger adds a handler per call
+WORKER_LOG = None
+
+
+def get_dates(
+    start_date: str | None = None,
+    end_date: str | None = None,
+    dates_file: str | None = None,
+) -> list[datetime]:
+    """Get the dates between two dates, inclusive, or from a file with one per line"""
+    if dates_file is not None:
+        lines = Path(dates_file).read_text().splitlines()
+        return sorted(
+            {
+                datetime.strptime(line.strip(), DATE_FORMAT)
+                for line in lines
+                if line.strip()
+            }
+        )
+
+    start = datetime.strptime(start_date, DATE_FORMAT)
+    end = datetime.strptime(end_date, DATE_FORMAT)
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _init_worker(threads: int) -> None:
+    import dask
+
+    global WORKER_LOG
+    WORKER_LOG = get_logger()
+
+    os.environ.setdefault("GDAL_CACHEMAX", str(GDAL_CACHEMAX))
+    # Share one Earthdata token between the processes, rather than each
+    # logging in
+    os.environ.setdefault(TOKEN_CACHE_ENV, str(TOKEN_CACHE_FILE))
+    dask.config.set(scheduler="threads", num_workers=threads)
+
+
+def _process(
+    date: datetime, input_location: str, output_location, kwargs
+) -> float | None:
+    """Process a date, returning how long it took, or None if it was skipped"""
+    start = time.perf_counter()
+    if not process_date(
+        date, input_location, output_location, log=WORKER_LOG, **kwargs
+    ):
+        return None
+    return time.perf_counter() - start
+
+
+def _total_memory() -> int | None:
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def limit_processes(processes: int, memory_per_process: int | None, log: Logger) -> int:
+    """Limit processes to as many as fit in the machine's memory"""
+    total_memory = _total_memory()
+    if memory_per_process and total_memory:
+        fit = max(total_memory // memory_per_process, 1)
+        if processes > fit:
+            log.warning(
+                f"Only {fit} processes fit in {total_memory / 2**30:.1f} GB of "
+                f"memory, rather than {processes}"
+            )
+            return fit
+    return processes
+
+
+def remove_cached(date: datetime) -> None:
+    """Delete a date's cached file, and the record of a partial download"""
+    from ghrsst.download import _state_path
+
+    cache_path = get_cache_path(date)
+    cache_path.unlink(missing_ok=True)
+    _state_path(cache_path).unlink(missing_ok=True)
+
+
+def prefetch_input(date: datetime, input_location: str, cache_local: bool) -> None:
+    """Get a date's input ready before a worker needs it
+
+    With cache_local the file is downloaded to the cache. A local file
+    is read ahead into the page cache instead.
+    """
+    if cache_local:
+        cache_data(date, input_location)
+        return
+
+    input_path = get_input_path(input_location, date)
+    if "://" not in input_path:
+        fd = os.open(input_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def backfill(
+    dates: list[datetime],
+    input_location: str,
+    output_location: Union[Path, S3Path],
+    overwrite: bool = False,
+    cache_local: bool = False,
+    processes: int = os.cpu_count(),
+    threads: int = THREADS_PER_PROCESS,
+    prefetch: int | None = None,
+    memory_per_process: int | None = MEMORY_PER_PROCESS,
+    log: Logger | None = None,
+    **kwargs,
+) -> dict:
+    """Process many dates at once, with a process per date
+
+    Each process works on one date at a time with a few threads, and
+    builds one variable at a time, so there are only as many processes as
+    fit in memory. Inputs are prefetched for the next dates while the
+    current ones are processed. With cache_local, the cached file of a
+    date that fails is deleted.
+
+    Args:
+        dates (list[datetime]): Dates to process
+        processes (int): Number of dates to process at once
+        threads (int): Dask threads in each process
+        prefetch (int): Number of inputs to have ready ahead of the
+            processes. Defaults to the number of processes, up to
+            MAX_PREFETCH.
+        memory_per_process (int): Bytes of memory each process needs, to
+            limit the processes to the machine's memory. None for no limit.
+        kwargs: Passed on to process_date
+
+    Returns:
+        dict: A summary of which dates were done, skipped, missing or failed
+    """
+    if log is None:
+        log = get_logger()
+    processes = limit_processes(processes, memory_per_process, log)
+    # Always have at least the next date's input on its way
+    if prefetch is None:
+        prefetch = min(processes, MAX_PREFETCH)
+    prefetch = max(prefetch, 1)
+
+    started = time.perf_counter()
+    summary = {"done": [], "skipped": [], "missing": [], "failed": {}}
+
+    if not overwrite:
+        # Regions have their own index, next to their outputs
+        done_location = output_location
+        if kwargs.get("roi") is not None:
+            done_location = get_roi_location(output_location, kwargs["roi"][0])
+        with environ(get_context()):
+            # A year without an index may still have dates done, so find
+            # them from the STAC items rather than prefetching them
+            for year in sorted({date.year for date in dates}):
+                if not read_index(done_location, year):
+                    rebuild_index(done_location, year, log=log)
+            todo = filter_done(done_location, dates)
+        done = set(todo)
+        summary["skipped"] = [f"{d:{DATE_FORMAT}}" for d in dates if d not in done]
+        dates = todo
+
+    log.info(
+        f"Processing {len(dates)} dates with {processes} processes, "
+        f"skipped {len(summary['skipped'])} that are already done"
+    )
+
+    def record_error(date: datetime, error: Exception) -> None:
+        if isinstance(error, FileNotFoundError):
+            log.error(f"Couldn't find file for date {date:{DATE_FORMAT}}: {error}")
+            summary["missing"].append(f"{date:{DATE_FORMAT}}")
+        else:
+            log.error(f"Failed to process date {date:{DATE_FORMAT}}: {error}")
+            summary["failed"][f"{date:{DATE_FORMAT}}"] = str(error)
+        # process_date only cleans up after the dates that finish
+        if cache_local:
+            remove_cached(date)
+
+    kwargs = dict(kwargs, overwrite=overwrite, cache_local=cache_local)
+    pending = deque(dates)
+    fetching = deque()
+    running = {}
+    seconds = []
+
+    fetcher = ThreadPoolExecutor(max_workers=prefetch)
+    # Spawn rather than fork, as forking a process with GDAL and dask
+    # threads running can deadlock
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=get_mp_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads,),
+    )
+
+    with fetcher, pool:
+        while pending or fetching or running:
+            # Keep the prefetch queue full
+            while pending and len(fetching) < prefetch:
+                date = pending.popleft()
+                future = fetcher.submit(
+                    prefetch_input, date, input_location, cache_local
+                )
+                fetching.append((date, future))
+
+            # Hand prefetched dates to free processes, in order
+            while fetching and fetching[0][1].done() and len(running) < processes:
+                date, future = fetching.popleft()
+                if future.exception() is not None:
+                    record_error(date, future.exception())
+                    continue
+                running[
+                    pool.submit(_process, date, input_location, output_location, kwargs)
+                ] = date
+
+            waiting = list(running)
+            if fetching and len(running) < processes:
+                waiting.append(fetching[0][1])
+            if not waiting:
+                continue
+
+            finished, _ = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in finished:
+                date = running.pop(future, None)
+                if date is None:
+                    # A prefetch finished, so go round and hand it out
+                    continue
+                if future.exception() is not None:
+                    record_error(date, future.exception())
+                elif future.result() is None:
+                    summary["skipped"].append(f"{date:{DATE_FORMAT}}")
+                    log.info(f"Skipped {date:{DATE_FORMAT}} as it already exists")
+                else:
+                    seconds.append(future.result())
+                    summary["done"].append(f"{date:{DATE_FORMAT}}")
+                    log.info(
+                        f"Finished {date:{DATE_FORMAT}} in {future.result():.1f}s, "
+                        f"{len(summary['done'])} of {len(dates)} done"
+                    )
+
+    summary["done"].sort()
+    summary["skipped"].sort()
+    summary["seconds"] = round(time.perf_counter() - started, 1)
+    if seconds:
+        summary["mean_seconds_per_date"] = round(sum(seconds) / len(seconds), 1)
+
+    log.info(
+        f"Backfill finished in {summary['seconds']}s: {len(summary['done'])} done, "
+        f"{len(summary['skipped'])} skipped, {len(summary['missing'])} missing, "
+        f"{len(summary['failed'])} failed"
+    )
+
+    return summary
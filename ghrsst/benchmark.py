@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import json
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from logging import Logger
+from pathlib import Path
+from typing import Union
+
+import click
+from s3path import S3Path
+
+from ghrsst.cogger import (
+    _S3_CLIENTS,
+    COG_PROFILES,
+    DEFAULT_PROFILE,
+    LAYOUTS,
+    MIN_REMAINING_SECONDS,
+    GHRSSTException,
+    environ,
+    get_logger,
+    load_data,
+    process_data,
+    write_data,
+    write_stac,
+)
+from ghrsst.metrics import measure
+from ghrsst.synthetic import MUR_SHAPE, write_synthetic_file
+
+BENCHMARK_DATE = datetime(2023, 11, 6)
+BENCHMARK_BUCKET = "ghrsst-benchmark"
+# The cogger Lambda starts a date with as little as this left, so that's all
+# the time a date can count on
+LAMBDA_BUDGET_SECONDS = MIN_REMAINING_SECONDS
+
+
+def run_pipeline(
+    input_location: str,
+    output_location: Union[Path, S3Path],
+    date: datetime = BENCHMARK_DATE,
+    eager: bool = False,
+    log: Logger | None = None,
+    **kwargs,
+) -> dict:
+    """Time each stage of processing a date, the way process_date runs them
+
+    Args:
+        eager (bool): Load the data in the load stage. Otherwise data is
+            read lazily, and reading is counted in write_data.
+        kwargs: Passed on to write_data
+    """
+    if log is None:
+        log = get_logger()
+
+    stages = {}
+    with measure("load_data", stages):
+        data = load_data(date, input_location, log=log)
+        if eager:
+            data = data.load()
+
+    with measure("process_data", stages):
+        processed = process_data(data)
+
+    with measure("write_data", stages):
+        written_files = write_data(
+            processed, date, output_location, overwrite=True, log=log, **kwargs
+        )
+
+    with measure("write_stac", stages):
+        write_stac(
+            data,
+            written_files,
+            date,
+            output_location,
+            log=log,
+            geobox=processed.odc.geobox,
+        )
+
+    stages["total"] = {
+        "seconds": round(sum(stage["seconds"] for stage in stages.values()), 3),
+        "peak_rss_mb": max(stage["peak_rss_mb"] for stage in stages.values()),
+    }
+
+    return stages
+
+
+@contextmanager
+def s3_stand_in(endpoint: str | None = None, bucket: str = BENCHMARK_BUCKET):
+    """An S3 to write to, either moto in this process or a local MinIO
+
+    moto isn't part of the Lambda image, so it has to be installed to use it.
+    """
+    if endpoint is not None:
+        context = {"AWS_ENDPOINT_URL": endpoint}
+        mock = None
+    else:
+        try:
+            from moto import mock_aws
+        except ImportError:
+            raise GHRSSTException(
+                "Install moto[s3] or give an S3 endpoint, like a local MinIO"
+            )
+
+        context = {
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+        mock = mock_aws()
+
+    # Clients are cached per endpoint and credentials, so don't reuse real ones
+    _S3_CLIENTS.clear()
+    with environ(context):
+        if mock is not None:
+            mock.start()
+        try:
+            import boto3
+
+            s3 = boto3.client("s3")
+            if bucket not in [b["Name"] for b in s3.list_buckets()["Buckets"]]:
+                s3.create_bucket(Bucket=bucket)
+            yield S3Path(f"/{bucket}/{BENCHMARK_BUCKET}")
+        finally:
+            if mock is not None:
+                mock.stop()
+            _S3_CLIENTS.clear()
+
+
+def benchmark(
+    input_location: str,
+    targets: list[str],
+    work_dir: Path,
+    repeat: int = 1,
+    s3_endpoint: str | None = None,
+    log: Logger | None = None,
+    **kwargs,
+) -> list[dict]:
+    """Run the pipeline against each target, a number of times"""
+    runs = []
+    for target in targets:
+        for attempt in range(repeat):
+            if target == "local":
+                output_location = work_dir / "output"
+                stages = run_pipeline(
+                    input_location, output_location, log=log, **kwargs
+                )
+            elif target == "s3":
+                with s3_stand_in(s3_endpoint) as output_location:
+                    stages = run_pipeline(
+                        input_location, output_location, log=log, **kwargs
+                    )
+            else:
+                raise GHRSSTException(f"Unknown target {target}")
+
+            runs.append({"target": target, "attempt": attempt, "stages": stages})
+            if log is not None:
+                log.info(
+                    f"{target} run {attempt}: {stages['total']['seconds']}s, "
+                    f"peak {stages['total']['peak_rss_mb']} MB"
+                )
+
+    return runs
+
+
+@click.option("--height", type=int, default=MUR_SHAPE[0])
+@click.option("--width", type=int, default=MUR_SHAPE[1])
+@click.option("--input-location", type=str, default=None)
+@click.option("--date", type=str, default=f"{BENCHMARK_DATE:%Y-%m-%d}")
+@click.option("--work-dir", type=str, default=None)
+@click.option("--target", "targets", multiple=True, default=["local", "s3"])
+@click.option("--s3-endpoint", type=str, default=None)
+@click.option("--repeat", type=int, default=1)
+@click.option("--workers", type=int, default=1)
+@click.option("--stream/--no-stream", is_flag=True, default=False)
+@click.option("--eager/--lazy", is_flag=True, default=False)
+@click.option("--coarse/--no-coarse", is_flag=True, default=False)
+@click.option("--layout", type=click.Choice(LAYOUTS), default="single")
+@click.option(
+    "--profile", type=click.Choice(list(COG_PROFILES)), default=DEFAULT_PROFILE
+)
+@click.option("--budget-seconds", type=float, default=LAMBDA_BUDGET_SECONDS)
+@click.option("--output-json", type=str, default=None)
+@click.command("ghrsst-benchmark")
+def main(
+    height,
+    width,
+    input_location,
+    date,
+    work_dir,
+    targets,
+    s3_endpoint,
+    repeat,
+    workers,
+    stream,
+    eager,
+    coarse,
+    layout,
+    profile,
+    budget_seconds,
+    output_json,
+):
+    log = get_logger()
+    date = datetime.strptime(date, "%Y-%m-%d")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = Path(work_dir or temp_dir)
+        if input_location is None:
+            # Keep synthetic files in the work dir, so they can be reused
+            input_location = str(work_dir / f"input-{height}x{width}")
+            if not (Path(input_location) / "done").exists():
+                log.info(f"Generating a {height}x{width} synthetic NetCDF")
+                write_synthetic_file(Path(input_location), date, (height, width))
+                (Path(input_location) / "done").touch()
+
+        try:
+            runs = benchmark(
+                input_location,
+                list(targets),
+                work_dir,
+                repeat=repeat,
+                s3_endpoint=s3_endpoint,
+                log=log,
+                date=date,
+                eager=eager,
+                workers=workers,
+                stream=stream,
+                coarse=coarse,
+                layout=layout,
+                profile=profile,
+            )
+        except GHRSSTException as e:
+            print(f"Failed to run benchmark with error {e}")
+            exit(1)
+
+    slowest = max(run["stages"]["total"]["seconds"] for run in runs)
+    results = {
+        "created": f"{datetime.now():%Y-%m-%dT%H:%M:%S}",
+        "input_location": input_location,
+        "shape": [height, width],
+        "options": {
+            "workers": workers,
+            "stream": stream,
+            "eager": eager,
+            "coarse": coarse,
+            "layout": layout,
+            "profile": profile,
+        },
+        "budget_seconds": budget_seconds,
+        "over_budget": slowest > budget_seconds,
+        "runs": runs,
+    }
+
+    text = json.dumps(results, indent=2)
+    if output_json is not None:
+        Path(output_json).write_text(text)
+    click.echo(text)
+
+    if results["over_budget"]:
+        print(f"Slowest run took {slowest}s, over the budget of {budget_seconds}s")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,28 +2,34 @@
 
 import json
 import logging
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime
+from io import BytesIO
 from logging import Logger
 from pathlib import Path
-from typing import Tuple, Union
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import Any, Tuple, Union
 
 import boto3
 import click
-import fsspec
+import numpy as np
 import xarray as xr
 from affine import Affine
 from aiohttp.client_exceptions import ClientResponseError
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from earthaccess import get_edl_token, login
 from odc.geo.geobox import GeoBox
-from odc.geo.xr import assign_crs, xr_coords
+from odc.geo.xr import assign_crs, wrap_xr, xr_coords
 from pystac import Asset, Item, MediaType, Link, RelType
-from rio_stac import create_stac_item
 from s3path import S3Path
 from xarray import Dataset
 
+from ghrsst.metrics import Metrics, stage
+
 COLLECTION = "ghrsst-mur-v2"
 FILE_STRING = "{date:%Y%m%d}090000-JPL-L4_GHRSST-SSTfnd-MUR-GLOB-v02.0-fv04.1.nc"
 FOLDER_PATH = "{date:%Y}/{date:%m}/{date:%d}"
@@ -39,7 +45,51 @@ VARIABLES = [
 # Not loading or writing the datetime data
 DROP_VARIABLES = ["dt_1km_data"]
 VARIABLES = [var for var in VARIABLES if var not in DROP_VARIABLES]
-COG_OPTS = dict(compress="zstd")
+# The data type each variable is stored as, which decides the COG it goes in
+# with the multiband layout, so that can be planned before opening the file
+VARIABLE_TYPES = {
+    "analysed_sst": "int16",
+    "analysis_error": "int16",
+    "mask": "int8",
+    "sea_ice_fraction": "int8",
+    "sst_anomaly": "int16",
+}
+# Encoding profiles for the COGs, which trade the time to encode them
+# against their size. All use zstd, with tiles of 512 pixels for serving.
+COG_PROFILES = {
+    "fast": dict(zstd_level=1, blocksize=512, overview_resampling="nearest"),
+    "balanced": dict(zstd_level=9, blocksize=512, overview_resampling="nearest"),
+    "archive": dict(zstd_level=15, blocksize=512, overview_resampling="average"),
+}
+DEFAULT_PROFILE = "balanced"
+# Integers use horizontal differencing, as odc-geo does, and floats the
+# floating point predictor. Profiles other than the default can differ by
+# data type: on a MUR-shaped date, no predictor makes the int8 COGs smaller
+# with zstd levels 1 and 15, but larger with level 9.
+PREDICTORS = {"fast": {"int8": 1}, "archive": {"int8": 1}}
+# Coarser products for maps at low zoom, by name and how many 0.01 degree
+# pixels make one of their pixels. Each is a multiple of the one before.
+COARSE_PRODUCTS = {"0p05": 5, "0p25": 25}
+# Either a COG per variable, or a COG per data type with a band per variable
+LAYOUTS = ["single", "multiband"]
+STAC_EXTENSIONS = [
+    "https://stac-extensions.github.io/projection/v1.1.0/schema.json",
+    "https://stac-extensions.github.io/raster/v1.1.0/schema.json",
+]
+# Enough connections for every variable and a multipart upload at once
+S3_MAX_POOL_CONNECTIONS = 50
+# Regional products go in a folder per region of interest, under this one
+ROI_FOLDER = "roi"
+# Where memory-mapped variables are decoded to, which is Lambda's ephemeral
+# storage. Rows are decoded a block at a time, a chunk of the file at once
+# if it's chunked.
+MEMMAP_FOLDER = Path("/tmp")
+MEMMAP_ROWS = 1000
+# Chunks to read and encode lazy data in
+WRITE_CHUNKS = {"time": 1, "lat": 500, "lon": 500}
+# The Lambda doesn't start a date with less than this many seconds left, so
+# a date has to finish in this long
+MIN_REMAINING_SECONDS = 300
 
 
 class GHRSSTException(Exception):
@@ -67,10 +117,39 @@ def _is_s3_path(path: Union[Path, S3Path]) -> bool:
     return isinstance(path, S3Path)
 
 
+_S3_CLIENTS = {}
+_S3_CLIENTS_LOCK = Lock()
+
+
+def get_s3_client():
+    """Get an S3 client for the current environment, reusing it if we can
+
+    Clients are kept per endpoint and credentials, so the ones made inside
+    the source.coop environ context are separate from the default ones.
+    """
+    key = tuple(
+        os.environ.get(name)
+        for name in ["AWS_ENDPOINT_URL", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]
+    )
+    with _S3_CLIENTS_LOCK:
+        if key not in _S3_CLIENTS:
+            # Sessions aren't thread safe, so each client gets its own
+            _S3_CLIENTS[key] = boto3.session.Session().client(
+                "s3",
+                config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    retries={"max_attempts": 5, "mode": "standard"},
+                ),
+            )
+
+    return _S3_CLIENTS[key]
+
+
 def _exists(path: Union[Path, S3Path]) -> bool:
     if _is_s3_path(path):
         try:
-            s3 = boto3.client("s3")
+            s3 = get_s3_client()
             s3.head_object(Bucket=path.bucket, Key=path.key)
             return True
         except ClientError:
@@ -79,6 +158,34 @@ def _exists(path: Union[Path, S3Path]) -> bool:
         return path.exists()
 
 
+def list_existing(folder: Union[Path, S3Path]) -> set[str]:
+    """Get the names of the files in a folder, with one listing rather than
+    a request per file
+    """
+    if _is_s3_path(folder):
+        s3 = get_s3_client()
+        prefix = folder.key.rstrip("/") + "/"
+        names = set()
+        for page in s3.get_paginator("list_objects_v2").paginate(
+            Bucket=folder.bucket, Prefix=prefix
+        ):
+            for obj in page.get("Contents", []):
+                names.add(obj["Key"][len(prefix) :])
+        return names
+    else:
+        if not folder.exists():
+            return set()
+        return {path.name for path in folder.iterdir()}
+
+
+def _write_bytes(path: Union[Path, S3Path], data: bytes) -> None:
+    if _is_s3_path(path):
+        # Uses a managed transfer, which is multipart for large files
+        get_s3_client().upload_fileobj(BytesIO(data), path.bucket, path.key)
+    else:
+        path.write_bytes(data)
+
+
 def _get_href(path: Union[Path, S3Path]) -> str:
     href = str(path)
     if _is_s3_path(path):
@@ -90,6 +197,7 @@ def _get_href(path: Union[Path, S3Path]) -> str:
 
     return href
 
+
 def get_logger():
     logger = logging.getLogger(__name__)
     handler = logging.StreamHandler()
@@ -110,6 +218,13 @@ if os.environ.get("AWS_EXECUTION_ENV") is not None:
     LOGGER = get_logger()
 
 
+def get_location(location: str) -> Union[Path, S3Path]:
+    if location.startswith("s3://"):
+        return S3Path(location.replace("s3://", "/"))
+    else:
+        return Path(location)
+
+
 def get_output_path(
     output_location: Union[Path, S3Path], date: datetime, extension: str
 ):
@@ -120,6 +235,70 @@ def get_output_path(
     )
 
 
+def get_roi(roi: str, name: str | None = None) -> tuple[str, tuple[float, ...]]:
+    """Parse a region of interest, from a bbox like "left,bottom,right,top"
+    in degrees, or a GeoJSON file or string, which is cropped to its bounds
+
+    Returns:
+        tuple: The region's name, which defaults to the GeoJSON file's name
+            or "roi", and its bbox
+    """
+    from odc.geo.geom import Geometry, unary_union
+
+    if roi.lstrip().startswith("{") or roi.endswith((".json", ".geojson")):
+        if roi.lstrip().startswith("{"):
+            geojson = json.loads(roi)
+        else:
+            geojson = json.loads(Path(roi).read_text())
+            name = name or Path(roi).name.split(".")[0]
+        features = geojson.get("features", [geojson])
+        geometries = [feature.get("geometry", feature) for feature in features]
+        bbox = tuple(
+            unary_union(Geometry(g, crs="EPSG:4326") for g in geometries).boundingbox
+        )
+    else:
+        try:
+            bbox = tuple(float(value) for value in roi.split(","))
+        except ValueError:
+            bbox = ()
+
+    if len(bbox) != 4:
+        raise GHRSSTException(f"Region {roi} must be left,bottom,right,top or GeoJSON")
+    left, bottom, right, top = bbox
+    if not (-180 <= left < right <= 180 and -90 <= bottom < top <= 90):
+        raise GHRSSTException(f"Region {roi} isn't a bbox in degrees")
+
+    return name or "roi", bbox
+
+
+def get_roi_location(
+    output_location: Union[Path, S3Path], roi_name: str
+) -> Union[Path, S3Path]:
+    return output_location / ROI_FOLDER / roi_name
+
+
+def get_roi_slices(geobox: GeoBox, bbox: tuple[float, ...]) -> tuple[slice, slice]:
+    """The rows and columns of the pixels that overlap a bbox"""
+    left, bottom, right, top = bbox
+    inverse = ~geobox.transform
+    col_start, row_start = inverse * (left, top)
+    col_stop, row_stop = inverse * (right, bottom)
+
+    # Allow for floating point error, so edges on pixel edges don't take
+    # in another row or column
+    ny, nx = geobox.shape
+    rows = slice(
+        max(math.floor(row_start + 1e-6), 0), min(math.ceil(row_stop - 1e-6), ny)
+    )
+    cols = slice(
+        max(math.floor(col_start + 1e-6), 0), min(math.ceil(col_stop - 1e-6), nx)
+    )
+    if rows.start >= rows.stop or cols.start >= cols.stop:
+        raise GHRSSTException(f"Region {bbox} doesn't overlap the data")
+
+    return rows, cols
+
+
 def get_input_path(input_location: str, date: datetime) -> str:
     if input_location.upper() == "JPL":
         return JPL_BASE + FILE_STRING.format(date=date)
@@ -127,6 +306,10 @@ def get_input_path(input_location: str, date: datetime) -> str:
         return str(Path(input_location) / FILE_STRING.format(date=date))
 
 
+def get_cache_path(date: datetime) -> Path:
+    return Path("/tmp") / FILE_STRING.format(date=date)
+
+
 def get_headers() -> dict[str, str]:
     """Get the earthdata authorisation headers for the request"""
     earthdata_token = os.environ.get("EARTHDATA_TOKEN", None)
@@ -141,19 +324,18 @@ def get_headers() -> dict[str, str]:
         if os.environ.get("EARTHDATA_USERNAME") is None:
             raise GHRSSTException("Please set EARTHDATA_USERNAME environment variable")
 
-    # If we don't have a token, use the username and password to get one
+    # If we don't have a token, use the username and password to get one,
+    # or reuse the one we got before
     if earthdata_token is None:
-        auth = login(strategy="environment")
-        if auth.authenticated:
-            earthdata_token = get_edl_token()["access_token"]
-        else:
-            raise GHRSSTException("Failed to authenticate with Earthdata")
+        from ghrsst.auth import get_token
+
+        earthdata_token = get_token()
 
     # Return the headers
     return {"Authorization": f"Bearer {earthdata_token}"}
 
 
-def get_simple_raster_info(data: Dataset, var: str):
+def get_simple_raster_info(data: Dataset, var: str, statistics: dict | None = None):
     variable = data[var]
 
     scale = variable.attrs.get("scale_factor")
@@ -171,34 +353,202 @@ def get_simple_raster_info(data: Dataset, var: str):
         meta["offset"] = float(offset)
     if unit is not None:
         meta["unit"] = str(unit)
+    if statistics is not None:
+        meta["statistics"] = statistics
 
     return [meta]
 
 
+def _lazy_statistics(data_var: xr.DataArray) -> dict[str, xr.DataArray]:
+    valid = data_var.where(data_var != data_var.attrs["_FillValue"])
+    return {
+        "count": valid.count(),
+        "minimum": valid.min(),
+        "maximum": valid.max(),
+        "mean": valid.mean(),
+        "stddev": valid.std(),
+    }
+
+
+def _format_statistics(data_var: xr.DataArray, computed: dict) -> dict[str, float]:
+    count = int(computed.pop("count"))
+    statistics = {"valid_percent": round(100 * count / data_var.size, 2)}
+    if count > 0:
+        statistics.update({key: float(value) for key, value in computed.items()})
+
+    return statistics
+
+
+def get_band_statistics(data_var: xr.DataArray) -> dict[str, float]:
+    """Statistics of the stored values of a band, ignoring nodata"""
+    import dask
+
+    # Read a chunk at a time, even if it isn't lazy already
+    (computed,) = dask.compute(_lazy_statistics(data_var.chunk(WRITE_CHUNKS)))
+    return _format_statistics(data_var, computed)
+
+
+def get_projection_info(geobox: GeoBox) -> dict:
+    """The STAC projection properties of a geobox"""
+    left, bottom, right, top = geobox.boundingbox
+    return {
+        "proj:epsg": geobox.crs.epsg,
+        "proj:geometry": _bbox_geometry(left, bottom, right, top),
+        "proj:bbox": [left, bottom, right, top],
+        "proj:shape": list(geobox.shape),
+        "proj:transform": list(geobox.transform),
+    }
+
+
+def _bbox_geometry(left: float, bottom: float, right: float, top: float) -> dict:
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [[left, bottom], [right, bottom], [right, top], [left, top], [left, bottom]]
+        ],
+    }
+
+
+def cache_data(date: datetime, input_location: str, log: Logger = None) -> Path:
+    """Download a date's file to the local cache, resuming if it's partly there"""
+    # Download in parallel parts, straight to disk
+    from ghrsst.download import download_file, get_md5
+
+    input_path = get_input_path(input_location, date)
+    cache_path = get_cache_path(date)
+    headers, md5 = None, None
+    if input_location.upper() == "JPL":
+        headers = get_headers()
+        md5 = get_md5(input_path, headers)
+    try:
+        download_file(input_path, cache_path, headers=headers, md5=md5, log=log)
+    except ClientResponseError as e:
+        raise GHRSSTException(
+            f"Failed to download {input_path} with error {e}. Please check your EARTHDATA_TOKEN."
+        )
+
+    return cache_path
+
+
+def _is_memmap(data_var: xr.DataArray) -> bool:
+    return isinstance(data_var.variable._data, np.memmap)
+
+
+def memmap_data(
+    data: Dataset,
+    variables: list[str] | None = None,
+    folder: Path = MEMMAP_FOLDER,
+) -> Dataset:
+    """Decode variables once into memory-mapped files, so they're held in
+    the page cache rather than in the memory of the process
+
+    Each is stored north-up and given back as a view in the file's order,
+    so flipping it in process_data gives the contiguous array. The files
+    are removed as soon as they're mapped, so their space is freed with
+    the data.
+
+    Args:
+        variables (list[str]): Only decode these variables. The others are
+            left as they are.
+    """
+    if variables is None:
+        variables = list(data.data_vars)
+
+    mapped = {}
+    for var in variables:
+        if var not in data.data_vars:
+            continue
+        source = data[var]
+        axis = source.get_axis_num("lat")
+        size = source.sizes["lat"]
+        chunks = source.encoding.get("chunksizes")
+        step = chunks[axis] if chunks else MEMMAP_ROWS
+
+        with NamedTemporaryFile(dir=folder, prefix=f"{var}-", suffix=".raw") as f:
+            array = np.memmap(f, dtype=source.dtype, mode="w+", shape=source.shape)
+
+        index = [slice(None)] * source.ndim
+        for start in range(0, size, step):
+            stop = min(start + step, size)
+            index[axis] = slice(size - stop, size - start)
+            rows = source.isel(lat=slice(start, stop)).values
+            array[tuple(index)] = np.flip(rows, axis)
+
+        index[axis] = slice(None, None, -1)
+        mapped[var] = source.copy(data=array[tuple(index)])
+
+    return data.assign(mapped)
+
+
 def load_data(
-    date: datetime, input_location: Path, cache_local: bool = False, log: Logger = None
+    date: datetime,
+    input_location: Path,
+    cache_local: bool = False,
+    log: Logger = None,
+    range_read: bool = False,
+    references_location: Union[Path, S3Path, None] = None,
+    metrics: Metrics | None = None,
+    variables: list[str] | None = None,
+    memmap: bool = False,
 ) -> Dataset:
+    """Open a date's data
+
+    Args:
+        variables (list[str]): Only read these variables. The others are
+            still there, but only for their metadata. With none, nothing is
+            downloaded, even when caching locally.
+        memmap (bool): Decode the variables into memory-mapped files with
+            memmap_data, rather than reading them lazily or into memory.
+    """
     input_path = get_input_path(input_location, date)
 
-    if cache_local:
+    if range_read:
+        # Lazily read only the chunks of the variables we need
+        from ghrsst.reader import open_ranged
+
+        headers = None
+        if input_location.upper() == "JPL":
+            headers = get_headers()
+        try:
+            data = open_ranged(
+                date,
+                input_location,
+                references_location=references_location,
+                headers=headers,
+                log=log,
+            )
+        except ClientResponseError as e:
+            raise GHRSSTException(
+                f"Failed to open {input_path} with error {e}. Please check your EARTHDATA_TOKEN."
+            )
+    elif cache_local and variables != []:
         log.info(f"Caching {input_path} locally")
-        cache_path = Path("/tmp") / FILE_STRING.format(date=date)
-        with fsspec.open(input_path, headers=get_headers()) as f:
-            with cache_path.open("wb") as cache_f:
-                cache_f.write(f.read())
+        with stage(metrics, "download"):
+            cache_path = cache_data(date, input_location, log=log)
         data = xr.open_dataset(
             cache_path, chunks={}, mask_and_scale=False, drop_variables=DROP_VARIABLES
         )
     elif input_location.upper() == "JPL":
-        # Open the file
+        # Open the file, through the session shared by every date
+        from ghrsst.session import get_http_filesystem
+
         try:
-            with fsspec.open(input_path, headers=get_headers()) as f:
+            with get_http_filesystem(get_headers()).open(input_path, "rb") as f:
                 data = xr.open_dataset(
                     f,
                     mask_and_scale=False,
                     drop_variables=DROP_VARIABLES,
                     engine="h5netcdf",
-                ).load()
+                )
+                if memmap:
+                    # The rest can't be read once the file is closed
+                    data = memmap_data(data, variables)
+                elif variables is None:
+                    data = data.load()
+                else:
+                    # The rest can't be read once the file is closed
+                    needed = [var for var in variables if var in data.data_vars]
+                    data = data.assign(data[needed].load().data_vars)
         except ClientResponseError as e:
             raise GHRSSTException(
                 f"Failed to open {input_path} with error {e}. Please check your EARTHDATA_TOKEN."
@@ -211,20 +561,37 @@ def load_data(
             input_path, mask_and_scale=False, drop_variables=DROP_VARIABLES
         )
 
+    needed = data.data_vars if variables is None else variables
+    if memmap and not all(_is_memmap(data[var]) for var in needed if var in data):
+        data = memmap_data(data, variables)
+
     return data
 
 
-def process_data(data: Dataset) -> Dataset:
+def process_data(data: Dataset, bbox: tuple[float, ...] | None = None) -> Dataset:
+    """Put the data on a precise north-up grid, with SST in celsius
+
+    Args:
+        bbox (tuple): Crop to the pixels that overlap this left, bottom,
+            right, top. On lazy data, only the chunks in it are read.
+    """
     # Assign the CRS
     data = assign_crs(data, crs="EPSG:4326")
 
     # Set up a new Affine and GeoBox
     new_affine = Affine(0.01, 0.0, -179.995, 0.0, -0.01, 89.995, 0.0, 0.0, 1.0)
     new_geobox = GeoBox(data.odc.geobox.shape, new_affine, data.odc.geobox.crs)
-    new_coords = xr_coords(new_geobox)
 
-    # First flip the dataset vertically
-    data = data.reindex(lat=data.lat[::-1])
+    # First flip the dataset vertically. Use a negative stride, which is a
+    # view on loaded data and lazy on dask data, rather than reindexing,
+    # which makes a copy of every variable
+    data = data.isel(lat=slice(None, None, -1))
+
+    if bbox is not None:
+        rows, cols = get_roi_slices(new_geobox, bbox)
+        data = data.isel(lat=rows, lon=cols)
+        new_geobox = new_geobox[rows, cols]
+    new_coords = xr_coords(new_geobox)
 
     # Update the coordinates of the xarray to be precise
     data = data.assign_coords(new_coords)
@@ -244,123 +611,630 @@ def process_data(data: Dataset) -> Dataset:
     return data
 
 
+def _gdal_band_metadata(data_var: xr.DataArray, sample: int = 0) -> list[str]:
+    """Scale, offset and units as GDAL metadata items, matching what GDAL writes"""
+    items = []
+    offset = data_var.attrs.get("add_offset")
+    scale = data_var.attrs.get("scale_factor")
+    units = data_var.attrs.get("units")
+
+    if offset is not None:
+        items.append(
+            f'<Item name="OFFSET" sample="{sample}" role="offset">{offset:.18g}</Item>'
+        )
+    if scale is not None:
+        items.append(
+            f'<Item name="SCALE" sample="{sample}" role="scale">{scale:.18g}</Item>'
+        )
+    if units is not None:
+        items.append(
+            f'<Item name="UNITTYPE" sample="{sample}" role="unittype">{units}</Item>'
+        )
+
+    return items
+
+
+def check_layout_and_profile(layout: str, profile: str) -> None:
+    """Fail early on a layout or profile that write_data would reject"""
+    if layout not in LAYOUTS:
+        raise GHRSSTException(f"Unknown layout {layout}, must be one of {LAYOUTS}")
+    if profile not in COG_PROFILES:
+        raise GHRSSTException(
+            f"Unknown profile {profile}, must be one of {list(COG_PROFILES)}"
+        )
+
+
+def get_cog_options(
+    bands: list[xr.DataArray], profile: str = DEFAULT_PROFILE
+) -> dict[str, Any]:
+    """Options for writing a COG of some bands, for either of odc-geo's writers"""
+    if profile not in COG_PROFILES:
+        raise GHRSSTException(
+            f"Unknown profile {profile}, must be one of {list(COG_PROFILES)}"
+        )
+
+    dtype = bands[0].dtype
+    options = dict(compress="zstd", **COG_PROFILES[profile])
+    options["predictor"] = PREDICTORS.get(profile, {}).get(
+        dtype.name, 3 if dtype.kind == "f" else 2
+    )
+    if any("flag_masks" in band.attrs for band in bands):
+        # Averaging flags would make up flags that aren't there
+        options["overview_resampling"] = "nearest"
+
+    return options
+
+
+def encode_cog(
+    bands: list[xr.DataArray], geobox: GeoBox, profile: str = DEFAULT_PROFILE
+) -> bytes:
+    """Encode loaded bands as a COG in memory, with GDAL"""
+    # Use the private method, forcing the geobox. The public method,
+    # odc.geo.cog.write_cog, does _NOT_ write the correct geotransform...
+    # TODO: report and resolve.
+    from odc.geo.cog._rio import _get_gdal_metadata, _write_cog
+
+    pixels = bands[0]
+    if len(bands) > 1:
+        pixels = xr.concat([band.isel(time=0) for band in bands], dim="band")
+
+    gdal_metadata = _get_gdal_metadata(bands, {})
+    # Each band needs a value, so use GDAL's defaults for bands without one
+    for key, default in (("scales", 1.0), ("offsets", 0.0), ("units", "")):
+        if key in gdal_metadata:
+            gdal_metadata[key] = [
+                default if value is None else value for value in gdal_metadata[key]
+            ]
+
+    return _write_cog(
+        pixels,
+        geobox,
+        ":mem:",
+        nodata=bands[0].attrs.get("nodata"),
+        gdal_metadata=gdal_metadata,
+        # Compress blocks on every core
+        num_threads="ALL_CPUS",
+        **get_cog_options(bands, profile),
+    )
+
+
+def _stream_cog(
+    bands: list[xr.DataArray],
+    geobox: GeoBox,
+    cog_file: Union[Path, S3Path],
+    statistics: bool = False,
+    profile: str = DEFAULT_PROFILE,
+) -> list[dict[str, float]] | None:
+    """Encode a COG chunk by chunk, and write it as a multipart upload
+
+    Only a few rows of dask chunks are held in memory at once, rather than
+    the whole raster and its overviews. With statistics, they're computed
+    in the same pass over the chunks and returned for each band.
+    """
+    import dask
+    import dask.array as da
+    from odc.geo.cog import save_cog_with_dask
+    from odc.geo.cog._mpu import mpu_write
+    from odc.geo.cog._mpu_fs import MPUFileSink
+    from odc.geo.cog._s3 import S3MultiPartUpload
+    from odc.geo.cog._tifffile import _patch_hdr
+
+    if len(bands) == 1:
+        pixels = bands[0].isel(time=0).data
+    else:
+        # Bands go last for save_cog_with_dask
+        pixels = da.stack([band.isel(time=0).data for band in bands], axis=-1)
+
+    # Force the geobox, the same as we do for _write_cog
+    pixels = wrap_xr(pixels, geobox, nodata=bands[0].attrs.get("nodata"))
+
+    # Prepare the header and the tiles, but don't write them yet, so that
+    # we can include the scale, offset and units in the GDAL metadata
+    cog = save_cog_with_dask(pixels, "", **get_cog_options(bands, profile))
+    tiles = cog["tiles"][::-1]
+    user_kw = {
+        "meta": cog["meta"],
+        "hdr0": cog["hdr0"],
+        "stats": cog["_stats"],
+        "gdal_metadata_extra": [
+            item
+            for sample, band in enumerate(bands)
+            for item in _gdal_band_metadata(band, sample)
+        ],
+    }
+
+    if _is_s3_path(cog_file):
+        # S3MultiPartUpload.upload passes these arguments on to
+        # create_multipart_upload, so use its writer directly
+        uploader = S3MultiPartUpload(cog_file.bucket, cog_file.key)
+        sink = uploader.writer({})
+    else:
+        sink = MPUFileSink(cog_file)
+
+    upload = mpu_write(tiles, sink, mk_header=_patch_hdr, user_kw=user_kw)
+
+    if not statistics:
+        upload.compute()
+        return None
+
+    # Share the reads of each chunk between the upload and the statistics
+    _, computed = dask.compute(upload, [_lazy_statistics(band) for band in bands])
+    return [_format_statistics(band, c) for band, c in zip(bands, computed)]
+
+
+def _write_variable(
+    data: Dataset,
+    var: str,
+    cog_file: Union[Path, S3Path],
+    log: Logger | None = None,
+    stream: bool = False,
+    statistics: dict | None = None,
+    metrics: Metrics | None = None,
+    geobox: GeoBox | None = None,
+    bands: list[str] | None = None,
+    profile: str = DEFAULT_PROFILE,
+) -> Tuple[str, Union[Path, S3Path]]:
+    """Write a variable to a COG, or with bands, write those variables as
+    the bands of one COG called var
+    """
+    if geobox is None:
+        geobox = data.odc.geobox
+    if bands is None:
+        bands = [var]
+
+    data_vars = []
+    for band in bands:
+        data_var = data[band]
+        # Rename to GDAL/ODC standard names
+        data_var.attrs["scales"] = data_var.attrs.get("scale_factor")
+        data_var.attrs["offsets"] = data_var.attrs.get("add_offset")
+        data_var.attrs["units"] = data_var.attrs.get("units")
+        data_var.attrs["nodata"] = data_var.attrs.get("_FillValue")
+        data_vars.append(data_var)
+
+    cog_path_str = str(cog_file)
+    if not _is_s3_path(cog_file.parent):
+        cog_file.parent.mkdir(parents=True, exist_ok=True)
+    else:
+        cog_path_str = f"s3:/{cog_file}"
+
+    if log is not None:
+        log.info(f"Writing {var} to {cog_path_str}")
+
+    if stream:
+        # Stream direct to S3, one chunk at a time
+        with stage(metrics, "stream", var):
+            band_statistics = _stream_cog(
+                data_vars,
+                geobox,
+                cog_file,
+                statistics=statistics is not None,
+                profile=profile,
+            )
+    else:
+        if statistics is not None:
+            # The COG is built from the whole array anyway, so load it once
+            # and compute the statistics from the same chunks
+            with stage(metrics, "statistics", var):
+                data_vars = [data_var.persist() for data_var in data_vars]
+                band_statistics = [get_band_statistics(dv) for dv in data_vars]
+
+        with stage(metrics, "encode", var):
+            cog_bytes = encode_cog(data_vars, geobox, profile)
+        with stage(metrics, "upload", var):
+            _write_bytes(cog_file, cog_bytes)
+
+    if statistics is not None:
+        statistics.update(zip(bands, band_statistics))
+
+    if log is not None:
+        log.info(f"Finished writing {var}")
+
+    return var, cog_file
+
+
+def get_band_groups(data: Dataset) -> dict[str, list[str]]:
+    """Group the variables by data type, for the multiband layout"""
+    groups = {}
+    for var in data.data_vars:
+        groups.setdefault(data[var].dtype.name, []).append(var)
+
+    return groups
+
+
+def plan_outputs(
+    date: datetime,
+    output_location: Union[Path, S3Path],
+    existing: set[str],
+    layout: str = "single",
+    coarse: bool = False,
+) -> list[str]:
+    """The variables that still have a COG to write, going by the names of
+    the files that exist, so they can be found before opening the data
+    """
+    if layout == "multiband":
+        outputs = {}
+        for var in VARIABLES:
+            outputs.setdefault(VARIABLE_TYPES[var], []).append(var)
+    else:
+        outputs = {var: [var] for var in VARIABLES}
+    if coarse:
+        # Coarse products are a COG per variable, whatever the layout
+        for name in COARSE_PRODUCTS:
+            outputs.update({f"{var}_{name}": [var] for var in VARIABLES})
+
+    missing = set()
+    for key, variables in outputs.items():
+        if get_output_path(output_location, date, f"_{key}.tif").name not in existing:
+            missing.update(variables)
+
+    return [var for var in VARIABLES if var in missing]
+
+
+def _pad_to_blocks(array: xr.DataArray, factor: int, value) -> xr.DataArray:
+    # Pad up to a whole number of blocks, so the edges aren't dropped
+    pad = {dim: (0, -array.sizes[dim] % factor) for dim in ("lat", "lon")}
+    return array.pad(pad, constant_values=value)
+
+
+def _block_sum(array: xr.DataArray, factor: int) -> xr.DataArray:
+    return _pad_to_blocks(array, factor, 0).coarsen(lat=factor, lon=factor).sum()
+
+
+def get_coarse_geobox(geobox: GeoBox, factor: int) -> GeoBox:
+    """The geobox of a product with blocks of factor by factor pixels"""
+    ny, nx = geobox.shape
+    shape = (-(-ny // factor), -(-nx // factor))
+    return GeoBox(shape, geobox.transform * Affine.scale(factor), geobox.crs)
+
+
+def coarsen_data(
+    data: Dataset, products: dict[str, int] = COARSE_PRODUCTS
+) -> dict[str, Dataset]:
+    """Make coarser copies of the data, with the mean of each block of pixels
+
+    Nodata pixels are left out of the means, and a block that's all nodata
+    is nodata. The sums and counts for each product are built from the
+    previous one, and everything is computed together, so the data is only
+    read once. Categorical variables, which have no scale factor, take the
+    value at the centre of each block instead.
+    """
+    import dask
+
+    geobox = data.odc.geobox
+    data = data.drop_vars([name for name in data.coords if name != "time"])
+
+    coarse = {name: {} for name in products}
+    for var in data.data_vars:
+        data_var = data[var]
+        fill = data_var.attrs["_FillValue"]
+
+        if "scale_factor" not in data_var.attrs:
+            for name, factor in products.items():
+                centre = slice(factor // 2, None, factor)
+                padded = _pad_to_blocks(data_var, factor, fill)
+                coarse[name][var] = padded.isel(lat=centre, lon=centre)
+            continue
+
+        valid = data_var != fill
+        total = xr.where(valid, data_var, 0).astype("int64")
+        count = valid.astype("int64")
+        previous = 1
+        for name, factor in products.items():
+            total = _block_sum(total, factor // previous)
+            count = _block_sum(count, factor // previous)
+            previous = factor
+
+            mean = (total / count.where(count > 0)).round()
+            coarse[name][var] = mean.fillna(fill).astype(data_var.dtype)
+
+    (coarse,) = dask.compute(coarse)
+
+    datasets = {}
+    for name, factor in products.items():
+        coarse_geobox = get_coarse_geobox(geobox, factor)
+        dataset = Dataset(coarse[name]).assign_coords(
+            xr_coords(coarse_geobox, dims=("lat", "lon"))
+        )
+        for var in dataset.data_vars:
+            dataset[var].attrs = dict(data[var].attrs)
+        datasets[name] = assign_crs(dataset, crs=geobox.crs)
+
+    return datasets
+
+
 def write_data(
     data: Dataset,
     date: datetime,
     output_location: Union[Path, S3Path],
     overwrite: bool = False,
     log: Logger | None = None,
+    workers: int = 1,
+    stream: bool = False,
+    existing: set[str] | None = None,
+    statistics: dict | None = None,
+    metrics: Metrics | None = None,
+    coarse: bool = False,
+    layout: str = "single",
+    profile: str = DEFAULT_PROFILE,
 ):
+    """Write each data variable out as a COG
+
+    Args:
+        workers (int): Number of variables to encode and upload at once. GDAL
+            releases the GIL while encoding, so threads give real concurrency,
+            and each upload overlaps with the encoding of the next variable.
+        stream (bool): Encode each COG block by block from the dask chunks and
+            write it as a multipart upload, rather than building it in memory.
+        existing (set[str]): Names of the files already in the date's folder,
+            if they've been listed already.
+        statistics (dict): If given, filled with the statistics of each band
+            that's written, keyed by variable name.
+        metrics (Metrics): If given, records how long each variable takes
+            to encode and upload.
+        coarse (bool): Also write the COARSE_PRODUCTS of each variable, named
+            like analysed_sst_0p05.
+        layout (str): Either "single", for a COG per variable, or
+            "multiband", for a COG per data type with the variables as bands,
+            named like _int16.tif.
+        profile (str): Which of the COG_PROFILES to encode with.
+    """
+    if layout not in LAYOUTS:
+        raise GHRSSTException(f"Unknown layout {layout}, must be one of {LAYOUTS}")
+
     if not _is_s3_path(output_location):
         if not output_location.exists():
             output_location.mkdir(parents=True)
 
-    data = data.chunk({"time": 1, "lat": 500, "lon": 500})
+    chunked = data.chunk(WRITE_CHUNKS)
+    if not stream:
+        # GDAL reads memory-mapped variables from the page cache, where
+        # dask would gather a copy of them into memory
+        mapped = [var for var in data.data_vars if _is_memmap(data[var])]
+        chunked = chunked.assign({var: data[var] for var in mapped})
+    data = chunked
+
+    if existing is None and not overwrite:
+        folder = get_output_path(output_location, date, ".tif").parent
+        existing = list_existing(folder)
+
+    if layout == "multiband":
+        outputs = get_band_groups(data)
+    else:
+        outputs = {var: None for var in data.data_vars}
 
     written_files = []
-    for var in data.data_vars:
-        cog_file = get_output_path(output_location, date, f"_{var}.tif")
+    to_write = []
+    for key, bands in outputs.items():
+        cog_file = get_output_path(output_location, date, f"_{key}.tif")
 
-        if _exists(cog_file) and not overwrite:
-            log.info(f"Skipping {var} as it already exists")
-            written_files.append((var, cog_file))
+        if not overwrite and cog_file.name in existing:
+            log.info(f"Skipping {key} as it already exists")
+            written_files.append((key, cog_file))
             continue
 
-        data_var = data[var]
-        # Rename to GDAL/ODC standard names
-        data_var.attrs["scales"] = data_var.attrs.get("scale_factor")
-        data_var.attrs["offsets"] = data_var.attrs.get("add_offset")
-        data_var.attrs["units"] = data_var.attrs.get("units")
-        data_var.attrs["nodata"] = data_var.attrs.get("_FillValue")
-
-        cog_path_str = str(cog_file)
-        if not _is_s3_path(cog_file.parent):
-            cog_file.parent.mkdir(parents=True, exist_ok=True)
-        else:
-            cog_path_str = f"s3:/{cog_file}"
+        to_write.append((key, cog_file, bands))
+
+    if workers > 1 and len(to_write) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _write_variable,
+                    data,
+                    key,
+                    cog_file,
+                    log,
+                    stream,
+                    statistics,
+                    metrics,
+                    bands=bands,
+                    profile=profile,
+                )
+                for key, cog_file, bands in to_write
+            ]
+            written_files += [future.result() for future in futures]
+    else:
+        for key, cog_file, bands in to_write:
+            written_files.append(
+                _write_variable(
+                    data,
+                    key,
+                    cog_file,
+                    log,
+                    stream,
+                    statistics,
+                    metrics,
+                    bands=bands,
+                    profile=profile,
+                )
+            )
 
-        log.info(f"Writing {var} to {cog_path_str}")
+    # Keep the order of the variables in the dataset
+    order = list(outputs)
+    written_files.sort(key=lambda written: order.index(written[0]))
 
-        # Stream direct to S3
-        # cog = save_cog_with_dask(data_var, cog_path_str, **COG_OPTS)
-        # cog.compute()
-
-        # Use the public method. This does _NOT_ write the correct
-        # geotransform... TODO: report and resolve.
-        # from odc.geo.cog import write_cog
-        # cog_file.write_bytes(write_cog(data_var, ":mem:", **COG_OPTS))
-
-        # Use the private method, forcing the geobox
-        from odc.geo.cog._rio import _get_gdal_metadata, _write_cog
-        cog_file.write_bytes(
-            _write_cog(
-                data_var,
-                data.odc.geobox,
-                ":mem:",
-                nodata=data_var.attrs.get("nodata"),
-                gdal_metadata=_get_gdal_metadata(data_var, {}),
-                **COG_OPTS,
-            )
+    if coarse:
+        written_files += _write_coarse(
+            data, date, output_location, overwrite, log, existing, metrics, profile
         )
 
-        if log is not None:
-            log.info(f"Finished writing {var}")
+    return written_files
+
 
-        written_files.append((var, cog_file))
+def _write_coarse(
+    data: Dataset,
+    date: datetime,
+    output_location: Union[Path, S3Path],
+    overwrite: bool = False,
+    log: Logger | None = None,
+    existing: set[str] | None = None,
+    metrics: Metrics | None = None,
+    profile: str = DEFAULT_PROFILE,
+):
+    to_write = []
+    written_files = []
+    for name in COARSE_PRODUCTS:
+        for var in data.data_vars:
+            cog_file = get_output_path(output_location, date, f"_{var}_{name}.tif")
+            if not overwrite and cog_file.name in existing:
+                log.info(f"Skipping {var}_{name} as it already exists")
+                written_files.append((f"{var}_{name}", cog_file))
+            else:
+                to_write.append((name, var, cog_file))
+
+    if not to_write:
+        return written_files
+
+    # Only coarsen the variables with something left to write
+    left = {var for _, var, _ in to_write}
+    variables = [var for var in data.data_vars if var in left]
+    with stage(metrics, "coarsen"):
+        coarse = coarsen_data(data[variables].chunk(WRITE_CHUNKS))
+
+    # These are small, so write them one after another. The geobox is given,
+    # as the one from the coordinates can be off by floating point error
+    for name, var, cog_file in to_write:
+        geobox = get_coarse_geobox(data.odc.geobox, COARSE_PRODUCTS[name])
+        _write_variable(
+            coarse[name],
+            var,
+            cog_file,
+            log,
+            metrics=metrics,
+            geobox=geobox,
+            profile=profile,
+        )
+        written_files.append((f"{var}_{name}", cog_file))
 
     return written_files
 
 
-def write_stac(
+def create_item(
     data: Dataset,
     written_files: Tuple[Tuple[str, Path]],
     date: datetime,
-    output_location: Union[Path, S3Path],
-    log: Logger | None = None
+    stac_id: str,
+    geobox: GeoBox | None = None,
+    statistics: dict | None = None,
+    end_date: datetime | None = None,
 ) -> Item:
-    stac_file = get_output_path(output_location, date, ".stac-item.json")
+    """Build a STAC item from what we already know about the data in memory
+
+    Args:
+        data (Dataset): Dataset to describe the bands of
+        written_files: Pairs of variable name and the COG it was written to
+        geobox (GeoBox): Geobox of the COGs, if it isn't the data's own
+        statistics (dict): Statistics for each band, keyed by variable name
+        end_date (datetime): Last day the data covers, if it's more than one
+    """
+    if geobox is None:
+        geobox = data.odc.geobox
+    if statistics is None:
+        statistics = {}
+
+    left, bottom, right, top = geobox.geographic_extent.boundingbox
+    properties = {
+        "start_datetime": f"{date:%Y-%m-%d}T00:00:00Z",
+        "end_datetime": f"{end_date or date:%Y-%m-%d}T23:59:59Z",
+        **get_projection_info(geobox),
+    }
+
+    item = Item(
+        id=stac_id,
+        geometry=_bbox_geometry(left, bottom, right, top),
+        bbox=[left, bottom, right, top],
+        datetime=date,
+        properties=properties,
+        stac_extensions=list(STAC_EXTENSIONS),
+        collection=COLLECTION,
+    )
+    item.add_link(
+        Link(rel=RelType.COLLECTION, target=COLLECTION, media_type=MediaType.JSON)
+    )
 
-    first_item = written_files[0][1]
-    href = _get_href(first_item)
-
-    log.info(f"Writing STAC based on {href}")
-
-    item = create_stac_item(
-        href,
-        id=stac_file.stem,
-        collection="ghrsst-mur-v2",
-        input_datetime=date,
-        with_proj=True,
-        with_raster=True,
-        properties={
-            "start_datetime": f"{date:%Y-%m-%d}T00:00:00Z",
-            "end_datetime": f"{date:%Y-%m-%d}T23:59:59Z",
-        },
-        assets={
-            var: Asset(
+    band_groups = get_band_groups(data)
+    for key, file in written_files:
+        var, _, product = key.rpartition("_")
+        if product not in COARSE_PRODUCTS:
+            var, product = key, None
+
+        if var in data.data_vars:
+            raster_bands = get_simple_raster_info(data, var, statistics.get(key))
+            title = key
+        else:
+            # A multiband COG, with a band for each variable of a data type
+            raster_bands = [
+                dict(get_simple_raster_info(data, band, statistics.get(band))[0])
+                | {"name": band}
+                for band in band_groups[var]
+            ]
+            title = ", ".join(band_groups[var])
+
+        extra_fields = {"raster:bands": raster_bands}
+        roles = ["data"]
+        if product is not None:
+            # Coarse products have their own grid
+            coarse_geobox = get_coarse_geobox(geobox, COARSE_PRODUCTS[product])
+            extra_fields["proj:shape"] = list(coarse_geobox.shape)
+            extra_fields["proj:transform"] = list(coarse_geobox.transform)
+            roles = ["overview"]
+
+        item.add_asset(
+            key,
+            Asset(
                 href=_get_href(file),
-                title=var,
+                title=title,
                 media_type=MediaType.COG,
-                roles=["data"],
-                extra_fields={"raster:bands": get_simple_raster_info(data, var)},
-            )
-            for var, file in written_files
-        },
+                roles=roles,
+                extra_fields=extra_fields,
+            ),
+        )
+
+    return item
+
+
+def write_stac(
+    data: Dataset,
+    written_files: Tuple[Tuple[str, Path]],
+    date: datetime,
+    output_location: Union[Path, S3Path],
+    log: Logger | None = None,
+    geobox: GeoBox | None = None,
+    statistics: dict | None = None,
+    roi_name: str | None = None,
+    end_date: datetime | None = None,
+) -> Item:
+    stac_file = get_output_path(output_location, date, ".stac-item.json")
+    # Regional items get their own ids, so they don't clash with the global ones
+    stac_id = stac_file.stem if roi_name is None else f"{stac_file.stem}_{roi_name}"
+
+    if log is not None:
+        log.info(f"Writing STAC for {len(written_files)} assets to {stac_file.name}")
+
+    item = create_item(
+        data,
+        written_files,
+        date,
+        stac_id,
+        geobox=geobox,
+        statistics=statistics,
+        end_date=end_date,
     )
 
-    item.add_link(
-        Link(
-            rel=RelType.CANONICAL,
-            target=get_input_path("JPL", date),
-            media_type=MediaType.NETCDF,
-            title="Original NetCDF",
+    if end_date is None:
+        item.add_link(
+            Link(
+                rel=RelType.CANONICAL,
+                target=get_input_path("JPL", date),
+                media_type=MediaType.NETCDF,
+                title="Original NetCDF",
+            )
         )
-    )
 
     if _is_s3_path(output_location):
         # Assume we're writing to source.coop
         item.set_self_href(_get_href(stac_file))
-        s3 = boto3.client("s3")
+        s3 = get_s3_client()
         s3.put_object(
             Bucket=stac_file.bucket,
             Key=stac_file.key,
@@ -403,118 +1277,434 @@ def process_date(
     overwrite: bool = False,
     cache_local: bool = False,
     log: logging.Logger = None,
-):
+    workers: int = 1,
+    stream: bool = False,
+    range_read: bool = False,
+    references_location: Union[Path, S3Path, None] = None,
+    statistics: bool = False,
+    metrics_file: str | None = None,
+    coarse: bool = False,
+    layout: str = "single",
+    cube: bool = False,
+    profile: str = DEFAULT_PROFILE,
+    roi: tuple[str, tuple[float, ...]] | None = None,
+    aggregate: bool = False,
+    memmap: bool = False,
+) -> bool:
     """Process a date from a data source and output to a location
 
     Args:
         date (datetime): Date to process
         input_location (str): Either 'jpl' to grab data from JPL, or a local folder to find the data in
         output_location (str): Location to output results to
+        workers (int): Number of variables to write concurrently
+        stream (bool): Stream COGs out chunk by chunk instead of in memory
+        range_read (bool): Read only the chunks we need with ranged requests
+        references_location (str): Location to keep kerchunk references in
+        statistics (bool): Include band statistics in the STAC item
+        metrics_file (str): File to append stage metrics to, as CloudWatch
+            Embedded Metric Format JSON lines. They're printed if not given.
+        coarse (bool): Also write coarser 0.05 and 0.25 degree products
+        layout (str): "single" for a COG per variable, or "multiband" for a
+            COG per data type with a band per variable
+        cube (bool): Also stage the date for the time-series Zarr cube,
+            for rechunk to fold it in
+        profile (str): Which of the COG_PROFILES to encode with
+        roi (tuple): The name and bbox of a region to crop to, from get_roi.
+            It's written to its own folder, from get_roi_location.
+        aggregate (bool): Also add the date to the running weekly, monthly
+            and climatology sums, and write the products derived from them
+        memmap (bool): Decode the data into memory-mapped files on local
+            disk, so the page cache holds it rather than the process
+
+    Returns:
+        bool: Whether the date was processed, rather than skipped as it
+            already exists
     """
     if log is None:
         log = get_logger()
+    check_layout_and_profile(layout, profile)
+
+    roi_name, bbox = roi if roi is not None else (None, None)
+    if roi is not None:
+        output_location = get_roi_location(output_location, roi_name)
 
     log.info(
         f"Processing date {date:%Y-%m-%d} from {input_location} to {output_location}"
     )
 
-    log.info(f"Overwrite: {overwrite}, Cache Local: {cache_local}")
+    log.info(
+        f"Overwrite: {overwrite}, Cache Local: {cache_local}, "
+        f"Workers: {workers}, Stream: {stream}, Range Read: {range_read}, "
+        f"Statistics: {statistics}, Coarse: {coarse}, Layout: {layout}, "
+        f"Cube: {cube}, Profile: {profile}, Region: {roi}, Aggregate: {aggregate}, "
+        f"Memmap: {memmap}"
+    )
 
     # Switch up our environment, in case we need to work on source.coop
     context = get_context()
+    metrics = Metrics(date, metrics_file)
 
-    with environ(context):
+    with environ(context), stage(metrics, "process_date"):
         # Check if we've done this date already
         stac_file = get_output_path(output_location, date, ".stac-item.json")
-        if _exists(stac_file) and not overwrite:
+        with stage(metrics, "list_existing"):
+            existing = set() if overwrite else list_existing(stac_file.parent)
+        if stac_file.name in existing:
             log.info(f"Skipping {date:%Y-%m-%d} as it already exists")
+            # It may have been prefetched before it was found to exist
+            if cache_local and not range_read:
+                get_cache_path(date).unlink(missing_ok=True)
+            return False
         else:
+            # Only read the variables that have a COG left to write, so a
+            # retry doesn't redo the ones that finished. The cube and the
+            # aggregates need them all.
+            variables = None
+            if not overwrite and not cube and not aggregate:
+                with stage(metrics, "plan_outputs"):
+                    variables = plan_outputs(
+                        date, output_location, existing, layout, coarse
+                    )
+                log.info(f"Variables left to write: {variables}")
+
             input_path = get_input_path(input_location, date)
             log.info(f"Loading data from {input_path}")
-            data = load_data(date, input_location, cache_local=cache_local, log=log)
+            with stage(metrics, "load_data"):
+                data = load_data(
+                    date,
+                    input_location,
+                    cache_local=cache_local,
+                    log=log,
+                    range_read=range_read,
+                    references_location=references_location,
+                    metrics=metrics,
+                    variables=variables,
+                    memmap=memmap,
+                )
 
             log.info("Processing data...")
-            processed = process_data(data)
+            with stage(metrics, "process_data"):
+                processed = process_data(data, bbox)
+            band_statistics = {} if statistics else None
 
             if _is_s3_path(output_location):
                 log.info(f"Writing data to s3:/{output_location}")
             else:
                 log.info(f"Writing data to {output_location}")
-            written_files = write_data(
-                processed, date, output_location, overwrite, log=log
-            )
+            with stage(metrics, "write_data"):
+                written_files = write_data(
+                    processed,
+                    date,
+                    output_location,
+                    overwrite,
+                    log=log,
+                    workers=workers,
+                    stream=stream,
+                    existing=existing,
+                    statistics=band_statistics,
+                    metrics=metrics,
+                    coarse=coarse,
+                    layout=layout,
+                    profile=profile,
+                )
+
+            if cube:
+                from ghrsst.cube import append_date
+
+                log.info("Staging for the cube")
+                with stage(metrics, "append_cube"):
+                    append_date(processed, date, output_location, log=log)
+
+            if aggregate:
+                from ghrsst.aggregate import aggregate_date
+
+                log.info("Aggregating")
+                with stage(metrics, "aggregate"):
+                    aggregate_date(
+                        processed, date, output_location, log=log, profile=profile
+                    )
 
             log.info("Writing STAC")
-            stac_doc = write_stac(data, written_files, date, output_location, log=log)
-
-            # Cleanup
-            if cache_local:
+            with stage(metrics, "write_stac"):
+                stac_doc = write_stac(
+                    data,
+                    written_files,
+                    date,
+                    output_location,
+                    log=log,
+                    geobox=processed.odc.geobox,
+                    statistics=band_statistics,
+                    roi_name=roi_name,
+                )
+
+            # Record the date as done, so it isn't queued again
+            from ghrsst.index import mark_done
+
+            with stage(metrics, "mark_done"):
+                mark_done(output_location, date, log=log)
+
+            # Cleanup. There's nothing cached if there was nothing to write.
+            if cache_local and not range_read:
                 log.info("Cleaning up cache")
-                cache_path = Path("/tmp") / FILE_STRING.format(date=date)
-                cache_path.unlink()
+                get_cache_path(date).unlink(missing_ok=True)
 
             log.info(f"Finished writing to: {stac_doc.self_href}")
 
+    return True
+
+
+def lambda_handler(event, lambda_context):
+    """Process a batch of dates from SQS, one after another
 
-def lambda_handler(event, _):
+    The next date's file is downloaded while the current one is written, when
+    caching locally. Dates that fail are reported back as batchItemFailures,
+    so that SQS only retries those.
+    """
     # Set up a tidy logger, but try to use the AWS way of logging
     log = LOGGER
     log.info(f"Event: {event}")
 
-    date_str = None
+    records = []
     for record in event["Records"]:
         event_source = record.get("eventSource")
         if event_source is not None and event_source == "aws:sqs":
             message = json.loads(record["body"])
             log.info(message)
             # Get the date from the message
-            date_str = message["date"]
+            date = datetime.strptime(message["date"], "%Y-%m-%d")
+            records.append((record["messageId"], date))
         else:
             log.error(f"No SQS message found, only {record}")
 
-    if date_str is not None:
-        date = datetime.strptime(date_str, "%Y-%m-%d")
-        output_location = os.environ.get(
-            "OUTPUT_LOCATION", "s3://files.auspatious.com/ghrsst/"
-        )
-        output_location = S3Path(output_location.replace("s3://", "/"))
-        input_location = "JPL"
-        overwrite = os.environ.get("OVERWRITE", "False").lower() == "true"
-        cache_local = os.environ.get("CACHE_LOCAL", "False").lower() == "true"
-
-        try:
-            process_date(
-                date,
-                input_location,
-                output_location,
-                overwrite,
-                cache_local=cache_local,
-                log=log,
-            )
-        except FileNotFoundError as e:
-            log.error(f"Couldn't find file for date {date:%Y-%m-%d} with error {e}")
-    else:
+    if len(records) == 0:
         raise GHRSSTException("No date found in event, exiting")
 
+    output_location = os.environ.get(
+        "OUTPUT_LOCATION", "s3://files.auspatious.com/ghrsst/"
+    )
+    output_location = S3Path(output_location.replace("s3://", "/"))
+    input_location = "JPL"
+    overwrite = os.environ.get("OVERWRITE", "False").lower() == "true"
+    cache_local = os.environ.get("CACHE_LOCAL", "False").lower() == "true"
+    workers = int(os.environ.get("WRITE_WORKERS", 1))
+    stream = os.environ.get("STREAM_COG", "False").lower() == "true"
+    range_read = os.environ.get("RANGE_READ", "False").lower() == "true"
+    statistics = os.environ.get("STATISTICS", "False").lower() == "true"
+    # Metrics are printed by default, which CloudWatch picks up
+    metrics_file = os.environ.get("METRICS_FILE")
+    coarse = os.environ.get("COARSE", "False").lower() == "true"
+    layout = os.environ.get("LAYOUT", "single").lower()
+    cube = os.environ.get("CUBE", "False").lower() == "true"
+    aggregate = os.environ.get("AGGREGATE", "False").lower() == "true"
+    memmap = os.environ.get("MEMMAP", "False").lower() == "true"
+    profile = os.environ.get("COG_PROFILE", DEFAULT_PROFILE).lower()
+    # Before any date is started, rather than after each one is downloaded
+    check_layout_and_profile(layout, profile)
+    roi = None
+    if os.environ.get("ROI") is not None:
+        roi = get_roi(os.environ["ROI"], os.environ.get("ROI_NAME"))
+    references_location = os.environ.get("REFERENCES_LOCATION")
+    if references_location is not None:
+        references_location = get_location(references_location)
+    # Don't start a date unless there's this much time left to finish it
+    min_remaining_seconds = int(
+        os.environ.get("MIN_REMAINING_SECONDS", MIN_REMAINING_SECONDS)
+    )
 
-@click.option("--date", type=str)
+    # Only prefetch when the file goes to disk, otherwise we'd hold two in memory.
+    # With memmap the disk is already near full with the date being written.
+    prefetch = cache_local and not range_read and not memmap
+
+    def _needs_download(date: datetime) -> bool:
+        if overwrite or cube or aggregate:
+            return True
+        location = output_location
+        if roi is not None:
+            location = get_roi_location(output_location, roi[0])
+        with environ(get_context()):
+            stac_file = get_output_path(location, date, ".stac-item.json")
+            existing = list_existing(stac_file.parent)
+        if stac_file.name in existing:
+            return False
+        return len(plan_outputs(date, location, existing, layout, coarse)) > 0
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        downloads = {}
+        for index, (message_id, date) in enumerate(records):
+            remaining_seconds = lambda_context.get_remaining_time_in_millis() / 1000
+            if remaining_seconds < min_remaining_seconds:
+                log.warning(f"Not enough time left to process {date:%Y-%m-%d}")
+                failures.append({"itemIdentifier": message_id})
+                continue
+
+            # Make sure this date's download is finished before we use it.
+            # If it failed, process_date will try again and raise the error.
+            if date in downloads:
+                try:
+                    downloads.pop(date).result()
+                except Exception as e:
+                    log.warning(f"Prefetching {date:%Y-%m-%d} failed with {e}")
+
+            # Then start downloading the next date, while we work on this one
+            if prefetch and index + 1 < len(records):
+                next_date = records[index + 1][1]
+                if _needs_download(next_date):
+                    log.info(f"Prefetching {next_date:%Y-%m-%d}")
+                    downloads[next_date] = prefetcher.submit(
+                        cache_data, next_date, input_location, log
+                    )
+
+            try:
+                process_date(
+                    date,
+                    input_location,
+                    output_location,
+                    overwrite,
+                    cache_local=cache_local,
+                    log=log,
+                    workers=workers,
+                    stream=stream,
+                    range_read=range_read,
+                    references_location=references_location,
+                    statistics=statistics,
+                    metrics_file=metrics_file,
+                    coarse=coarse,
+                    layout=layout,
+                    cube=cube,
+                    profile=profile,
+                    roi=roi,
+                    aggregate=aggregate,
+                    memmap=memmap,
+                )
+            except FileNotFoundError as e:
+                log.error(f"Couldn't find file for date {date:%Y-%m-%d} with error {e}")
+            except Exception as e:
+                log.exception(f"Failed to process date {date:%Y-%m-%d} with error {e}")
+                failures.append({"itemIdentifier": message_id})
+
+    return {"batchItemFailures": failures}
+
+
+@click.option("--date", type=str, default=None)
+@click.option("--start-date", type=str, default=None)
+@click.option("--end-date", type=str, default=None)
+@click.option("--dates-file", type=str, default=None)
+@click.option("--processes", type=int, default=os.cpu_count())
+@click.option("--summary-file", type=str, default=None)
 @click.option("--output-location", type=str)
 @click.option("--input-location", type=str, default="JPL")
 @click.option("--overwrite/--no-overwrite", is_flag=True, default=False)
 @click.option("--cache-local/--no-cache-local", is_flag=True, default=False)
+@click.option("--workers", type=int, default=1)
+@click.option("--stream/--no-stream", is_flag=True, default=False)
+@click.option("--range-read/--no-range-read", is_flag=True, default=False)
+@click.option("--references-location", type=str, default=None)
+@click.option("--statistics/--no-statistics", is_flag=True, default=False)
+@click.option("--metrics-file", type=str, default=None)
+@click.option("--coarse/--no-coarse", is_flag=True, default=False)
+@click.option("--layout", type=click.Choice(LAYOUTS), default="single")
+@click.option("--cube/--no-cube", is_flag=True, default=False)
+@click.option(
+    "--profile", type=click.Choice(list(COG_PROFILES)), default=DEFAULT_PROFILE
+)
+@click.option("--aggregate/--no-aggregate", is_flag=True, default=False)
+@click.option("--memmap/--no-memmap", is_flag=True, default=False)
+@click.option("--roi", type=str, default=None)
+@click.option("--roi-name", type=str, default=None)
 @click.command("ghrsst-cogger")
-def main(date, output_location, input_location, overwrite, cache_local):
-    date = datetime.strptime(date, "%Y-%m-%d")
+def main(
+    date,
+    start_date,
+    end_date,
+    dates_file,
+    processes,
+    summary_file,
+    output_location,
+    input_location,
+    overwrite,
+    cache_local,
+    workers,
+    stream,
+    range_read,
+    references_location,
+    statistics,
+    metrics_file,
+    coarse,
+    layout,
+    cube,
+    profile,
+    aggregate,
+    memmap,
+    roi,
+    roi_name,
+):
+    output_location = get_location(output_location)
+    if roi is not None:
+        roi = get_roi(roi, roi_name)
+    if references_location is not None:
+        references_location = get_location(references_location)
+
+    if date is None:
+        # Backfill many dates, with a process per date
+        from ghrsst.backfill import backfill, get_dates
+
+        if dates_file is None and (start_date is None or end_date is None):
+            raise click.UsageError(
+                "Give either --date, --start-date and --end-date, or --dates-file"
+            )
 
-    if output_location.startswith("s3://"):
-        output_location = S3Path(output_location.replace("s3://", "/"))
-    else:
-        output_location = Path(output_location)
+        summary = backfill(
+            get_dates(start_date, end_date, dates_file),
+            input_location,
+            output_location,
+            overwrite,
+            cache_local=cache_local,
+            processes=processes,
+            workers=workers,
+            stream=stream,
+            range_read=range_read,
+            references_location=references_location,
+            statistics=statistics,
+            metrics_file=metrics_file,
+            coarse=coarse,
+            layout=layout,
+            cube=cube,
+            profile=profile,
+            roi=roi,
+            aggregate=aggregate,
+            memmap=memmap,
+        )
+        if summary_file is not None:
+            Path(summary_file).write_text(json.dumps(summary, indent=2))
+        if summary["failed"]:
+            exit(1)
+        return
+
+    date = datetime.strptime(date, "%Y-%m-%d")
 
     # Only catch known exceptions, and otherwise let the program crash
     try:
         process_date(
-            date, input_location, output_location, overwrite, cache_local=cache_local
+            date,
+            input_location,
+            output_location,
+            overwrite,
+            cache_local=cache_local,
+            workers=workers,
+            stream=stream,
+            range_read=range_read,
+            references_location=references_location,
+            statistics=statistics,
+            metrics_file=metrics_file,
+            coarse=coarse,
+            layout=layout,
+            cube=cube,
+            profile=profile,
+            roi=roi,
+            aggregate=aggregate,
+            memmap=memmap,
         )
     except GHRSSTException as e:
         print(f"Failed to process date {date:%Y-%m-%d} with error {e}")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import json
+import time
+from datetime import datetime
+from logging import Logger
+from pathlib import Path
+
+import click
+from xarray import Dataset
+
+from ghrsst.cogger import (
+    COG_PROFILES,
+    GHRSSTException,
+    encode_cog,
+    get_logger,
+    load_data,
+    process_data,
+)
+
+
+def compare_profiles(
+    data: Dataset,
+    profiles: list[str],
+    repeat: int = 1,
+    log: Logger | None = None,
+) -> list[dict]:
+    """Encode each variable with each profile, and time it and measure its size
+
+    Data should be loaded already, so that only encoding is timed. The
+    fastest of the repeats is kept.
+    """
+    geobox = data.odc.geobox
+    results = []
+    for var in data.data_vars:
+        data_var = data[var]
+        # The same GDAL metadata as _write_variable gives it
+        data_var.attrs["scales"] = data_var.attrs.get("scale_factor")
+        data_var.attrs["offsets"] = data_var.attrs.get("add_offset")
+        data_var.attrs["nodata"] = data_var.attrs.get("_FillValue")
+
+        for profile in profiles:
+            seconds = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                cog_bytes = encode_cog([data_var], geobox, profile)
+                seconds.append(time.perf_counter() - started)
+
+            results.append(
+                {
+                    "variable": var,
+                    "profile": profile,
+                    "seconds": round(min(seconds), 3),
+                    "megabytes": round(len(cog_bytes) / 2**20, 2),
+                    "ratio": round(data_var.nbytes / len(cog_bytes), 2),
+                }
+            )
+            if log is not None:
+                log.info(
+                    f"{var} with {profile}: {results[-1]['seconds']}s, "
+                    f"{results[-1]['megabytes']} MB"
+                )
+
+    return results
+
+
+def format_table(results: list[dict]) -> str:
+    lines = [f"{'variable':<18} {'profile':<10} {'seconds':>8} {'MB':>8} {'ratio':>6}"]
+    for result in results:
+        lines.append(
+            f"{result['variable']:<18} {result['profile']:<10} "
+            f"{result['seconds']:>8.3f} {result['megabytes']:>8.2f} "
+            f"{result['ratio']:>6.2f}"
+        )
+
+    return "\n".join(lines)
+
+
+@click.option("--date", type=str)
+@click.option("--input-location", type=str, default="JPL")
+@click.option(
+    "--profile",
+    "profiles",
+    type=click.Choice(list(COG_PROFILES)),
+    multiple=True,
+    default=list(COG_PROFILES),
+)
+@click.option("--repeat", type=int, default=1)
+@click.option("--output-json", type=str, default=None)
+@click.command("ghrsst-compare")
+def main(date, input_location, profiles, repeat, output_json):
+    log = get_logger()
+    date = datetime.strptime(date, "%Y-%m-%d")
+
+    try:
+        log.info(f"Loading {date:%Y-%m-%d} from {input_location}")
+        data = process_data(load_data(date, input_location, log=log)).load()
+        results = compare_profiles(data, list(profiles), repeat=repeat, log=log)
+    except GHRSSTException as e:
+        print(f"Failed to compare profiles with error {e}")
+        exit(1)
+
+    if output_json is not None:
+        Path(output_json).write_text(json.dumps(results, indent=2))
+    click.echo(format_table(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,303 @@
 import asyncio
+import json
 import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from logging import Logger
+from pathlib import Path
 
+import aiohttp
 import click
 import stacrs
 from s3path import S3Path
 
-from ghrsst.cogger import GHRSSTException, get_logger, get_output_path
+from ghrsst.cogger import (
+    S3_MAX_POOL_CONNECTIONS,
+    GHRSSTException,
+    environ,
+    get_context,
+    get_logger,
+    get_output_path,
+    get_s3_client,
+)
+
+PARQUET_FILE = "ghrsst-mur-v2.parquet"
+# Recent dates can be reprocessed, so always fetch these again
+REFRESH_DAYS = 7
+PUBLIC_URL = "https://data.source.coop/ausantarctic/ghrsst-mur-v2"
+ITEM_SUFFIX = ".stac-item.json"
+# Years listed at once when finding items in S3
+LIST_WORKERS = 8
+# Items are kept here with their ETag, so unchanged ones aren't downloaded again
+ITEM_CACHE_DIR = Path(tempfile.gettempdir()) / "ghrsst-stac-items"
+# Requests at once to start with, and the most it grows back to
+CONCURRENT_REQUESTS = 20
+RETRIES = 5
+BACKOFF_SECONDS = 0.5
+REQUEST_SECONDS = 30
+# The server is busy or briefly failing, so it's worth trying these again
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _item_date(item: dict) -> datetime:
+    return datetime.strptime(item["properties"]["start_datetime"][:10], "%Y-%m-%d")
+
+
+async def read_existing_items(parquet_href: str, log: Logger = None) -> list[dict]:
+    """Read the items in an existing parquet file, or none if there isn't one"""
+    try:
+        existing = await stacrs.read(parquet_href)
+    except Exception as e:
+        if log is not None:
+            log.info(f"Couldn't read existing parquet at {parquet_href}: {e}")
+        return []
+
+    return existing["features"]
+
+
+class AdaptiveLimit:
+    """Limit concurrent requests, halving the limit when the server pushes
+    back and growing it again a little with each success
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self._active = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < int(self.limit))
+            self._active += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
 
+    def succeeded(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
 
-async def fetch_all_items(dates, input_location, concurrent_requests=20):
-    location = S3Path(input_location)
-    hrefs = [
-        str(get_output_path(location, date, ".stac-item.json")).replace(
-            input_location, "https://data.source.coop/ausantarctic/ghrsst-mur-v2"
-        )
-        for date in dates
-    ]
+    def pushed_back(self) -> None:
+        self.limit = max(1.0, self.limit / 2)
 
-    print(f"Prepared {len(hrefs)} hrefs")
 
-    async def fetch_item(href, semaphore):
-        async with semaphore:
-            try:
-                return await stacrs.read(href)
-            except Exception as e:
-                print(f"Failed to fetch {href} with error {e}")
-                return None
+def get_item_href(date: datetime, input_location: str, public_url: str = PUBLIC_URL):
+    path = get_output_path(S3Path(input_location), date, ITEM_SUFFIX)
+    return str(path).replace(input_location, public_url)
 
-    semaphore = asyncio.Semaphore(concurrent_requests)
-    tasks = [asyncio.create_task(fetch_item(href, semaphore)) for href in hrefs]
-    items = await asyncio.gather(*tasks)
 
-    return [item for item in items if item is not None]
+def _cache_path(cache_dir: Path, href: str) -> Path:
+    return cache_dir / href.rsplit("/", 1)[-1]
+
+
+def _read_cached(cache_dir: Path | None, href: str) -> dict | None:
+    if cache_dir is None:
+        return None
+    try:
+        return json.loads(_cache_path(cache_dir, href).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_cached(cache_dir: Path | None, href: str, cached: dict) -> None:
+    if cache_dir is None:
+        return
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = _cache_path(cache_dir, href)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    temp_path.write_text(json.dumps(cached))
+    os.replace(temp_path, path)
+
+
+async def fetch_item(
+    session: aiohttp.ClientSession,
+    href: str,
+    limit: AdaptiveLimit,
+    cache_dir: Path | None = None,
+    retries: int = RETRIES,
+) -> dict:
+    """Fetch an item, or reuse the cached one if the server says it hasn't
+    changed since we got it
+
+    Busy or failing servers are retried with backoff. Raises
+    FileNotFoundError if there's no item.
+    """
+    cached = _read_cached(cache_dir, href)
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    error = None
+    for attempt in range(retries):
+        try:
+            async with limit.slot():
+                async with session.get(href, headers=headers) as response:
+                    if response.status == 304:
+                        limit.succeeded()
+                        return cached["item"]
+                    if response.status == 404:
+                        raise FileNotFoundError(href)
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        item = await response.json(content_type=None)
+                        limit.succeeded()
+                        _write_cached(
+                            cache_dir,
+                            href,
+                            {
+                                "etag": response.headers.get("ETag"),
+                                "last_modified": response.headers.get("Last-Modified"),
+                                "item": item,
+                            },
+                        )
+                        return item
+                    error = f"HTTP {response.status}"
+        except aiohttp.ClientResponseError as e:
+            # Not something trying again will fix
+            raise GHRSSTException(f"Failed to fetch {href} with error {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+
+        limit.pushed_back()
+        if attempt < retries - 1:
+            await asyncio.sleep(BACKOFF_SECONDS * 2**attempt * (1 + random.random()))
+
+    raise GHRSSTException(
+        f"Failed to fetch {href} after {retries} attempts, last error {error}"
+    )
+
 
+async def fetch_all_items(
+    dates: list[datetime],
+    input_location: str,
+    concurrent_requests: int = CONCURRENT_REQUESTS,
+    cache_dir: Path | None = ITEM_CACHE_DIR,
+    public_url: str = PUBLIC_URL,
+    log: Logger | None = None,
+) -> tuple[list[dict], dict]:
+    """Fetch the items for each date
+
+    Returns:
+        tuple: The items that were found, and a summary of which dates had
+            no item and which failed even after retrying
+    """
+    hrefs = [get_item_href(date, input_location, public_url) for date in dates]
+    if log is not None:
+        log.info(f"Fetching {len(hrefs)} items from {public_url}")
 
-async def get_items(dates, input_location):
-    location = S3Path(input_location)
-    hrefs = []
+    summary = {"missing": [], "failed": {}}
+    limit = AdaptiveLimit(concurrent_requests)
 
-    for date in dates:
-        path = get_output_path(location, date, ".stac-item.json")
-        href = str(path).replace(
-            input_location, "https://data.source.coop/ausantarctic/ghrsst-mur-v2"
+    async def fetch(session, date, href):
+        try:
+            return await fetch_item(session, href, limit, cache_dir=cache_dir)
+        except FileNotFoundError:
+            summary["missing"].append(f"{date:%Y-%m-%d}")
+        except Exception as e:
+            summary["failed"][f"{date:%Y-%m-%d}"] = str(e)
+            if log is not None:
+                log.error(f"Failed to fetch item for {date:%Y-%m-%d}: {e}")
+        return None
+
+    connector = aiohttp.TCPConnector(limit=concurrent_requests)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_SECONDS)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        items = await asyncio.gather(
+            *[fetch(session, date, href) for date, href in zip(dates, hrefs)]
         )
 
-        hrefs.append(href)
+    summary["missing"].sort()
+    return [item for item in items if item is not None], summary
+
+
+def list_item_keys(
+    location: S3Path, years: list[int], workers: int = LIST_WORKERS
+) -> dict[datetime, tuple[str, str]]:
+    """Find the items that exist, with a paginated listing of each year
+
+    Returns:
+        dict: The key and ETag of each date's item
+    """
+    s3 = get_s3_client()
+
+    def list_year(year: int) -> dict:
+        found = {}
+        prefix = f"{location.key.rstrip('/')}/{year}/".lstrip("/")
+        for page in s3.get_paginator("list_objects_v2").paginate(
+            Bucket=location.bucket, Prefix=prefix
+        ):
+            for obj in page.get("Contents", []):
+                name = obj["Key"].rsplit("/", 1)[-1]
+                if name.endswith(ITEM_SUFFIX):
+                    date = datetime.strptime(name[:8], "%Y%m%d")
+                    found[date] = (obj["Key"], obj["ETag"])
+        return found
+
+    keys = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for found in executor.map(list_year, sorted(set(years))):
+            keys.update(found)
+
+    return keys
+
+
+def fetch_listed_items(
+    dates: list[datetime],
+    location: S3Path,
+    cache_dir: Path | None = ITEM_CACHE_DIR,
+    log: Logger | None = None,
+) -> tuple[list[dict], dict]:
+    """Fetch the items for each date that the listing found, from S3
+
+    Items whose ETag matches the cached one aren't downloaded again.
+
+    Returns:
+        tuple: The items that were found, and a summary of which dates had
+            no item and which failed
+    """
+    keys = list_item_keys(location, [date.year for date in dates])
+    found = [date for date in dates if date in keys]
+    summary = {
+        "missing": [f"{date:%Y-%m-%d}" for date in dates if date not in keys],
+        "failed": {},
+    }
+    if log is not None:
+        log.info(f"Listed {len(found)} of {len(dates)} items in {location}")
+
+    s3 = get_s3_client()
 
-    print(f"Prepared {len(hrefs)} hrefs")
+    def fetch(date: datetime) -> dict | None:
+        key, etag = keys[date]
+        cached = _read_cached(cache_dir, key)
+        if cached is not None and cached.get("etag") == etag:
+            return cached["item"]
 
-    async def fetch_item(href):
         try:
-            item = await stacrs.read(href)
-            return item
+            response = s3.get_object(Bucket=location.bucket, Key=key)
+            item = json.loads(response["Body"].read())
         except Exception as e:
-            print(f"Failed to fetch {href} with error {e}")
+            summary["failed"][f"{date:%Y-%m-%d}"] = str(e)
+            if log is not None:
+                log.error(f"Failed to fetch item for {date:%Y-%m-%d}: {e}")
             return None
 
-    items = await asyncio.gather(*[fetch_item(href) for href in hrefs])
-    items = [item for item in items if item is not None]
+        _write_cached(cache_dir, key, {"etag": etag, "item": item})
+        return item
 
-    return items
+    with ThreadPoolExecutor(max_workers=S3_MAX_POOL_CONNECTIONS) as executor:
+        items = list(executor.map(fetch, found))
+
+    return [item for item in items if item is not None], summary
 
 
 async def create_parquet(
@@ -71,7 +307,23 @@ async def create_parquet(
     output_location: str,
     write_tempfile: bool = False,
     log: Logger = None,
+    incremental: bool = False,
+    refresh_days: int = REFRESH_DAYS,
+    cache_dir: Path | None = ITEM_CACHE_DIR,
+    from_listing: bool = False,
 ) -> int:
+    """Build a STAC geoparquet file of the items between two dates
+
+    With incremental, the existing parquet file is read and only the dates
+    it is missing, plus the last refresh_days, are fetched.
+
+    With from_listing, the items that exist are found by listing the S3
+    input location, and only those are fetched, rather than requesting an
+    item over HTTPS for every date.
+
+    Dates whose items couldn't be fetched are left out, and raised as an
+    error once the parquet file is written.
+    """
     dates = [
         start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)
     ]
@@ -82,13 +334,43 @@ async def create_parquet(
             f"Reading from {input_location}, writing to {output_location}, write_tempfile is {write_tempfile}"
         )
 
-    items = await fetch_all_items(dates, input_location)
+    output_location = output_location.replace("s3:/", "s3://")
+    out = f"{output_location}/{PARQUET_FILE}"
+
+    existing = []
+    if incremental:
+        refresh_from = end_date - timedelta(days=refresh_days)
+        existing = [
+            item
+            for item in await read_existing_items(out, log=log)
+            if start_date <= _item_date(item) < refresh_from
+        ]
+        done = {_item_date(item) for item in existing}
+        dates = [date for date in dates if date not in done]
+
+        if log is not None:
+            log.info(f"Kept {len(existing)} existing items, fetching {len(dates)}")
+
+    if from_listing:
+        if not input_location.startswith("s3:/"):
+            raise GHRSSTException("Listing items needs an S3 input location")
+        location = S3Path(input_location.replace("s3:/", "/", 1))
+        with environ(get_context()):
+            items, summary = await asyncio.to_thread(
+                fetch_listed_items, dates, location, cache_dir=cache_dir, log=log
+            )
+    else:
+        items, summary = await fetch_all_items(
+            dates, input_location, cache_dir=cache_dir, log=log
+        )
 
-    log.info(f"Found {len(items)} STAC items")
+    if log is not None:
+        log.info(
+            f"Found {len(items)} STAC items, {len(summary['missing'])} dates "
+            f"have none and {len(summary['failed'])} failed"
+        )
 
-    # Write items to parquet
-    output_location = output_location.replace("s3:/", "s3://")
-    out = f"{output_location}/ghrsst-mur-v2.parquet"
+    items = sorted(existing + items, key=_item_date)
 
     if log is not None:
         log.info(f"Writing {len(items)} items to {out}")
@@ -99,15 +381,13 @@ async def create_parquet(
     if output_location.startswith("s3://"):
         if write_tempfile:
             # Write to a memoryfile
-            temp_file = "/tmp/ghrsst-mur-v2.parquet"
+            temp_file = f"/tmp/{PARQUET_FILE}"
             if log is not None:
                 log.info(f"Writing to tempfile at: {temp_file}")
             await stacrs.write(temp_file, items)
 
             # Move the tempfile to the final location on S3
-            out = (
-                S3Path(output_location.replace("s3://", "/")) / "ghrsst-mur-v2.parquet"
-            )
+            out = S3Path(output_location.replace("s3://", "/")) / PARQUET_FILE
 
             if log is not None:
                 log.info(f"Copying tempfile to S3 at : S3:/{out}")
@@ -118,7 +398,17 @@ async def create_parquet(
             log.info(f"Writing {len(items)} items to S3 at: {out}")
             await stacrs.write(out, items)
     else:
-        await stacrs.write(out, items)
+        # Write next to the output, then swap it in, so readers never see
+        # a partly written file
+        temp_file = f"{output_location}/.{PARQUET_FILE}"
+        await stacrs.write(temp_file, items)
+        os.replace(temp_file, out)
+
+    if summary["failed"]:
+        raise GHRSSTException(
+            f"Wrote {len(items)} items, but failed to fetch items for "
+            f"{', '.join(sorted(summary['failed']))}"
+        )
 
     return len(items)
 
@@ -139,6 +429,10 @@ def lambda_handler(event, _):
         "s3://", "s3:/"
     )
     write_tempfile = os.environ.get("WRITE_TEMPFILE", "true").lower() == "true"
+    incremental = os.environ.get("INCREMENTAL", "false").lower() == "true"
+    refresh_days = int(os.environ.get("REFRESH_DAYS", REFRESH_DAYS))
+    cache_dir = Path(os.environ.get("ITEM_CACHE_DIR", ITEM_CACHE_DIR))
+    from_listing = os.environ.get("FROM_LISTING", "false").lower() == "true"
 
     result = asyncio.run(
         create_parquet(
@@ -148,6 +442,10 @@ def lambda_handler(event, _):
             output_location=output_location,
             write_tempfile=write_tempfile,
             log=log,
+            incremental=incremental,
+            refresh_days=refresh_days,
+            cache_dir=cache_dir,
+            from_listing=from_listing,
         )
     )
 
@@ -159,8 +457,22 @@ def lambda_handler(event, _):
 @click.option("--input-location", type=str, default="s3://ausantarctic/ghrsst-mur-v2")
 @click.option("--output-location", type=str, default=None)
 @click.option("--write-tempfile/--no-write-tempfile", is_flag=True, default=True)
+@click.option("--incremental/--full", is_flag=True, default=False)
+@click.option("--refresh-days", type=int, default=REFRESH_DAYS)
+@click.option("--item-cache", type=str, default=str(ITEM_CACHE_DIR))
+@click.option("--from-listing/--from-https", is_flag=True, default=False)
 @click.command("create-parquet")
-def main(start_date, end_date, input_location, output_location, write_tempfile):
+def main(
+    start_date,
+    end_date,
+    input_location,
+    output_location,
+    write_tempfile,
+    incremental,
+    refresh_days,
+    item_cache,
+    from_listing,
+):
     start_date = datetime.strptime(start_date, "%Y-%m-%d")
     end_date = datetime.strptime(end_date, "%Y-%m-%d")
 
@@ -182,6 +494,10 @@ def main(start_date, end_date, input_location, output_location, write_tempfile):
                 output_location=output_location,
                 write_tempfile=write_tempfile,
                 log=log,
+                incremental=incremental,
+                refresh_days=refresh_days,
+                cache_dir=Path(item_cache),
+                from_listing=from_listing,
             )
         )
 
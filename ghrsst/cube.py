@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from logging import Logger
+from multiprocessing import get_context as get_mp_context
+from pathlib import Path
+from typing import Union
+
+import click
+import dask.array as da
+import numpy as np
+import xarray as xr
+import zarr
+from odc.geo.geobox import GeoBox
+from odc.geo.xr import xr_coords
+from s3path import S3Path
+
+from ghrsst.cogger import (
+    MIN_REMAINING_SECONDS,
+    GHRSSTException,
+    _get_href,
+    _is_s3_path,
+    environ,
+    get_context,
+    get_location,
+    get_logger,
+    get_output_path,
+)
+
+CUBE_NAME = "cube.zarr"
+# Dates are appended here, and folded into the cube by rechunk. Each date is
+# a chunk of its own along time, so appending one only writes its own
+# chunks, and dates can be appended at once from anywhere. There's a group
+# per year, with a day for each day of a leap year.
+STAGING_NAME = "cube-staging.zarr"
+STAGING_DAYS = 366
+# The first day of MUR, which is index 0 along the cube's time axis
+CUBE_START = datetime(2002, 6, 1)
+# Chunked for reading long time series at a few points
+CUBE_CHUNKS = {"time": 365, "lat": 100, "lon": 100}
+# Pixels along each side of the blocks a date is staged in
+APPEND_BLOCK = 1000
+# Rows and columns of the windows that rechunk reads from a time chunk of
+# COGs at once. That's 365 x 1000 x 1000 int16, or about 730 MB, per process.
+RECHUNK_WINDOW = 1000
+# COGs each rechunk process reads at once
+READ_THREADS = 8
+# The daily run redoes the last week, so a time chunk is only folded from
+# staging once it's been over that long
+FOLD_AFTER_DAYS = 7
+# Where fold keeps track of the time chunk it's part way through, in the
+# staging store's attributes
+FOLD_ATTR = "folding"
+
+
+def get_cube_path(output_location: Union[Path, S3Path]) -> str:
+    if _is_s3_path(output_location):
+        return f"s3:/{output_location / CUBE_NAME}"
+    return str(output_location / CUBE_NAME)
+
+
+def get_staging_path(output_location: Union[Path, S3Path]) -> str:
+    if _is_s3_path(output_location):
+        return f"s3:/{output_location / STAGING_NAME}"
+    return str(output_location / STAGING_NAME)
+
+
+def _storage_options(store: str) -> dict | None:
+    if not store.startswith("s3://"):
+        return None
+
+    # Credentials come from the environment, which is different for
+    # source.coop, so don't reuse a filesystem made with other ones
+    options = {"skip_instance_cache": True}
+    if os.environ.get("AWS_ENDPOINT_URL") is not None:
+        options["endpoint_url"] = os.environ["AWS_ENDPOINT_URL"]
+    return options
+
+
+def _open_cube(store: str) -> zarr.Group:
+    return zarr.open_group(store, mode="r+", storage_options=_storage_options(store))
+
+
+def _time_index(date: datetime) -> int:
+    return (date - CUBE_START).days
+
+
+def _day_index(date: datetime) -> int:
+    """Index of a date in its year's staging group"""
+    return (date - datetime(date.year, 1, 1)).days
+
+
+def _days_to_end_of_year(date: datetime) -> int:
+    return _time_index(datetime(date.year, 12, 31)) + 1
+
+
+def _dims(array: zarr.Array) -> tuple[str, ...]:
+    # Zarr v3 keeps dimension names in the metadata, and v2 in an attribute
+    names = getattr(array.metadata, "dimension_names", None)
+    return tuple(names or array.attrs.get("_ARRAY_DIMENSIONS", ()))
+
+
+def _require_array(group: zarr.Group, name: str, **kwargs) -> zarr.Array:
+    """Get an array, or create it, even if another process is creating it
+    at the same time with the same metadata
+    """
+    try:
+        return group.create_array(name, **kwargs)
+    except zarr.errors.ContainsArrayError:
+        return group[name]
+
+
+def get_cube_variables(data: xr.Dataset) -> dict[str, dict]:
+    """The data type, fill value and decoding attributes of each variable"""
+    variables = {}
+    for var in data.data_vars:
+        attrs = data[var].attrs
+        cube_attrs = {}
+        for key in ["scale_factor", "add_offset"]:
+            if attrs.get(key) is not None:
+                cube_attrs[key] = float(attrs[key])
+        if attrs.get("units") is not None:
+            cube_attrs["units"] = str(attrs["units"])
+
+        variables[var] = {
+            "dtype": data[var].dtype.name,
+            "fill": int(attrs["_FillValue"]),
+            "attrs": cube_attrs,
+        }
+
+    return variables
+
+
+def get_template(geobox: GeoBox, variables: dict[str, dict], days: int) -> xr.Dataset:
+    """A lazy dataset of fill values, with the cube's grid, time and chunks"""
+    chunks = (CUBE_CHUNKS["time"], CUBE_CHUNKS["lat"], CUBE_CHUNKS["lon"])
+    data_vars = {
+        var: xr.Variable(
+            ("time", "lat", "lon"),
+            da.full(
+                (days, *geobox.shape), info["fill"], dtype=info["dtype"], chunks=chunks
+            ),
+            attrs=info["attrs"],
+            encoding={"_FillValue": info["fill"], "chunks": chunks},
+        )
+        for var, info in variables.items()
+    }
+    time = (np.datetime64(CUBE_START, "D") + np.arange(days)).astype("datetime64[ns]")
+    template = xr.Dataset(
+        data_vars,
+        coords={"time": time, **xr_coords(geobox, dims=("lat", "lon"))},
+    )
+    # Store days since the start, so a date's index is the stored time
+    template["time"].encoding = {
+        "units": f"days since {CUBE_START:%Y-%m-%d}",
+        "dtype": "int32",
+    }
+
+    return template
+
+
+def ensure_cube(
+    output_location: Union[Path, S3Path],
+    geobox: GeoBox,
+    variables: dict[str, dict],
+    date: datetime,
+    log: Logger | None = None,
+) -> str:
+    """Create the cube, or grow it, so that it runs to the end of a date's year
+
+    Growing sets the length of the time axis rather than adding to it, so
+    it's safe to repeat.
+    """
+    store = get_cube_path(output_location)
+    days = _days_to_end_of_year(date)
+
+    try:
+        group = _open_cube(store)
+    except FileNotFoundError:
+        if log is not None:
+            log.info(f"Creating a cube at {store} with {days} days")
+        # Only the metadata and coordinates are written, as the data is all fill
+        get_template(geobox, variables, days).to_zarr(
+            store,
+            mode="w-",
+            compute=False,
+            zarr_format=2,
+            storage_options=_storage_options(store),
+        )
+        return store
+
+    if tuple(group["lat"].shape + group["lon"].shape) != tuple(geobox.shape):
+        raise GHRSSTException(
+            f"The cube at {store} has shape {group['lat'].shape + group['lon'].shape}, "
+            f"not {geobox.shape}"
+        )
+
+    current = group["time"].shape[0]
+    if current < days:
+        if log is not None:
+            log.info(f"Growing the cube at {store} from {current} to {days} days")
+        for name, array in group.arrays():
+            if _dims(array)[:1] == ("time",):
+                array.resize((days, *array.shape[1:]))
+            if name == "time":
+                array[current:days] = np.arange(current, days, dtype="int32")
+        zarr.consolidate_metadata(group.store)
+
+    return store
+
+
+def ensure_staging(
+    output_location: Union[Path, S3Path],
+    geobox: GeoBox,
+    variables: dict[str, dict],
+    year: int,
+) -> zarr.Group:
+    """Get a year's staging group, creating the arrays of any variables it
+    doesn't have yet
+
+    Each variable has an array of the data, and an array that flags the
+    days it's been staged for.
+    """
+    store = get_staging_path(output_location)
+    group = zarr.open_group(
+        store,
+        mode="a",
+        path=str(year),
+        zarr_format=2,
+        storage_options=_storage_options(store),
+    )
+
+    for var, info in variables.items():
+        array = _require_array(
+            group,
+            var,
+            shape=(STAGING_DAYS, *geobox.shape),
+            chunks=(1, APPEND_BLOCK, APPEND_BLOCK),
+            dtype=info["dtype"],
+            fill_value=info["fill"],
+            attributes={**info["attrs"], "_ARRAY_DIMENSIONS": ["time", "lat", "lon"]},
+        )
+        if tuple(array.shape[1:]) != tuple(geobox.shape):
+            raise GHRSSTException(
+                f"The staging arrays at {store} have shape {array.shape[1:]}, "
+                f"not {geobox.shape}"
+            )
+        _require_array(
+            group,
+            f"{var}_staged",
+            shape=(STAGING_DAYS,),
+            chunks=(1,),
+            dtype="int8",
+            fill_value=0,
+            attributes={"_ARRAY_DIMENSIONS": ["time"]},
+        )
+
+    return group
+
+
+def append_date(
+    data: xr.Dataset,
+    date: datetime,
+    output_location: Union[Path, S3Path],
+    log: Logger | None = None,
+) -> str:
+    """Stage a processed date, for rechunk to fold into the cube
+
+    Only the date's own chunks are written, however long the cube is, so
+    dates can be appended from many Lambdas at once. Each variable is
+    flagged as staged once it's all written, so appending a date again
+    just overwrites it.
+
+    Args:
+        data (Dataset): Processed data for the date, from process_data
+        date (datetime): Date of the data
+        output_location: Location the cube is kept in, next to the COGs
+    """
+    group = ensure_staging(
+        output_location, data.odc.geobox, get_cube_variables(data), date.year
+    )
+    index = _day_index(date)
+
+    sources, targets = [], []
+    for var in data.data_vars:
+        # Blocks line up with the chunks, so none are written twice
+        pixels = da.asarray(data[var].isel(time=0).data).rechunk(APPEND_BLOCK)
+        sources.append(pixels[None])
+        targets.append(group[var])
+
+    regions = [(slice(index, index + 1), slice(None), slice(None))] * len(targets)
+    da.store(sources, targets, regions=regions, lock=False)
+    for var in data.data_vars:
+        group[f"{var}_staged"][index] = 1
+
+    store = get_staging_path(output_location)
+    if log is not None:
+        log.info(f"Staged {date:%Y-%m-%d} for the cube at {store}")
+
+    return store
+
+
+def read_staged(
+    output_location: Union[Path, S3Path], dates: list[datetime], var: str
+) -> set[datetime]:
+    """The dates that a variable is staged for"""
+    try:
+        group = _open_cube(get_staging_path(output_location))
+    except FileNotFoundError:
+        return set()
+
+    staged = set()
+    for year in sorted({date.year for date in dates}):
+        try:
+            flags = group[f"{year}/{var}_staged"][:]
+        except KeyError:
+            continue
+        staged |= {
+            date for date in dates if date.year == year and flags[_day_index(date)]
+        }
+
+    return staged
+
+
+def get_sources(item: dict) -> dict[str, tuple[str, int]]:
+    """The asset and band that each variable is in, from a STAC item, for
+    either layout
+    """
+    sources = {}
+    for key, asset in item["assets"].items():
+        if "overview" in asset.get("roles", []):
+            continue
+        for band, info in enumerate(asset["raster:bands"], start=1):
+            sources[info.get("name", key)] = (key, band)
+
+    return sources
+
+
+def get_cog_variables(
+    hrefs: dict[str, tuple[str, int]],
+) -> tuple[GeoBox, dict[str, dict]]:
+    """The grid, and the same as get_cube_variables, from the COGs' headers"""
+    import rasterio
+
+    geobox, variables = None, {}
+    for var, (href, band) in hrefs.items():
+        with rasterio.open(href) as cog:
+            geobox = GeoBox(cog.shape, cog.transform, cog.crs)
+            scale, offset = cog.scales[band - 1], cog.offsets[band - 1]
+            attrs = {}
+            if (scale, offset) != (1.0, 0.0):
+                attrs = {"scale_factor": scale, "add_offset": offset}
+            if cog.units[band - 1]:
+                attrs["units"] = cog.units[band - 1]
+
+            variables[var] = {
+                "dtype": cog.dtypes[band - 1],
+                "fill": int(cog.nodatavals[band - 1]),
+                "attrs": attrs,
+            }
+
+    return geobox, variables
+
+
+def _open_cog(href: str | None):
+    import rasterio
+    from rasterio.errors import RasterioIOError
+
+    if href is None:
+        return None
+    try:
+        return rasterio.open(href)
+    except RasterioIOError:
+        # Older dates don't have every variable
+        return None
+
+
+def _rechunk_rows(
+    store: str,
+    staging_store: str,
+    var: str,
+    band: int,
+    sources: list[tuple | None],
+    start: int,
+    rows: slice,
+    window: int,
+) -> None:
+    """Write a time chunk of a band of rows of a variable, a window at a time
+
+    Args:
+        sources (list): For each day of the chunk, ("staging", year, index)
+            if it's staged, ("cog", href) to read it from its COG, or None
+            if it isn't done.
+    """
+    from rasterio.windows import Window
+
+    array = _open_cube(store)[var]
+    fill = array.fill_value
+    width = array.shape[2]
+    hrefs = [source[1] if source and source[0] == "cog" else None for source in sources]
+    staging = None
+    if any(source and source[0] == "staging" for source in sources):
+        staging = _open_cube(staging_store)
+
+    with ExitStack() as stack, ThreadPoolExecutor(READ_THREADS) as executor:
+        cogs = list(executor.map(_open_cog, hrefs))
+        for cog in cogs:
+            if cog is not None:
+                stack.enter_context(cog)
+        readable = [
+            i
+            for i, source in enumerate(sources)
+            if source and (source[0] == "staging" or cogs[i] is not None)
+        ]
+
+        for first in range(0, width, window):
+            cols = slice(first, min(first + window, width))
+            block = np.full(
+                (len(sources), rows.stop - rows.start, cols.stop - cols.start),
+                fill,
+                dtype=array.dtype,
+            )
+
+            def read(i):
+                if sources[i][0] == "staging":
+                    _, year, index = sources[i]
+                    block[i] = staging[f"{year}/{var}"][index, rows, cols]
+                else:
+                    block[i] = cogs[i].read(band, window=Window.from_slices(rows, cols))
+
+            list(executor.map(read, readable))
+            array[start : start + len(sources), rows, cols] = block
+
+
+def rechunk(
+    output_location: Union[Path, S3Path],
+    dates: list[datetime],
+    processes: int = os.cpu_count(),
+    window: int = RECHUNK_WINDOW,
+    memory_per_process: int | None = None,
+    skip: list[str] = (),
+    seconds: float | None = None,
+    prune: bool = True,
+    log: Logger | None = None,
+) -> dict:
+    """Build the cube from the archive, a time chunk at a time
+
+    Every time chunk that the dates fall in is rewritten in full from the
+    dates that are done, and processes each write their own rows, so no
+    chunk is written twice. Dates that are staged are read from there, and
+    the rest from their COGs. Once every task is written, the staged days
+    that were read are removed from staging.
+
+    Args:
+        dates (list[datetime]): Dates to build the cube for
+        processes (int): Number of processes reading COGs at once. With
+            one, the tasks run in this process, as on Lambda.
+        window (int): Rows and columns of each read, a multiple of the
+            cube's chunks. Memory use is 365 x window x window per process.
+        memory_per_process (int): Bytes of memory each process needs, to
+            limit the processes to the machine's memory. Defaults to a
+            window's worth and GDAL's cache.
+        skip (list[str]): Tasks that are already written, from the summary
+            of an earlier call
+        seconds (float): Don't start any tasks after this long
+        prune (bool): Remove the staged days once they're all written
+
+    Returns:
+        dict: A summary, with the tasks that were written, whether that's
+            all of them, and the dates that were read from staging
+    """
+    from ghrsst.backfill import (
+        GDAL_CACHEMAX,
+        THREADS_PER_PROCESS,
+        _init_worker,
+        limit_processes,
+    )
+    from ghrsst.index import DATE_FORMAT, filter_done, read_index, rebuild_index
+
+    if log is None:
+        log = get_logger()
+    if window % CUBE_CHUNKS["lat"] or window % CUBE_CHUNKS["lon"]:
+        raise GHRSSTException(f"Window {window} isn't a multiple of {CUBE_CHUNKS}")
+
+    started = time.perf_counter()
+    if memory_per_process is None:
+        memory_per_process = CUBE_CHUNKS["time"] * window * window * 2
+        memory_per_process += GDAL_CACHEMAX * 2**20
+    processes = limit_processes(processes, memory_per_process, log)
+
+    # Rewrite whole time chunks, and find the dates in them that are done
+    chunk = CUBE_CHUNKS["time"]
+    chunks = sorted({_time_index(date) // chunk for date in dates})
+    in_chunks = [
+        CUBE_START + timedelta(days=index)
+        for c in chunks
+        for index in range(c * chunk, (c + 1) * chunk)
+    ]
+    # Archives written before the index have nothing in it, so find their
+    # dates from the STAC items
+    for year in sorted({date.year for date in in_chunks}):
+        if not read_index(output_location, year):
+            rebuild_index(output_location, year, log=log)
+    not_done = set(filter_done(output_location, in_chunks))
+    done = [date for date in in_chunks if date not in not_done]
+    if not done:
+        raise GHRSSTException("None of the dates have been processed yet")
+
+    # Use the first date's STAC item to find where each variable is
+    stac_file = get_output_path(output_location, done[0], ".stac-item.json")
+    sources = get_sources(json.loads(stac_file.read_text()))
+
+    def href(date: datetime, key: str) -> str:
+        return _get_href(get_output_path(output_location, date, f"_{key}.tif"))
+
+    geobox, variables = get_cog_variables(
+        {var: (href(done[0], key), band) for var, (key, band) in sources.items()}
+    )
+    store = ensure_cube(output_location, geobox, variables, max(dates), log)
+    days = _open_cube(store)["time"].shape[0]
+
+    def source(date: datetime, var: str, key: str) -> tuple | None:
+        if date in staged[var]:
+            return ("staging", date.year, _day_index(date))
+        if date in done:
+            return ("cog", href(date, key))
+        return None
+
+    staging_store = get_staging_path(output_location)
+    staged = {var: read_staged(output_location, done, var) for var in sources}
+    done = set(done)
+    tasks = []
+    for c in chunks:
+        start = c * chunk
+        chunk_dates = [
+            CUBE_START + timedelta(days=index)
+            for index in range(start, min(start + chunk, days))
+        ]
+        for var, (key, band) in sources.items():
+            day_sources = [source(d, var, key) for d in chunk_dates]
+            for first in range(0, geobox.shape[0], window):
+                rows = slice(first, min(first + window, geobox.shape[0]))
+                tasks.append(
+                    (store, staging_store, var, band, day_sources, start, rows, window)
+                )
+
+    log.info(
+        f"Rechunking {len(done)} dates, {len(set().union(*staged.values()))} "
+        f"of them staged, in {len(chunks)} time chunks into {store}, "
+        f"with {len(tasks)} tasks on {processes} processes"
+    )
+
+    deadline = None if seconds is None else time.monotonic() + seconds
+    pending = deque(task for task in tasks if _task_key(task) not in skip)
+    finished = {_task_key(task) for task in tasks} - {
+        _task_key(task) for task in pending
+    }
+
+    def record(task: tuple) -> None:
+        _, _, var, _, _, start, rows, _ = task
+        finished.add(_task_key(task))
+        first_date = CUBE_START + timedelta(days=start)
+        log.info(
+            f"Wrote {var} rows {rows.start}-{rows.stop} from "
+            f"{first_date:{DATE_FORMAT}}, {len(finished)} of {len(tasks)}"
+        )
+
+    def out_of_time() -> bool:
+        return deadline is not None and time.monotonic() > deadline
+
+    if processes == 1:
+        while pending and not out_of_time():
+            task = pending.popleft()
+            _rechunk_rows(*task)
+            record(task)
+    else:
+        # Spawn rather than fork, as forking with GDAL threads running can
+        # deadlock
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=get_mp_context("spawn"),
+            initializer=_init_worker,
+            initargs=(THREADS_PER_PROCESS,),
+        )
+        with pool:
+            running = {}
+            while pending or running:
+                while pending and len(running) < processes and not out_of_time():
+                    task = pending.popleft()
+                    running[pool.submit(_rechunk_rows, *task)] = task
+                if not running:
+                    break
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    task = running.pop(future)
+                    future.result()
+                    record(task)
+
+    complete = len(finished) == len(tasks)
+    if complete and prune:
+        remove_staged(output_location, staged, log=log)
+
+    summary = {
+        "store": store,
+        "dates": len(done),
+        "time_chunks": len(chunks),
+        "tasks": len(tasks),
+        "finished": sorted(finished),
+        "complete": complete,
+        "staged": {
+            var: sorted(f"{date:{DATE_FORMAT}}" for date in dates)
+            for var, dates in staged.items()
+        },
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+    log.info(
+        f"Rechunk {'finished' if complete else 'stopped'} in {summary['seconds']}s, "
+        f"with {len(finished)} of {len(tasks)} tasks written"
+    )
+
+    return summary
+
+
+def _task_key(task: tuple) -> str:
+    _, _, var, _, _, start, rows, _ = task
+    return f"{var}/{start}/{rows.start}"
+
+
+def remove_staged(
+    output_location: Union[Path, S3Path],
+    staged: dict[str, set[datetime]],
+    log: Logger | None = None,
+) -> None:
+    """Remove days from staging once they're in the cube, and the years
+    that have ended and have nothing left staged
+    """
+    try:
+        group = _open_cube(get_staging_path(output_location))
+    except FileNotFoundError:
+        return
+
+    for var, dates in staged.items():
+        for date in sorted(dates):
+            year = group[str(date.year)]
+            index = _day_index(date)
+            # Unflag it first, so it's never read half removed
+            year[f"{var}_staged"][index] = 0
+            array = year[var]
+            # Writing the fill value deletes the chunks
+            for first in range(0, array.shape[1], APPEND_BLOCK):
+                array[index, first : first + APPEND_BLOCK] = array.fill_value
+        if log is not None and dates:
+            log.info(f"Removed {len(dates)} days of {var} from staging")
+
+    # A year can still be staged into for a while after it ends
+    last_year = (datetime.today() - timedelta(days=FOLD_AFTER_DAYS)).year
+    for name, year in list(group.groups()):
+        flags = [array for key, array in year.arrays() if key.endswith("_staged")]
+        if int(name) < last_year and not any(flag[:].any() for flag in flags):
+            del group[name]
+            if log is not None:
+                log.info(f"Removed {name} from staging")
+
+
+def _next_fold_chunk(group: zarr.Group) -> int | None:
+    """The first time chunk that has ended and has days staged"""
+    chunk = CUBE_CHUNKS["time"]
+    ended = _time_index(datetime.today() - timedelta(days=FOLD_AFTER_DAYS)) // chunk
+    chunks = set()
+    for name, year in group.groups():
+        for key, flags in year.arrays():
+            if not key.endswith("_staged"):
+                continue
+            for index in np.flatnonzero(flags[:]):
+                date = datetime(int(name), 1, 1) + timedelta(days=int(index))
+                if _time_index(date) // chunk < ended:
+                    chunks.add(_time_index(date) // chunk)
+
+    return min(chunks, default=None)
+
+
+def fold(
+    output_location: Union[Path, S3Path],
+    processes: int = 1,
+    seconds: float | None = None,
+    log: Logger | None = None,
+) -> dict | None:
+    """Fold the staged days of a time chunk that has ended into the cube
+
+    The chunk's staged days are removed once it's all written. When it
+    runs out of time, the tasks that were written are kept in the staging
+    store's attributes, and the next call carries on from there.
+
+    Returns:
+        dict: The summary from rechunk, or None if there's nothing to fold
+    """
+    if log is None:
+        log = get_logger()
+
+    try:
+        group = _open_cube(get_staging_path(output_location))
+    except FileNotFoundError:
+        log.info("Nothing is staged for the cube")
+        return None
+
+    progress = group.attrs.get(FOLD_ATTR)
+    if progress is None:
+        chunk = _next_fold_chunk(group)
+        if chunk is None:
+            log.info("No time chunks that have ended are staged")
+            return None
+        progress = {"chunk": chunk, "finished": [], "staged": None}
+
+    start = CUBE_START + timedelta(days=progress["chunk"] * CUBE_CHUNKS["time"])
+    end = start + timedelta(days=CUBE_CHUNKS["time"] - 1)
+    log.info(f"Folding the time chunk from {start:%Y-%m-%d} into the cube")
+    summary = rechunk(
+        output_location,
+        [start, end],
+        processes=processes,
+        skip=progress["finished"],
+        seconds=seconds,
+        prune=False,
+        log=log,
+    )
+
+    # Days staged after the fold started may have been missed by the tasks
+    # that were written first, so leave those staged for the next fold
+    if progress["staged"] is None:
+        progress["staged"] = summary["staged"]
+    group = _open_cube(get_staging_path(output_location))
+    if summary["complete"]:
+        remove_staged(
+            output_location,
+            {
+                var: {datetime.strptime(date, "%Y-%m-%d") for date in dates}
+                for var, dates in progress["staged"].items()
+            },
+            log=log,
+        )
+        group.attrs.pop(FOLD_ATTR, None)
+    else:
+        progress["finished"] = summary["finished"]
+        group.attrs[FOLD_ATTR] = progress
+
+    return summary
+
+
+def lambda_handler(event, lambda_context):
+    """Carry on folding staged days into the cube, on a schedule"""
+    log = get_logger()
+    log.info(f"Event: {event}")
+
+    output_location = get_location(
+        os.environ.get("OUTPUT_LOCATION", "s3://files.auspatious.com/ghrsst/")
+    )
+    processes = int(os.environ.get("FOLD_PROCESSES", 1))
+    min_remaining = int(os.environ.get("MIN_REMAINING_SECONDS", MIN_REMAINING_SECONDS))
+    seconds = lambda_context.get_remaining_time_in_millis() / 1000 - min_remaining
+
+    with environ(get_context()):
+        fold(output_location, processes=processes, seconds=seconds, log=log)
+
+
+@click.option("--output-location", type=str)
+@click.option("--start-date", type=str)
+@click.option("--end-date", type=str)
+@click.option("--processes", type=int, default=os.cpu_count())
+@click.option("--window", type=int, default=RECHUNK_WINDOW)
+@click.option("--fold/--no-fold", "fold_staged", is_flag=True, default=False)
+@click.command("ghrsst-cube")
+def main(output_location, start_date, end_date, processes, window, fold_staged):
+    from ghrsst.backfill import get_dates
+
+    log = get_logger()
+    output_location = get_location(output_location)
+
+    # Only catch known exceptions, and otherwise let the program crash
+    try:
+        with environ(get_context()):
+            if fold_staged:
+                fold(output_location, processes=processes, log=log)
+                return
+            rechunk(
+                output_location,
+                get_dates(start_date, end_date),
+                processes=processes,
+                window=window,
+                log=log,
+            )
+    except GHRSSTException as e:
+        print(f"Failed to rechunk with error {e}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,63 @@
 import json
 import os
 from datetime import datetime, timedelta
+from logging import Logger
 
 import boto3
+import click
+from botocore.exceptions import ClientError
 
-from ghrsst.cogger import get_logger
+from ghrsst.cogger import environ, get_context, get_location, get_logger
+from ghrsst.index import filter_done
 
-N_PREVIOUS_DAYS = os.environ.get("N_PREVIOUS_DAYS", 7)
+N_PREVIOUS_DAYS = int(os.environ.get("N_PREVIOUS_DAYS", 7))
 QUEUE_NAME = os.environ.get("QUEUE_NAME", "ghrsst-queue")
+# SQS takes at most 10 messages per batch
+SQS_BATCH_SIZE = 10
+# Errors from an index that's missing or can't be read, rather than a fault
+INDEX_ERROR_CODES = ["AccessDenied", "403", "NoSuchKey", "404", "NoSuchBucket"]
+
+
+def remove_done_dates(
+    dates: list[datetime], output_location: str | None, log: Logger
+) -> list[datetime]:
+    """Drop the dates that the index says are already done, or keep them all
+    if it can't be read, as dates that are done are skipped anyway
+    """
+    if output_location is None:
+        return dates
+
+    try:
+        with environ(get_context()):
+            todo = filter_done(get_location(output_location), dates)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code not in INDEX_ERROR_CODES:
+            raise
+        log.warning(f"Couldn't read the index ({code}), queueing every date: {e}")
+        return dates
+
+    log.info(f"Skipping {len(dates) - len(todo)} dates that are already done")
+    return todo
+
+
+def send_dates(dates: list[datetime], queue_name: str, log: Logger) -> int:
+    log.info(f"Getting queue: {queue_name}")
+    sqs = boto3.resource("sqs")
+    queue = sqs.get_queue_by_name(QueueName=queue_name)
+
+    messages = []
+    for dt in dates:
+        body = {
+            "date": dt.strftime("%Y-%m-%d"),
+        }
+        messages.append({"Id": body["date"], "MessageBody": json.dumps(body)})
+
+    log.info(f"Sending {len(messages)} messages")
+    for i in range(0, len(messages), SQS_BATCH_SIZE):
+        queue.send_messages(Entries=messages[i : i + SQS_BATCH_SIZE])
+
+    return len(messages)
 
 
 def lambda_handler(event, _):
@@ -18,19 +68,40 @@ def lambda_handler(event, _):
     log.info(f"Event: {event}")
     log.info(f"Working on date: {today:%Y-%m-%d}")
 
-    messages = []
+    dates = [today - timedelta(days=i) for i in range(N_PREVIOUS_DAYS)]
+    dates = remove_done_dates(dates, os.environ.get("OUTPUT_LOCATION"), log)
 
-    for i in range(N_PREVIOUS_DAYS):
-        dt = today - timedelta(days=i)
+    if len(dates) == 0:
+        log.info("All dates are already done, nothing to send")
+        return
 
-        body = {
-            "date": dt.strftime("%Y-%m-%d"),
-        }
-        messages.append({"Id": body["date"], "MessageBody": json.dumps(body)})
+    send_dates(dates, QUEUE_NAME, log)
 
-    log.info(f"Getting queue: {QUEUE_NAME}")
-    sqs = boto3.resource("sqs")
-    queue = sqs.get_queue_by_name(QueueName=QUEUE_NAME)
 
-    log.info(f"Sending {len(messages)} messages")
-    queue.send_messages(Entries=messages)
+@click.option("--start-date", type=str)
+@click.option("--end-date", type=str)
+@click.option("--output-location", type=str, default=None)
+@click.option("--queue-name", type=str, default=QUEUE_NAME)
+@click.option("--dry-run/--no-dry-run", is_flag=True, default=False)
+@click.command("ghrsst-enqueue")
+def main(start_date, end_date, output_location, queue_name, dry_run):
+    log = get_logger()
+    start_date = datetime.strptime(start_date, "%Y-%m-%d")
+    end_date = datetime.strptime(end_date, "%Y-%m-%d")
+
+    dates = [
+        start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)
+    ]
+    dates = remove_done_dates(dates, output_location, log)
+
+    if dry_run:
+        click.echo(f"Would send {len(dates)} dates to {queue_name}")
+    elif len(dates) > 0:
+        sent = send_dates(dates, queue_name, log)
+        click.echo(f"Sent {sent} dates to {queue_name}")
+    else:
+        click.echo("All dates are already done, nothing to send")
+
+
+if __name__ == "__main__":
+    main()
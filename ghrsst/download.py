@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from pathlib import Path
+from threading import Lock
+
+from ghrsst.cogger import GHRSSTException
+from ghrsst.session import url_to_fs
+
+PART_SIZE = 16 * 2**20
+DOWNLOAD_WORKERS = 8
+RETRIES = 3
+
+
+def _state_path(destination: Path) -> Path:
+    return destination.with_name(destination.name + ".parts")
+
+
+def _read_state(destination: Path, size: int, part_size: int) -> set[int]:
+    """Get the parts that are already downloaded, if we're resuming"""
+    state_path = _state_path(destination)
+    if not state_path.exists() or not destination.exists():
+        return set()
+
+    state = json.loads(state_path.read_text())
+    if state["size"] != size or state["part_size"] != part_size:
+        return set()
+
+    return set(state["done"])
+
+
+def _write_state(destination: Path, size: int, part_size: int, done: set[int]):
+    state = {"size": size, "part_size": part_size, "done": sorted(done)}
+    _state_path(destination).write_text(json.dumps(state))
+
+
+def get_md5(url: str, headers: dict[str, str] | None = None) -> str | None:
+    """Get the checksum that JPL publishes next to each file, if there is one
+
+    It's only a check, so if it can't be fetched for any reason, like a 403,
+    there's no checksum rather than a failed download.
+    """
+    try:
+        fs, path = url_to_fs(url + ".md5", headers)
+        with fs.open(path, "rt") as f:
+            return f.read().split()[0]
+    except Exception:
+        return None
+
+
+def _md5(path: Path) -> str:
+    md5 = hashlib.md5()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(PART_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def download_file(
+    url: str,
+    destination: Path,
+    headers: dict[str, str] | None = None,
+    md5: str | None = None,
+    part_size: int = PART_SIZE,
+    workers: int = DOWNLOAD_WORKERS,
+    retries: int = RETRIES,
+    log: Logger | None = None,
+) -> Path:
+    """Download a file in parallel byte ranges into a preallocated local file
+
+    Finished parts are recorded next to the file, so calling this again
+    after a failure only fetches the parts that are missing. Peak memory
+    is one part per worker.
+    """
+    fs, path = url_to_fs(url, headers)
+    size = fs.size(path)
+
+    if destination.exists() and not _state_path(destination).exists():
+        # Only keep a finished download if it's the file we want, otherwise
+        # download it again
+        if destination.stat().st_size == size and (
+            md5 is None or _md5(destination) == md5
+        ):
+            if log is not None:
+                log.info(f"Already downloaded {url} to {destination}")
+            return destination
+        if log is not None:
+            log.warning(f"{destination} doesn't match {url}, downloading it again")
+
+    parts = [
+        (index, start, min(start + part_size, size))
+        for index, start in enumerate(range(0, size, part_size))
+    ]
+    done = _read_state(destination, size, part_size)
+
+    if not done:
+        # Create a sparse file of the right size, to write the parts into
+        with destination.open("wb") as f:
+            f.truncate(size)
+        _write_state(destination, size, part_size, done)
+    elif log is not None:
+        log.info(f"Resuming download of {url}, {len(done)} of {len(parts)} parts done")
+
+    lock = Lock()
+    fd = os.open(destination, os.O_WRONLY)
+
+    def fetch(part):
+        index, start, end = part
+        for attempt in range(retries):
+            try:
+                data = fs.cat_file(path, start=start, end=end)
+                if len(data) != end - start:
+                    raise IOError(
+                        f"Got {len(data)} bytes for part {index}, expected {end - start}"
+                    )
+                break
+            except FileNotFoundError:
+                raise
+            except Exception:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(2**attempt)
+
+        os.pwrite(fd, data, start)
+        with lock:
+            done.add(index)
+            _write_state(destination, size, part_size, done)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Consume the results, so that any errors are raised
+            list(executor.map(fetch, [part for part in parts if part[0] not in done]))
+    finally:
+        os.close(fd)
+
+    if destination.stat().st_size != size:
+        raise GHRSSTException(
+            f"Downloaded {destination.stat().st_size} bytes of {url}, expected {size}"
+        )
+
+    if md5 is not None and _md5(destination) != md5:
+        destination.unlink()
+        _state_path(destination).unlink()
+        raise GHRSSTException(f"Checksum mismatch for {url}, removed the download")
+
+    _state_path(destination).unlink()
+
+    if log is not None:
+        log.info(f"Downloaded {size} bytes from {url} in {len(parts)} parts")
+
+    return destination
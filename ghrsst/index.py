@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import fcntl
+import os
+import random
+import time
+from datetime import datetime
+from logging import Logger
+from pathlib import Path
+from typing import Iterable, Union
+
+import click
+from botocore.exceptions import ClientError
+from s3path import S3Path
+
+from ghrsst.cogger import (
+    _is_s3_path,
+    environ,
+    get_context,
+    get_location,
+    get_logger,
+    get_s3_client,
+)
+
+INDEX_FOLDER = "index"
+DATE_FORMAT = "%Y-%m-%d"
+# Conditional writes fail when another Lambda updates the index first
+CONFLICT_CODES = ["PreconditionFailed", "ConditionalRequestConflict"]
+RETRIES = 10
+
+
+def get_index_path(
+    output_location: Union[Path, S3Path], year: int
+) -> Union[Path, S3Path]:
+    return output_location / INDEX_FOLDER / f"{year}.txt"
+
+
+def _parse(text: str) -> set[str]:
+    return {line.strip() for line in text.splitlines() if line.strip()}
+
+
+def _render(dates: Iterable[str]) -> str:
+    return "".join(f"{date}\n" for date in sorted(dates))
+
+
+def _read_s3(index_path: S3Path) -> tuple[set[str], str | None]:
+    s3 = get_s3_client()
+    try:
+        response = s3.get_object(Bucket=index_path.bucket, Key=index_path.key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return set(), None
+        raise
+
+    return _parse(response["Body"].read().decode()), response["ETag"]
+
+
+def read_index(output_location: Union[Path, S3Path], year: int) -> set[str]:
+    """Get the dates that are done for a year, as YYYY-MM-DD strings"""
+    index_path = get_index_path(output_location, year)
+    if _is_s3_path(index_path):
+        return _read_s3(index_path)[0]
+    elif index_path.exists():
+        return _parse(index_path.read_text())
+    else:
+        return set()
+
+
+def _write_s3(index_path: S3Path, dates: Iterable[str], **condition) -> None:
+    get_s3_client().put_object(
+        Bucket=index_path.bucket,
+        Key=index_path.key,
+        Body=_render(dates),
+        ACL="bucket-owner-full-control",
+        ContentType="text/plain",
+        **condition,
+    )
+
+
+def write_index(
+    output_location: Union[Path, S3Path], year: int, dates: Iterable[str]
+) -> None:
+    index_path = get_index_path(output_location, year)
+    if _is_s3_path(index_path):
+        _write_s3(index_path, dates)
+    else:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        index_path.write_text(_render(dates))
+
+
+def _mark_done_s3(index_path: S3Path, date_str: str, log: Logger | None) -> None:
+    for attempt in range(RETRIES):
+        dates, etag = _read_s3(index_path)
+        if date_str in dates:
+            return
+
+        # Only write if nobody else has changed the index since we read it
+        condition = {"IfMatch": etag} if etag is not None else {"IfNoneMatch": "*"}
+        try:
+            _write_s3(index_path, dates | {date_str}, **condition)
+            return
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "NotImplemented":
+                # Not every S3-compatible endpoint has conditional writes
+                if log is not None:
+                    log.warning("Conditional writes aren't supported, writing anyway")
+                _write_s3(index_path, dates | {date_str})
+                return
+            if code not in CONFLICT_CODES or attempt == RETRIES - 1:
+                raise
+            time.sleep(random.uniform(0, 0.1 * 2**attempt))
+
+
+def mark_done(
+    output_location: Union[Path, S3Path], date: datetime, log: Logger | None = None
+) -> None:
+    """Add a date to the index of finished dates"""
+    index_path = get_index_path(output_location, date.year)
+    date_str = f"{date:{DATE_FORMAT}}"
+
+    if _is_s3_path(index_path):
+        _mark_done_s3(index_path, date_str, log)
+    else:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        # Lock so that concurrent local workers don't lose each other's dates
+        with open(index_path.with_suffix(".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dates = read_index(output_location, date.year)
+            if date_str not in dates:
+                temp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+                temp_path.write_text(_render(dates | {date_str}))
+                os.replace(temp_path, index_path)
+
+    if log is not None:
+        log.info(f"Marked {date_str} as done in {index_path}")
+
+
+def filter_done(
+    output_location: Union[Path, S3Path], dates: list[datetime]
+) -> list[datetime]:
+    """Remove the dates that are already done, reading one index per year"""
+    done = set()
+    for year in sorted({date.year for date in dates}):
+        done |= read_index(output_location, year)
+
+    return [date for date in dates if f"{date:{DATE_FORMAT}}" not in done]
+
+
+def rebuild_index(
+    output_location: Union[Path, S3Path], year: int, log: Logger | None = None
+) -> set[str]:
+    """Rebuild a year's index from the STAC items that exist"""
+    stac_suffix = ".stac-item.json"
+    dates = set()
+
+    if _is_s3_path(output_location):
+        s3 = get_s3_client()
+        prefix = f"{output_location.key.rstrip('/')}/{year}/".lstrip("/")
+        for page in s3.get_paginator("list_objects_v2").paginate(
+            Bucket=output_location.bucket, Prefix=prefix
+        ):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(stac_suffix):
+                    month, day = obj["Key"][len(prefix) :].split("/")[:2]
+                    dates.add(f"{year}-{month}-{day}")
+    else:
+        for path in (output_location / str(year)).glob(f"*/*/*{stac_suffix}"):
+            dates.add(f"{year}-{path.parent.parent.name}-{path.parent.name}")
+
+    write_index(output_location, year, dates)
+
+    if log is not None:
+        log.info(f"Rebuilt the index for {year} with {len(dates)} dates")
+
+    return dates
+
+
+@click.option("--output-location", type=str)
+@click.option("--start-year", type=int, default=2002)
+@click.option("--end-year", type=int, default=datetime.today().year)
+@click.command("ghrsst-index")
+def main(output_location, start_year, end_year):
+    log = get_logger()
+    output_location = get_location(output_location)
+
+    with environ(get_context()):
+        for year in range(start_year, end_year + 1):
+            rebuild_index(output_location, year, log=log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+NAMESPACE = "GHRSST"
+# How often to sample memory use while a stage runs
+SAMPLE_SECONDS = 0.05
+UNITS = {
+    "Seconds": "Seconds",
+    "PeakRSS": "Megabytes",
+    "BytesRead": "Bytes",
+    "BytesWritten": "Bytes",
+}
+
+
+def _rss() -> int:
+    """Resident memory of this process, in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except FileNotFoundError:
+        import resource
+
+        # Not Linux, so fall back to the peak so far, which macOS gives in bytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _io() -> tuple[int, int]:
+    """Bytes this process has read and written, including over the network"""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except FileNotFoundError:
+        return 0, 0
+
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+@contextmanager
+def measure(stage: str, results: dict):
+    """Record the time a stage takes, the peak memory while it runs, and the
+    bytes read and written
+
+    Memory is sampled from a thread, so it includes what GDAL, HDF5 and
+    dask allocate outside of Python. Memory and IO are for the whole
+    process, so they include anything else running at the same time.
+    """
+    start_rss = _rss()
+    start_read, start_written = _io()
+    peak = [start_rss]
+    stop = Event()
+
+    def sample():
+        while not stop.wait(SAMPLE_SECONDS):
+            peak[0] = max(peak[0], _rss())
+
+    sampler = Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        stop.set()
+        sampler.join()
+        peak[0] = max(peak[0], _rss())
+        read, written = _io()
+
+        results[stage] = {
+            "seconds": round(seconds, 3),
+            "peak_rss_mb": round(peak[0] / 2**20, 1),
+            "peak_increase_mb": round((peak[0] - start_rss) / 2**20, 1),
+            "bytes_read": read - start_read,
+            "bytes_written": written - start_written,
+        }
+
+
+def to_emf(
+    record: dict, stage: str, date: datetime, variable: str | None = None
+) -> dict:
+    """A stage's record in CloudWatch Embedded Metric Format"""
+    dimensions = ["Stage"] if variable is None else ["Stage", "Variable"]
+    emf = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [dimensions],
+                    "Metrics": [
+                        {"Name": name, "Unit": unit} for name, unit in UNITS.items()
+                    ],
+                }
+            ],
+        },
+        "Stage": stage,
+        "Date": f"{date:%Y-%m-%d}",
+        "Seconds": record["seconds"],
+        "PeakRSS": record["peak_rss_mb"],
+        "BytesRead": record["bytes_read"],
+        "BytesWritten": record["bytes_written"],
+    }
+    if variable is not None:
+        emf["Variable"] = variable
+
+    return emf
+
+
+class Metrics:
+    """Times the stages of processing a date, and emits each as it finishes
+
+    Lines go to stdout, which CloudWatch reads as metrics when running in
+    Lambda, or are appended to a file.
+    """
+
+    def __init__(self, date: datetime, metrics_file: str | None = None):
+        self.date = date
+        self.metrics_file = metrics_file
+        self.stages = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def stage(self, name: str, variable: str | None = None):
+        results = {}
+        try:
+            with measure(name, results):
+                yield
+        finally:
+            # Emit even if the stage fails, so we can see where time went
+            self._emit(name, variable, results[name])
+
+    def _emit(self, name: str, variable: str | None, record: dict) -> None:
+        line = json.dumps(to_emf(record, name, self.date, variable))
+        with self._lock:
+            key = name if variable is None else f"{name}/{variable}"
+            self.stages[key] = record
+            if self.metrics_file is None:
+                print(line, flush=True)
+            else:
+                with open(self.metrics_file, "a") as f:
+                    f.write(line + "\n")
+
+
+def stage(metrics: Metrics | None, name: str, variable: str | None = None):
+    """Measure a stage if we're collecting metrics, otherwise do nothing"""
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(name, variable)
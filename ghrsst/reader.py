@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+from datetime import datetime
+from logging import Logger
+from pathlib import Path
+from typing import Union
+
+import click
+import xarray as xr
+from fsspec.utils import get_protocol
+from s3path import S3Path
+from xarray import Dataset
+
+from ghrsst.cogger import (
+    DROP_VARIABLES,
+    GHRSSTException,
+    _exists,
+    get_headers,
+    get_input_path,
+    get_location,
+    get_logger,
+    get_output_path,
+)
+from ghrsst.session import get_http_filesystem, url_to_fs
+
+# The HDF5 metadata is small and scattered through the file, so read it
+# in blocks and keep them, rather than making a request per B-tree node
+BLOCK_SIZE = 2 * 2**20
+REFERENCES_EXTENSION = ".refs.json"
+
+
+def create_references(
+    input_path: str,
+    headers: dict[str, str] | None = None,
+    drop_variables: list[str] = DROP_VARIABLES,
+) -> dict:
+    """Create kerchunk references to the chunks of each variable in a NetCDF
+
+    Only the HDF5 metadata is read, using ranged requests.
+    """
+    from kerchunk.hdf import SingleHdf5ToZarr
+
+    # kerchunk turns on debug logging for itself
+    logging.getLogger("h5-to-zarr").setLevel(logging.WARNING)
+
+    fs, path = url_to_fs(input_path, headers)
+    with fs.open(path, "rb", block_size=BLOCK_SIZE, cache_type="blockcache") as f:
+        references = SingleHdf5ToZarr(f, input_path).translate()
+
+    # Drop the variables we never use, so their chunks can't be fetched
+    references["refs"] = {
+        key: value
+        for key, value in references["refs"].items()
+        if key.split("/")[0] not in drop_variables
+    }
+
+    return references
+
+
+def open_references(
+    references: dict, input_path: str, headers: dict[str, str] | None = None
+) -> Dataset:
+    """Lazily open a NetCDF through its references
+
+    Chunks are only fetched, with concurrent ranged requests, when a
+    variable's data is computed.
+    """
+    protocol = get_protocol(input_path)
+    if protocol in ("http", "https"):
+        remote = {"fs": {protocol: get_http_filesystem(headers, asynchronous=True)}}
+    else:
+        remote = {"remote_protocol": protocol}
+
+    return xr.open_dataset(
+        "reference://",
+        engine="zarr",
+        chunks={},
+        mask_and_scale=False,
+        zarr_format=2,
+        backend_kwargs={
+            "consolidated": False,
+            "storage_options": {"fo": references, **remote},
+        },
+    )
+
+
+def get_references(
+    date: datetime,
+    input_location: str,
+    references_location: Union[Path, S3Path, None] = None,
+    headers: dict[str, str] | None = None,
+    log: Logger | None = None,
+) -> dict:
+    """Get the references for a date, from the index if we have it, or
+    by scanning the file and saving them to the index if we don't
+    """
+    references_path = None
+    if references_location is not None:
+        references_path = get_output_path(
+            references_location, date, REFERENCES_EXTENSION
+        )
+        if _exists(references_path):
+            if log is not None:
+                log.info(f"Reading references from {references_path}")
+            return json.loads(references_path.read_text())
+
+    input_path = get_input_path(input_location, date)
+    if log is not None:
+        log.info(f"Creating references for {input_path}")
+    references = create_references(input_path, headers=headers)
+
+    if references_path is not None:
+        if isinstance(references_path, Path):
+            references_path.parent.mkdir(parents=True, exist_ok=True)
+        references_path.write_text(json.dumps(references))
+
+    return references
+
+
+def open_ranged(
+    date: datetime,
+    input_location: str,
+    references_location: Union[Path, S3Path, None] = None,
+    headers: dict[str, str] | None = None,
+    log: Logger | None = None,
+) -> Dataset:
+    """Open a date's NetCDF, reading only the chunks of the variables we need"""
+    references = get_references(
+        date, input_location, references_location, headers=headers, log=log
+    )
+
+    return open_references(
+        references, get_input_path(input_location, date), headers=headers
+    )
+
+
+@click.option("--date", type=str)
+@click.option("--input-location", type=str, default="JPL")
+@click.option("--output-location", type=str)
+@click.command("ghrsst-references")
+def main(date, input_location, output_location):
+    date = datetime.strptime(date, "%Y-%m-%d")
+    output_location = get_location(output_location)
+
+    try:
+        headers = None
+        if input_location.upper() == "JPL":
+            headers = get_headers()
+
+        get_references(
+            date, input_location, output_location, headers=headers, log=get_logger()
+        )
+    except GHRSSTException as e:
+        print(f"Failed to create references for {date:%Y-%m-%d} with error {e}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import time
+from functools import partial
+from threading import Lock
+
+import aiohttp
+import fsspec
+from fsspec.implementations.http import HTTPFileSystem
+from fsspec.utils import get_protocol
+from yarl import URL
+
+# Connections kept open to each host, which bounds concurrent requests
+HTTP_CONCURRENCY = 16
+# Bytes each read of an open file fetches, as fsspec's default does
+HTTP_BLOCK_SIZE = 5 * 2**20
+# How long to keep idle connections open between dates
+KEEPALIVE_SECONDS = 60
+# Use a redirect target until this long before it expires. Targets that
+# don't say when they expire, like a CDN, are kept for REDIRECT_SECONDS
+REDIRECT_MARGIN_SECONDS = 60
+REDIRECT_SECONDS = 10 * 60
+
+_FILESYSTEMS = {}
+_FILESYSTEMS_LOCK = Lock()
+
+
+def _redirect_seconds(target: URL) -> float:
+    """How long a redirect target can be used, from its signature if it's
+    a presigned S3 URL
+    """
+    expires = target.query.get("X-Amz-Expires")
+    if expires is None:
+        return REDIRECT_SECONDS
+    return max(int(expires) - REDIRECT_MARGIN_SECONDS, 0)
+
+
+class RedirectCachingSession:
+    """An aiohttp session that remembers where each URL redirected to
+
+    Earthdata sends every request through a chain of redirects before it
+    gets to the signed URL the file is really at. Later requests for the
+    same URL go straight there until the signature expires.
+    """
+
+    def __init__(self, **kwargs):
+        self._redirects = {}
+        self._session = aiohttp.ClientSession(
+            trace_configs=[self._trace_config()], **kwargs
+        )
+
+    def _resolve(self, url, kwargs: dict):
+        redirect = self._redirects.get(str(url))
+        if redirect is None:
+            return url, kwargs
+
+        target, expires = redirect
+        if time.monotonic() > expires:
+            self._redirects.pop(str(url), None)
+            return url, kwargs
+
+        # As aiohttp does when following a redirect to another host
+        if URL(str(url)).origin() != target.origin():
+            headers = {
+                key: value
+                for key, value in (kwargs.get("headers") or {}).items()
+                if key.lower() != "authorization"
+            }
+            kwargs = dict(kwargs, headers=headers)
+
+        return target, kwargs
+
+    async def _on_request_start(self, session, context, params):
+        context.url = str(params.url)
+        context.redirected = False
+
+    async def _on_request_redirect(self, session, context, params):
+        context.redirected = True
+
+    async def _on_request_end(self, session, context, params):
+        if context.redirected and params.response.status < 400:
+            self._redirects[context.url] = (
+                params.url,
+                time.monotonic() + _redirect_seconds(params.url),
+            )
+        elif params.response.status in (401, 403):
+            # Most likely an expired signature, so go the long way next time
+            for url, (target, _) in list(self._redirects.items()):
+                if target == params.url:
+                    self._redirects.pop(url, None)
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_request_redirect.append(self._on_request_redirect)
+        trace.on_request_end.append(self._on_request_end)
+        return trace
+
+    def get(self, url, **kwargs):
+        url, kwargs = self._resolve(url, kwargs)
+        return self._session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        url, kwargs = self._resolve(url, kwargs)
+        return self._session.head(url, **kwargs)
+
+    def __getattr__(self, name):
+        # fsspec closes the session and its connector when it's done with it
+        return getattr(self._session, name)
+
+
+async def _get_client(concurrency: int, **kwargs) -> RedirectCachingSession:
+    connector = aiohttp.TCPConnector(
+        limit_per_host=concurrency,
+        keepalive_timeout=KEEPALIVE_SECONDS,
+        ttl_dns_cache=KEEPALIVE_SECONDS,
+    )
+    return RedirectCachingSession(connector=connector, **kwargs)
+
+
+def get_http_filesystem(
+    headers: dict[str, str] | None = None,
+    concurrency: int | None = None,
+    block_size: int | None = None,
+    asynchronous: bool = False,
+) -> HTTPFileSystem:
+    """Get the HTTP filesystem for these headers, shared by every read in
+    the process so connections and redirects are reused between dates
+
+    Concurrency and block size default to HTTP_CONCURRENCY and
+    HTTP_BLOCK_SIZE, from the environment if they're set there.
+
+    Args:
+        asynchronous (bool): Get the one for zarr, which reads on its own
+            event loop. An aiohttp session only works on the loop it was
+            made on, so it can't share fsspec's.
+    """
+    if concurrency is None:
+        concurrency = int(os.environ.get("HTTP_CONCURRENCY", HTTP_CONCURRENCY))
+    if block_size is None:
+        block_size = int(os.environ.get("HTTP_BLOCK_SIZE", HTTP_BLOCK_SIZE))
+
+    key = (
+        tuple(sorted((headers or {}).items())),
+        concurrency,
+        block_size,
+        asynchronous,
+    )
+    with _FILESYSTEMS_LOCK:
+        if key not in _FILESYSTEMS:
+            _FILESYSTEMS[key] = HTTPFileSystem(
+                headers=headers or {},
+                block_size=block_size,
+                get_client=partial(_get_client, concurrency),
+                asynchronous=asynchronous,
+                skip_instance_cache=True,
+            )
+
+    return _FILESYSTEMS[key]
+
+
+def url_to_fs(
+    url: str, headers: dict[str, str] | None = None
+) -> tuple[fsspec.AbstractFileSystem, str]:
+    """Get the filesystem for a URL, which for HTTP is the shared one"""
+    if get_protocol(url) in ("http", "https"):
+        return get_http_filesystem(headers), url
+    return fsspec.core.url_to_fs(url)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+from pathlib import Path
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+from ghrsst.cogger import FILE_STRING
+
+# The full MUR grid, at 0.01 degrees
+MUR_SHAPE = (17999, 36000)
+# The chunking of the variables in the MUR NetCDFs
+MUR_CHUNKS = (1, 1023, 2047)
+
+
+def _variable(values, dtype: str, fill: int, land=None, **attrs) -> xr.Variable:
+    values = values.round()
+    if land is not None:
+        values = da.where(land, fill, values)
+    chunks = tuple(min(c, s) for c, s in zip(MUR_CHUNKS, values[None].shape))
+
+    return xr.Variable(
+        ("time", "lat", "lon"),
+        values.astype(dtype)[None],
+        attrs=attrs,
+        encoding={"_FillValue": fill, "zlib": True, "chunksizes": chunks},
+    )
+
+
+def make_synthetic_dataset(
+    shape: tuple[int, int] = MUR_SHAPE, date: datetime = datetime(2023, 11, 6), seed=0
+) -> xr.Dataset:
+    """A dataset with the same variables, encoding and grid as a MUR NetCDF
+
+    The fields are smooth with a little noise, and have land and sea ice, so
+    that they compress about as well as the real thing. Values are made
+    lazily, chunk by chunk, so even the full grid can be written to disk.
+    """
+    ny, nx = shape
+    lat = np.linspace(-89.99, 89.99, ny, dtype="float32")
+    lon = np.linspace(-179.99, 180.0, nx, dtype="float32")
+
+    chunks = MUR_CHUNKS[1:]
+    lat_2d = da.from_array(np.radians(lat), chunks=chunks[0])[:, None]
+    lon_2d = da.from_array(np.radians(lon), chunks=chunks[1])[None, :]
+    noise = da.random.RandomState(seed).standard_normal(shape, chunks=chunks)
+
+    land = da.sin(3 * lon_2d) * da.cos(2 * lat_2d) > 0.6
+    ice = (abs(lat_2d) > np.radians(70)) & ~land
+
+    sst_kelvin = 271.35 + 30 * da.cos(lat_2d) ** 2 + 0.5 * da.sin(8 * lon_2d)
+    sst_kelvin = da.where(ice, 271.35, sst_kelvin + 0.05 * noise)
+    ice_fraction = da.where(ice, (abs(lat_2d) - np.radians(70)) / np.radians(20), 0)
+
+    variables = {
+        "analysed_sst": _variable(
+            (sst_kelvin - 298.15) / 0.001,
+            "int16",
+            -32768,
+            land,
+            scale_factor=0.001,
+            add_offset=298.15,
+            units="kelvin",
+        ),
+        "analysis_error": _variable(
+            (0.4 + 0.05 * noise) / 0.01,
+            "int16",
+            -32768,
+            land,
+            scale_factor=0.01,
+            add_offset=0.0,
+            units="kelvin",
+        ),
+        "mask": _variable(
+            da.where(land, 2, da.where(ice, 9, 1)),
+            "int8",
+            -128,
+            flag_masks=[1, 2, 4, 8, 16],
+        ),
+        "sea_ice_fraction": _variable(
+            ice_fraction / 0.01,
+            "int8",
+            -128,
+            ~ice,
+            scale_factor=0.01,
+            add_offset=0.0,
+            units="1",
+        ),
+        "sst_anomaly": _variable(
+            (0.5 * da.sin(4 * lat_2d) * da.cos(4 * lon_2d) + 0.1 * noise) / 0.001,
+            "int16",
+            -32768,
+            land,
+            scale_factor=0.001,
+            add_offset=0.0,
+            units="kelvin",
+        ),
+        "dt_1km_data": _variable(
+            da.zeros(shape, chunks=chunks), "int8", -128, land, units="hours"
+        ),
+    }
+
+    return xr.Dataset(
+        variables,
+        coords={
+            "time": [np.datetime64(f"{date:%Y-%m-%d}T09:00:00", "ns")],
+            "lat": ("lat", lat, {"units": "degrees_north"}),
+            "lon": ("lon", lon, {"units": "degrees_east"}),
+        },
+    )
+
+
+def write_synthetic_file(
+    folder: Path,
+    date: datetime = datetime(2023, 11, 6),
+    shape: tuple[int, int] = MUR_SHAPE,
+    seed=0,
+) -> Path:
+    """Write a synthetic NetCDF, named as JPL names them, into a folder"""
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / FILE_STRING.format(date=date)
+    make_synthetic_dataset(shape, date, seed).to_netcdf(path, engine="h5netcdf")
+
+    return path
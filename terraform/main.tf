@@ -18,6 +18,30 @@ variable "destination_bucket_path" {
   default     = "s3://fake-test-bucket/path/"
 }
 
+locals {
+  # The bucket that destination_bucket_path is in
+  destination_bucket = split("/", trimprefix(var.destination_bucket_path, "s3://"))[0]
+}
+
+# Each date takes about 5 minutes, so the last date of a batch starts about
+# (batch_size - 1) x 300 seconds in. A date isn't started with less than
+# MIN_REMAINING_SECONDS of the timeout left, and one handed back unstarted
+# still counts towards maxReceiveCount, so leave that with room to spare:
+# 2 dates leave 600 seconds for the second, where 3 would leave only 300.
+variable "batch_size" {
+  description = "The number of dates each cogger lambda processes per invocation"
+  type        = number
+  default     = 2
+}
+
+# Decode into memory-mapped files on ephemeral storage, which needs about
+# 5.6 GB for a date and its cached input
+variable "memmap" {
+  description = "Whether the cogger lambda decodes dates into memory-mapped files"
+  type        = bool
+  default     = false
+}
+
 variable "image_tag" {
   description = "The image URL for the lambda docker image"
   type        = string
@@ -99,10 +123,10 @@ resource "aws_cloudwatch_log_group" "ghrsst_log_group" {
 resource "aws_lambda_function" "ghrsst_lambda" {
   function_name = "ghrsst-lambda"
   role          = aws_iam_role.ghrsst_role.arn
-  timeout       = 480   # 8 minutes
+  timeout       = 900   # 15 minutes, to fit a batch of dates
   memory_size   = 10240 # 10240 10 GB
   ephemeral_storage {
-    size = 6000
+    size = var.memmap ? 8192 : 6000
   }
 
   # Run a dockerfile
@@ -117,7 +141,11 @@ resource "aws_lambda_function" "ghrsst_lambda" {
       # SOURCECOOP_AWS_ACCESS_KEY_ID = data.aws_secretsmanager_secret_version.aws_access_key_id.secret_string,
       # SOURCECOOP_AWS_SECRET_ACCESS_KEY = data.aws_secretsmanager_secret_version.aws_secret_access_key.secret_string,
       OUTPUT_LOCATION = "s3://${var.destination_bucket_path}",
+      # Goes with batch_size and the timeout
+      MIN_REMAINING_SECONDS = "300",
       CACHE_LOCAL     = "true"
+      WRITE_WORKERS   = "5"
+      MEMMAP          = var.memmap ? "true" : "false"
     }
   }
 }
@@ -157,7 +185,8 @@ resource "aws_iam_policy" "ghrsst_writer_policy" {
       ],
       "Resource": [
         "${aws_cloudwatch_log_group.ghrsst_log_group.arn}:*",
-        "${aws_cloudwatch_log_group.parquet.arn}:*"
+        "${aws_cloudwatch_log_group.parquet.arn}:*",
+        "${aws_cloudwatch_log_group.cube.arn}:*"
       ],
       "Effect": "Allow"
     },
@@ -174,6 +203,7 @@ resource "aws_iam_policy" "ghrsst_writer_policy" {
       "Action": [
         "s3:GetObject",
         "s3:PutObject",
+        "s3:DeleteObject",
         "s3:ListBucket",
         "s3:ListMultiPartUploadParts",
         "s3:AbortMultipartUpload"
@@ -201,7 +231,10 @@ resource "aws_iam_role_policy_attachment" "ghrsst_role_policy_attachment" {
 resource "aws_lambda_event_source_mapping" "sqs_event_source_mapping" {
   event_source_arn = aws_sqs_queue.ghrsst_queue.arn
   function_name    = aws_lambda_function.ghrsst_lambda.function_name
-  batch_size       = 1
+  batch_size       = var.batch_size
+
+  # Only retry the dates that failed, not the whole batch
+  function_response_types = ["ReportBatchItemFailures"]
 }
 
 # Set up a second log group
@@ -228,6 +261,8 @@ resource "aws_lambda_function" "daily_lambda" {
   environment {
     variables = {
       SQS_QUEUE = aws_sqs_queue.ghrsst_queue.name
+      # Used to read the index of dates that are already done
+      OUTPUT_LOCATION = "s3://${var.destination_bucket_path}",
     }
   }
 }
@@ -254,7 +289,10 @@ resource "aws_iam_role" "ghrsst_role_daily" {
 EOF
 }
 
-# And a daily policy
+# And a daily policy. It lists the destination bucket so that reading an
+# index that isn't there yet, like a new year's, is a 404 rather than a 403.
+# The source.coop bucket also has to allow this role, in
+# source-coop-policy.json, for it to read the index there.
 resource "aws_iam_policy" "ghrsst_role_policy_daily" {
   name   = "ghrsst-policy-daily"
   policy = <<EOF
@@ -279,6 +317,25 @@ resource "aws_iam_policy" "ghrsst_role_policy_daily" {
       ],
       "Resource": "${aws_sqs_queue.ghrsst_queue.arn}",
       "Effect": "Allow"
+    },
+    {
+      "Action": [
+        "s3:GetObject"
+      ],
+      "Resource": [
+        "arn:aws:s3:::${aws_s3_bucket.ghrsst_bucket.bucket}/*",
+        "arn:aws:s3:::us-west-2.opendata.source.coop/*"
+      ],
+      "Effect": "Allow"
+    },
+    {
+      "Action": [
+        "s3:ListBucket"
+      ],
+      "Resource": [
+        "arn:aws:s3:::${local.destination_bucket}"
+      ],
+      "Effect": "Allow"
     }
   ]
 }
@@ -339,6 +396,7 @@ resource "aws_lambda_function" "parquet" {
     variables = {
       START_DATE      = "2003-05-30",
       OUTPUT_LOCATION = "s3://${var.destination_bucket_path}",
+      INCREMENTAL     = "true",
     }
   }
 }
@@ -363,3 +421,57 @@ resource "aws_lambda_permission" "allow_cloudwatch_to_call_parquet" {
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.parquet.arn
 }
+
+# And one for the cube, which folds the staged days of a year into it once
+# the year is over
+resource "aws_cloudwatch_log_group" "cube" {
+  name              = "/aws/lambda/ghrsst-lambda-cube"
+  retention_in_days = 5
+}
+
+# Folding a year takes longer than a Lambda can run, so each run carries on
+# from where the last one stopped, and does nothing once it's all folded
+resource "aws_lambda_function" "cube" {
+  function_name = "ghrsst-lambda-cube"
+  role          = aws_iam_role.ghrsst_role.arn # re-use the og role, because it can write
+  image_config {
+    command = ["ghrsst.cube.lambda_handler"]
+  }
+  timeout     = 900  # 15 minutes
+  memory_size = 4096 # 4 GB, for a window of about 730 MB and GDAL's cache
+  ephemeral_storage {
+    size = 512
+  }
+
+  # Run a dockerfile
+  image_uri    = "${resource.aws_ecr_repository.ghrsst.repository_url}:${var.image_tag}"
+  package_type = "Image"
+
+  environment {
+    variables = {
+      OUTPUT_LOCATION       = "s3://${var.destination_bucket_path}",
+      MIN_REMAINING_SECONDS = "300",
+    }
+  }
+}
+
+# Schedule the cube lambda every hour
+resource "aws_cloudwatch_event_rule" "cube" {
+  name                = "ghrsst-lambda-cube"
+  description         = "Fold staged days into the cube"
+  schedule_expression = "rate(1 hour)"
+}
+
+resource "aws_cloudwatch_event_target" "cube" {
+  rule      = aws_cloudwatch_event_rule.cube.name
+  target_id = "ghrsst-lambda-cube"
+  arn       = aws_lambda_function.cube.arn
+}
+
+resource "aws_lambda_permission" "allow_cloudwatch_to_call_cube" {
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.cube.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.cube.arn
+}
@@ -0,0 +1,16 @@
+from datetime import datetime
+
+import pytest
+
+from ghrsst.synthetic import write_synthetic_file
+
+SYNTHETIC_DATE = datetime(2023, 11, 6)
+SYNTHETIC_SHAPE = (600, 1200)
+
+
+@pytest.fixture
+def synthetic_folder(tmp_path):
+    folder = tmp_path / "input"
+    write_synthetic_file(folder, SYNTHETIC_DATE, SYNTHETIC_SHAPE)
+
+    return folder
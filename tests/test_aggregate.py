@@ -0,0 +1,91 @@
+import json
+from datetime import timedelta
+
+import numpy as np
+import pytest
+import rasterio
+
+from ghrsst import aggregate
+from ghrsst.aggregate import (
+    _open_cube,
+    _period_index,
+    aggregate_date,
+    get_aggregates_path,
+    get_derived_location,
+)
+from ghrsst.cogger import get_logger, get_output_path, load_data, process_data
+
+from tests.conftest import SYNTHETIC_DATE
+
+
+def test_aggregate_is_incremental(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder))).load()
+    sst = data["analysed_sst"].isel(time=0).values
+    valid = sst != data["analysed_sst"].attrs["_FillValue"]
+
+    # The next day is a degree warmer, and a repeat changes nothing
+    warmer = data.copy(deep=True)
+    warmer["analysed_sst"].values[0][valid] += 1000
+    next_day = SYNTHETIC_DATE + timedelta(days=1)
+    aggregate_date(data, SYNTHETIC_DATE, tmp_path, log=log)
+    aggregate_date(warmer, next_day, tmp_path, log=log)
+    items = aggregate_date(warmer, next_day, tmp_path, log=log)
+
+    group = _open_cube(get_aggregates_path(tmp_path))
+    np.testing.assert_array_equal(
+        group["analysed_sst_month_count"][_period_index("month", SYNTHETIC_DATE)],
+        valid * 2,
+    )
+
+    # The week starts on the Monday, which is the first date
+    weekly = get_derived_location(tmp_path, "weekly")
+    cog_file = get_output_path(weekly, SYNTHETIC_DATE, "_analysed_sst.tif")
+    with rasterio.open(cog_file) as src:
+        mean = src.read(1)
+    np.testing.assert_array_equal(mean[valid], sst[valid] + 500)
+
+    item = json.loads(open(items["monthly"]).read())
+    assert item["properties"]["start_datetime"] == "2023-11-01T00:00:00Z"
+    assert item["properties"]["end_datetime"] == "2023-11-30T23:59:59Z"
+
+    # The other days of the year haven't been seen, so there's no anomaly
+    anomaly = get_derived_location(tmp_path, "anomaly")
+    cog_file = get_output_path(anomaly, next_day, "_analysed_sst.tif")
+    with rasterio.open(cog_file) as src:
+        assert (src.read(1) == src.nodata).all()
+
+    # A year later, it's measured against the year before, not itself
+    next_year = SYNTHETIC_DATE.replace(year=SYNTHETIC_DATE.year + 1)
+    aggregate_date(warmer, next_year, tmp_path, log=log)
+    cog_file = get_output_path(anomaly, next_year, "_analysed_sst.tif")
+    with rasterio.open(cog_file) as src:
+        np.testing.assert_array_equal(src.read(1)[valid], 1000)
+
+
+def test_aggregate_retry_after_failure(synthetic_folder, tmp_path, monkeypatch):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder))).load()
+    valid = data["analysed_sst"].values[0] != data["analysed_sst"].attrs["_FillValue"]
+    next_day = SYNTHETIC_DATE + timedelta(days=1)
+    aggregate_date(data, SYNTHETIC_DATE, tmp_path, log=log)
+
+    # Fail part way through copying the next day's sums over
+    commit = aggregate._commit
+    calls = []
+
+    def fail_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("Lambda stopped")
+        commit(*args)
+
+    monkeypatch.setattr(aggregate, "_commit", fail_once)
+    with pytest.raises(RuntimeError):
+        aggregate_date(data, next_day, tmp_path, log=log)
+    aggregate_date(data, next_day, tmp_path, log=log)
+
+    group = _open_cube(get_aggregates_path(tmp_path))
+    for period in ["week", "month"]:
+        count = group[f"analysed_sst_{period}_count"][_period_index(period, next_day)]
+        np.testing.assert_array_equal(count, valid * 2)
@@ -1,10 +1,13 @@
 from datetime import datetime
 from pathlib import Path
 
+import numpy as np
 import pytest
 
 from ghrsst.cogger import load_data, process_data
 
+from tests.conftest import SYNTHETIC_DATE
+
 LOCAL_FOLDER = "data"
 LOCAL_FILE_DATE = datetime(2023, 11, 6)
 ROOT_FOLDER = Path(__file__).parent.parent
@@ -47,3 +50,14 @@ def test_process_data(xarray_sample):
     print(processed.lat.values[0], processed.lat.values[-1])
 
     assert affine_after == AFFINE_AFTER
+
+
+def test_process_data_flip_is_a_view(synthetic_folder):
+    data = load_data(SYNTHETIC_DATE, str(synthetic_folder)).load()
+    expected = data.reindex(lat=data.lat[::-1])
+
+    processed = process_data(data)
+
+    assert np.shares_memory(processed.analysed_sst.values, data.analysed_sst.values)
+    for var in data.data_vars:
+        assert (processed[var].values == expected[var].values).all()
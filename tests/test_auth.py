@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ghrsst import auth
+from ghrsst.cogger import get_headers
+
+
+@pytest.fixture
+def logins(monkeypatch):
+    """Count logins, and start each test without a token in memory"""
+    calls = []
+
+    def fake_login():
+        calls.append(1)
+        expires = datetime.now(timezone.utc) + timedelta(days=30)
+        return {"access_token": f"token-{len(calls)}", "expires": expires.isoformat()}
+
+    monkeypatch.setattr(auth, "_login", fake_login)
+    monkeypatch.setattr(auth, "_TOKEN", None)
+    monkeypatch.setenv("EARTHDATA_USERNAME", "user")
+    monkeypatch.setenv("EARTHDATA_PASSWORD", "password")
+    monkeypatch.delenv("EARTHDATA_TOKEN", raising=False)
+    monkeypatch.delenv(auth.TOKEN_CACHE_ENV, raising=False)
+    return calls
+
+
+def test_token_is_reused_in_memory(logins):
+    headers = [get_headers() for _ in range(3)]
+
+    assert len(logins) == 1
+    assert all(h == {"Authorization": "Bearer token-1"} for h in headers)
+
+
+def test_token_is_shared_through_file(logins, monkeypatch, tmp_path):
+    cache_file = tmp_path / "token.json"
+    monkeypatch.setenv(auth.TOKEN_CACHE_ENV, str(cache_file))
+
+    assert auth.get_token() == "token-1"
+    assert cache_file.stat().st_mode & 0o077 == 0
+
+    # Like a new process, with nothing in memory
+    monkeypatch.setattr(auth, "_TOKEN", None)
+    assert auth.get_token() == "token-1"
+    assert len(logins) == 1
+
+
+def test_token_is_refreshed_near_expiry(logins, monkeypatch):
+    assert auth.get_token() == "token-1"
+
+    expires = datetime.now(timezone.utc) + auth.REFRESH_BEFORE / 2
+    monkeypatch.setattr(
+        auth, "_TOKEN", {"access_token": "token-1", "expires": expires.isoformat()}
+    )
+    assert auth.get_token() == "token-2"
+    assert len(logins) == 2
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"access_token": "stale"}',
+        '{"access_token": "stale", "expires": "tomorrow"}',
+        '{"access_token": "stale", "expires": "2030-01-01T00:00:00"}',
+        '["stale"]',
+    ],
+)
+def test_invalid_cache_is_ignored(logins, monkeypatch, tmp_path, text):
+    cache_file = tmp_path / "token.json"
+    cache_file.write_text(text)
+    monkeypatch.setenv(auth.TOKEN_CACHE_ENV, str(cache_file))
+
+    assert auth.get_token() == "token-1"
+    assert len(logins) == 1
+
+
+def test_parse_token():
+    token = auth._parse_token({"access_token": "abc", "expiration_date": "12/31/2030"})
+    assert token["expires"].startswith("2030-12-31")
+
+    # Without an expiry, it's kept for a while rather than forever
+    token = auth._parse_token({"access_token": "abc"})
+    expires = datetime.fromisoformat(token["expires"])
+    assert expires - datetime.now(timezone.utc) <= auth.DEFAULT_LIFETIME
+    assert auth._is_fresh(token)
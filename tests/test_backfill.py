@@ -0,0 +1,91 @@
+import shutil
+from datetime import timedelta
+from pathlib import Path
+
+from ghrsst.backfill import backfill, get_dates
+from ghrsst.cogger import (
+    cache_data,
+    get_cache_path,
+    get_input_path,
+    get_logger,
+    process_date,
+)
+from ghrsst.index import INDEX_FOLDER
+
+from tests.conftest import SYNTHETIC_DATE
+
+
+def test_get_dates(tmp_path):
+    dates_file = tmp_path / "dates.txt"
+    dates_file.write_text("2023-11-06\n\n2023-11-01\n2023-11-06\n")
+
+    assert [f"{d:%Y-%m-%d}" for d in get_dates(dates_file=str(dates_file))] == [
+        "2023-11-01",
+        "2023-11-06",
+    ]
+    assert len(get_dates("2023-12-30", "2024-01-02")) == 4
+
+
+def test_backfill(synthetic_folder, tmp_path):
+    log = get_logger()
+    dates = [SYNTHETIC_DATE, SYNTHETIC_DATE + timedelta(days=1)]
+
+    summary = backfill(
+        dates, str(synthetic_folder), tmp_path / "output", processes=2, log=log
+    )
+    assert summary["done"] == ["2023-11-06"]
+    assert summary["missing"] == ["2023-11-07"]
+    assert summary["failed"] == {}
+
+    # Finished dates aren't processed again
+    summary = backfill(
+        dates, str(synthetic_folder), tmp_path / "output", processes=2, log=log
+    )
+    assert summary["skipped"] == ["2023-11-06"]
+    assert summary["done"] == []
+
+
+def test_failed_date_cache_is_removed(synthetic_folder, tmp_path):
+    log = get_logger()
+    # A file for the date that can be cached, but not opened
+    bad_date = SYNTHETIC_DATE + timedelta(days=2)
+    Path(get_input_path(str(synthetic_folder), bad_date)).write_bytes(b"not netcdf")
+
+    summary = backfill(
+        [bad_date],
+        str(synthetic_folder),
+        tmp_path / "output",
+        cache_local=True,
+        processes=1,
+        log=log,
+    )
+    assert list(summary["failed"]) == ["2023-11-08"]
+    assert not get_cache_path(bad_date).exists()
+
+
+def test_dates_without_an_index_are_skipped(synthetic_folder, tmp_path):
+    log = get_logger()
+    output = tmp_path / "output"
+    backfill([SYNTHETIC_DATE], str(synthetic_folder), output, processes=1, log=log)
+
+    # Written before there was an index, so it's found from the STAC item
+    # and its input isn't fetched again
+    shutil.rmtree(output / INDEX_FOLDER)
+    summary = backfill(
+        [SYNTHETIC_DATE],
+        str(synthetic_folder),
+        output,
+        cache_local=True,
+        processes=1,
+        log=log,
+    )
+    assert summary["skipped"] == ["2023-11-06"]
+    assert summary["done"] == []
+    assert not get_cache_path(SYNTHETIC_DATE).exists()
+
+    # process_date also skips it, and cleans up a prefetched file
+    cache_data(SYNTHETIC_DATE, str(synthetic_folder))
+    assert not process_date(
+        SYNTHETIC_DATE, str(synthetic_folder), output, cache_local=True, log=log
+    )
+    assert not get_cache_path(SYNTHETIC_DATE).exists()
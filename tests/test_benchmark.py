@@ -0,0 +1,34 @@
+import pytest
+
+from ghrsst.benchmark import run_pipeline, s3_stand_in
+from ghrsst.cogger import get_logger
+
+from tests.conftest import SYNTHETIC_DATE
+
+STAGES = ["load_data", "process_data", "write_data", "write_stac", "total"]
+
+
+def test_run_pipeline(synthetic_folder, tmp_path):
+    stages = run_pipeline(
+        str(synthetic_folder), tmp_path / "output", SYNTHETIC_DATE, log=get_logger()
+    )
+
+    assert list(stages) == STAGES
+    assert stages["total"]["seconds"] > 0
+    assert len(list((tmp_path / "output").glob("*/*/*/*.tif"))) == 5
+
+
+def test_run_pipeline_s3(synthetic_folder):
+    pytest.importorskip("moto")
+
+    with s3_stand_in() as output_location:
+        stages = run_pipeline(
+            str(synthetic_folder),
+            output_location,
+            SYNTHETIC_DATE,
+            log=get_logger(),
+            stream=True,
+        )
+        assert len(list(output_location.glob("*/*/*/*.tif"))) == 5
+
+    assert list(stages) == STAGES
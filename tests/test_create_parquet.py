@@ -0,0 +1,211 @@
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ghrsst import create_parquet
+
+START = datetime(2024, 1, 1)
+END = datetime(2024, 1, 20)
+
+
+def _item(date: datetime) -> dict:
+    return {
+        "type": "Feature",
+        "stac_version": "1.1.0",
+        "id": f"{date:%Y%m%d}",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [[-180, -90], [180, -90], [180, 90], [-180, 90], [-180, -90]]
+            ],
+        },
+        "bbox": [-180, -90, 180, 90],
+        "properties": {
+            "datetime": f"{date:%Y-%m-%d}T00:00:00Z",
+            "start_datetime": f"{date:%Y-%m-%d}T00:00:00Z",
+            "end_datetime": f"{date:%Y-%m-%d}T23:59:59Z",
+        },
+        "links": [],
+        "assets": {"analysed_sst": {"href": f"{date:%Y%m%d}-analysed_sst.tif"}},
+    }
+
+
+def test_incremental_only_fetches_new_dates(tmp_path, monkeypatch):
+    fetched = []
+
+    async def fake_fetch_all_items(dates, input_location, **kwargs):
+        fetched.extend(dates)
+        # The latest date hasn't been processed yet
+        items = [_item(date) for date in dates if date < END]
+        return items, {"missing": [], "failed": {}}
+
+    monkeypatch.setattr(create_parquet, "fetch_all_items", fake_fetch_all_items)
+
+    def run(end_date, incremental):
+        return asyncio.run(
+            create_parquet.create_parquet(
+                START,
+                end_date,
+                "s3:/bucket/ghrsst-mur-v2",
+                str(tmp_path),
+                log=create_parquet.get_logger(),
+                incremental=incremental,
+                refresh_days=3,
+            )
+        )
+
+    assert run(END - timedelta(days=5), incremental=False) == 15
+
+    fetched.clear()
+    assert run(END, incremental=True) == 19
+    assert fetched == [END - timedelta(days=i) for i in range(4, -1, -1)]
+
+    written = asyncio.run(
+        create_parquet.read_existing_items(str(tmp_path / create_parquet.PARQUET_FILE))
+    )
+    assert [item["id"] for item in written] == [
+        f"{START + timedelta(days=i):%Y%m%d}" for i in range(19)
+    ]
+
+
+@pytest.fixture
+def item_server():
+    """Serve an item for each date, with an ETag, like source.coop does
+
+    The first date always fails, the second is busy the first time it's
+    asked for, and the last has no item.
+    """
+    requests, not_modified = [], []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            name = self.path.rsplit("/", 1)[-1]
+            date = datetime.strptime(name[:8], "%Y%m%d")
+            requests.append(date)
+            if date == START:
+                self.send_response(500)
+            elif date == START + timedelta(days=1) and requests.count(date) == 1:
+                self.send_response(503)
+            elif date == START + timedelta(days=4):
+                self.send_response(404)
+            elif self.headers.get("If-None-Match") == f'"{name}"':
+                not_modified.append(date)
+                self.send_response(304)
+            else:
+                body = json.dumps(_item(date)).encode()
+                self.send_response(200)
+                self.send_header("ETag", f'"{name}"')
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.end_headers()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/ghrsst-mur-v2", not_modified, requests
+    server.shutdown()
+
+
+def test_fetch_retries_caches_and_reports(item_server, tmp_path, monkeypatch):
+    public_url, not_modified, requests = item_server
+    monkeypatch.setattr(create_parquet, "BACKOFF_SECONDS", 0)
+    dates = [START + timedelta(days=i) for i in range(5)]
+
+    def fetch():
+        return asyncio.run(
+            create_parquet.fetch_all_items(
+                dates,
+                "s3:/bucket/ghrsst-mur-v2",
+                cache_dir=tmp_path,
+                public_url=public_url,
+            )
+        )
+
+    items, summary = fetch()
+    assert [item["id"] for item in items] == ["20240102", "20240103", "20240104"]
+    assert summary["missing"] == ["2024-01-05"]
+    assert list(summary["failed"]) == ["2024-01-01"]
+    assert requests.count(START) == create_parquet.RETRIES
+
+    # Unchanged items come from the cache
+    again, _ = fetch()
+    assert again == items
+    assert sorted(not_modified) == dates[1:4]
+    assert len(list(tmp_path.glob("*.json"))) == 3
+
+
+def test_from_listing(tmp_path, monkeypatch):
+    pytest.importorskip("moto")
+    from ghrsst.benchmark import s3_stand_in
+    from ghrsst.cogger import get_output_path, get_s3_client
+
+    async def no_https(*args, **kwargs):
+        raise AssertionError("Items should come from the listing")
+
+    monkeypatch.setattr(create_parquet, "fetch_all_items", no_https)
+    # Across a year boundary, with a gap and the latest date not done yet
+    dates = [datetime(2023, 12, 29) + timedelta(days=i) for i in range(6)]
+
+    with s3_stand_in() as location:
+        s3 = get_s3_client()
+        for date in dates[:2] + dates[3:5]:
+            folder = get_output_path(location, date, "").parent
+            item_path = get_output_path(location, date, create_parquet.ITEM_SUFFIX)
+            s3.put_object(
+                Bucket=location.bucket, Key=item_path.key, Body=json.dumps(_item(date))
+            )
+            s3.put_object(Bucket=location.bucket, Key=f"{folder.key}/cog.tif", Body=b"")
+
+        def run():
+            return asyncio.run(
+                create_parquet.create_parquet(
+                    dates[0],
+                    dates[-1],
+                    f"s3:/{location.bucket}/{location.key}",
+                    str(tmp_path),
+                    cache_dir=tmp_path / "cache",
+                    from_listing=True,
+                )
+            )
+
+        assert run() == 4
+        assert len(list((tmp_path / "cache").glob("*.json"))) == 4
+
+        # Items that haven't changed aren't downloaded again
+        cached_path = next((tmp_path / "cache").glob("20231229*.json"))
+        cached = json.loads(cached_path.read_text())
+        cached["item"]["id"] = "cached"
+        cached_path.write_text(json.dumps(cached))
+        assert run() == 4
+
+    written = asyncio.run(
+        create_parquet.read_existing_items(str(tmp_path / create_parquet.PARQUET_FILE))
+    )
+    assert [item["id"] for item in written][0] == "cached"
+
+
+def test_list_item_keys_at_bucket_root():
+    pytest.importorskip("moto")
+    from s3path import S3Path
+
+    from ghrsst.benchmark import s3_stand_in
+    from ghrsst.cogger import get_output_path, get_s3_client
+
+    with s3_stand_in() as location:
+        root = S3Path(f"/{location.bucket}/")
+        item_path = get_output_path(root, START, create_parquet.ITEM_SUFFIX)
+        get_s3_client().put_object(
+            Bucket=location.bucket, Key=item_path.key, Body=b"{}"
+        )
+
+        keys = create_parquet.list_item_keys(root, [START.year])
+        assert list(keys) == [START]
+        assert keys[START][0] == item_path.key
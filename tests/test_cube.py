@@ -0,0 +1,120 @@
+import shutil
+from datetime import timedelta
+
+import numpy as np
+import zarr
+
+from ghrsst.cogger import get_logger, load_data, process_data, process_date
+from ghrsst.cube import (
+    FOLD_ATTR,
+    _day_index,
+    _time_index,
+    append_date,
+    fold,
+    get_cube_path,
+    get_staging_path,
+    read_staged,
+    rechunk,
+)
+from ghrsst.index import INDEX_FOLDER, read_index
+
+from tests.conftest import SYNTHETIC_DATE
+
+
+def test_append_is_idempotent(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+    # In the next year, so it's staged in another group
+    next_date = SYNTHETIC_DATE + timedelta(days=60)
+
+    store = append_date(data, SYNTHETIC_DATE, tmp_path, log=log)
+    append_date(data, next_date, tmp_path, log=log)
+    append_date(data, SYNTHETIC_DATE, tmp_path, log=log)
+
+    dates = [SYNTHETIC_DATE - timedelta(days=1), SYNTHETIC_DATE, next_date]
+    assert read_staged(tmp_path, dates, "analysed_sst") == {SYNTHETIC_DATE, next_date}
+
+    # Only the date's own chunks are written
+    staging = zarr.open_group(store)
+    sst = data["analysed_sst"].values[0]
+    for date in [SYNTHETIC_DATE, next_date]:
+        array = staging[f"{date.year}/analysed_sst"]
+        np.testing.assert_array_equal(array[_day_index(date)], sst)
+        assert (array[_day_index(date) - 1] == array.fill_value).all()
+
+
+def test_rechunk_folds_staged_dates(synthetic_folder, tmp_path):
+    log = get_logger()
+    process_date(SYNTHETIC_DATE, str(synthetic_folder), tmp_path / "cogs", log=log)
+    process_date(
+        SYNTHETIC_DATE,
+        str(synthetic_folder),
+        tmp_path / "multiband",
+        log=log,
+        layout="multiband",
+    )
+    # Staged, and changed since the COGs were written, to see which is read
+    process_date(
+        SYNTHETIC_DATE, str(synthetic_folder), tmp_path / "staged", log=log, cube=True
+    )
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder))).load()
+    valid = data["analysed_sst"].values != -32768
+    data["analysed_sst"].values[valid] += 1
+    append_date(data, SYNTHETIC_DATE, tmp_path / "staged", log=log)
+
+    cubes = {}
+    for output in ["cogs", "multiband", "staged"]:
+        summary = rechunk(
+            tmp_path / output, [SYNTHETIC_DATE], processes=2, window=300, log=log
+        )
+        assert summary["dates"] == 1
+        cubes[output] = zarr.open_group(get_cube_path(tmp_path / output))
+
+    expected = cubes.pop("cogs")
+    index = _time_index(SYNTHETIC_DATE)
+    for output, rechunked in cubes.items():
+        assert sorted(rechunked.array_keys()) == sorted(expected.array_keys())
+        for var in ["analysed_sst", "analysis_error", "mask", "sea_ice_fraction"]:
+            assert rechunked[var].attrs.asdict() == expected[var].attrs.asdict()
+            values = expected[var][index - 1 : index + 1]
+            if output == "staged" and var == "analysed_sst":
+                values[1] = data[var].values[0]
+            assert (rechunked[var][index - 1 : index + 1] == values).all()
+
+
+def test_rechunk_without_index(synthetic_folder, tmp_path):
+    log = get_logger()
+    process_date(SYNTHETIC_DATE, str(synthetic_folder), tmp_path, log=log)
+    # As if it was written before there was an index
+    shutil.rmtree(tmp_path / INDEX_FOLDER)
+
+    summary = rechunk(tmp_path, [SYNTHETIC_DATE], processes=1, window=300, log=log)
+    assert summary["dates"] == 1
+    assert read_index(tmp_path, SYNTHETIC_DATE.year) == {"2023-11-06"}
+
+
+def test_fold_carries_on_and_removes_staged_days(synthetic_folder, tmp_path):
+    log = get_logger()
+    process_date(SYNTHETIC_DATE, str(synthetic_folder), tmp_path, log=log, cube=True)
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder))).load()
+
+    # Out of time before any task starts, so it's left for the next run
+    summary = fold(tmp_path, seconds=-1, log=log)
+    assert not summary["complete"]
+    staging = zarr.open_group(get_staging_path(tmp_path))
+    assert staging.attrs[FOLD_ATTR]["staged"]["analysed_sst"] == ["2023-11-06"]
+
+    summary = fold(tmp_path, log=log)
+    assert summary["complete"]
+    cube = zarr.open_group(get_cube_path(tmp_path))
+    np.testing.assert_array_equal(
+        cube["analysed_sst"][_time_index(SYNTHETIC_DATE)],
+        data["analysed_sst"].values[0],
+    )
+
+    # The year is over and all folded, so staging is empty, and there's
+    # nothing left to fold
+    staging = zarr.open_group(get_staging_path(tmp_path))
+    assert list(staging.groups()) == []
+    assert FOLD_ATTR not in staging.attrs
+    assert fold(tmp_path, log=log) is None
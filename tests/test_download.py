@@ -0,0 +1,74 @@
+import hashlib
+import json
+
+import pytest
+
+from ghrsst.cogger import GHRSSTException
+from ghrsst import download
+from ghrsst.download import download_file, get_md5
+
+PART_SIZE = 1000
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    source = tmp_path / "source.nc"
+    source.write_bytes(bytes(range(256)) * 20)
+    return source
+
+
+def test_download_in_parts(source_file, tmp_path):
+    destination = tmp_path / "cache.nc"
+    md5 = hashlib.md5(source_file.read_bytes()).hexdigest()
+
+    download_file(str(source_file), destination, md5=md5, part_size=PART_SIZE)
+
+    assert destination.read_bytes() == source_file.read_bytes()
+    assert not (tmp_path / "cache.nc.parts").exists()
+
+
+def test_download_resumes(source_file, tmp_path):
+    destination = tmp_path / "cache.nc"
+    size = source_file.stat().st_size
+
+    # Pretend the first part was downloaded before a failure, with
+    # zeros in place of its data, so we can see it isn't fetched again
+    destination.write_bytes(b"\0" * size)
+    (tmp_path / "cache.nc.parts").write_text(
+        json.dumps({"size": size, "part_size": PART_SIZE, "done": [0]})
+    )
+
+    download_file(str(source_file), destination, part_size=PART_SIZE)
+
+    downloaded = destination.read_bytes()
+    assert downloaded[:PART_SIZE] == b"\0" * PART_SIZE
+    assert downloaded[PART_SIZE:] == source_file.read_bytes()[PART_SIZE:]
+
+
+def test_download_checksum_mismatch(source_file, tmp_path):
+    destination = tmp_path / "cache.nc"
+
+    with pytest.raises(GHRSSTException):
+        download_file(str(source_file), destination, md5="0" * 32)
+
+    assert not destination.exists()
+
+
+def test_download_replaces_bad_file(source_file, tmp_path):
+    destination = tmp_path / "cache.nc"
+    md5 = hashlib.md5(source_file.read_bytes()).hexdigest()
+    # The right size, but not the right bytes
+    destination.write_bytes(b"\0" * source_file.stat().st_size)
+
+    download_file(str(source_file), destination, md5=md5, part_size=PART_SIZE)
+
+    assert destination.read_bytes() == source_file.read_bytes()
+
+
+def test_get_md5_failure_is_no_checksum(monkeypatch):
+    def forbidden(*args, **kwargs):
+        raise PermissionError("403 Forbidden")
+
+    monkeypatch.setattr(download, "url_to_fs", forbidden)
+
+    assert get_md5("https://example.com/file.nc") is None
@@ -0,0 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from botocore.exceptions import ClientError
+
+from ghrsst import dategen
+from ghrsst.cogger import get_logger, get_output_path
+from ghrsst.dategen import remove_done_dates
+from ghrsst.index import filter_done, mark_done, read_index, rebuild_index
+
+START = datetime(2024, 2, 1)
+
+
+def test_filter_done(tmp_path):
+    dates = [START + timedelta(days=i) for i in range(5)]
+    mark_done(tmp_path, dates[1])
+    mark_done(tmp_path, dates[3])
+    mark_done(tmp_path, dates[3])
+
+    assert read_index(tmp_path, 2024) == {"2024-02-02", "2024-02-04"}
+    assert filter_done(tmp_path, dates) == [dates[0], dates[2], dates[4]]
+
+
+def test_concurrent_mark_done(tmp_path):
+    dates = [START + timedelta(days=i) for i in range(20)]
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(mark_done, [tmp_path] * len(dates), dates))
+
+    assert filter_done(tmp_path, dates) == []
+
+
+def test_rebuild_index(tmp_path):
+    for date in [START, START + timedelta(days=10)]:
+        stac_file = get_output_path(tmp_path, date, ".stac-item.json")
+        stac_file.parent.mkdir(parents=True)
+        stac_file.write_text("{}")
+
+    assert rebuild_index(tmp_path, 2024) == {"2024-02-01", "2024-02-11"}
+    assert read_index(tmp_path, 2024) == {"2024-02-01", "2024-02-11"}
+
+
+def test_unreadable_index_queues_every_date(tmp_path, monkeypatch):
+    def access_denied(*args, **kwargs):
+        raise ClientError({"Error": {"Code": "AccessDenied"}}, "GetObject")
+
+    monkeypatch.setattr(dategen, "filter_done", access_denied)
+    dates = [START + timedelta(days=i) for i in range(3)]
+
+    assert remove_done_dates(dates, str(tmp_path), get_logger()) == dates
+
+
+def test_other_index_errors_are_raised(tmp_path, monkeypatch):
+    def slow_down(*args, **kwargs):
+        raise ClientError({"Error": {"Code": "SlowDown"}}, "GetObject")
+
+    monkeypatch.setattr(dategen, "filter_done", slow_down)
+    with pytest.raises(ClientError):
+        remove_done_dates([START], str(tmp_path), get_logger())
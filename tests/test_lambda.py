@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from ghrsst import cogger
+
+
+class FakeLambdaContext:
+    def __init__(self, remaining_seconds):
+        self.remaining_seconds = remaining_seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_seconds * 1000
+
+
+def _event(*dates):
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:sqs",
+                "messageId": f"message-{date}",
+                "body": json.dumps({"date": date}),
+            }
+            for date in dates
+        ]
+    }
+
+
+def test_batch_reports_failures(monkeypatch):
+    processed = []
+
+    def fake_process_date(date, *args, **kwargs):
+        processed.append(f"{date:%Y-%m-%d}")
+        if date.day == 2:
+            raise cogger.GHRSSTException("Failed")
+        if date.day == 3:
+            raise FileNotFoundError("Not published yet")
+
+    monkeypatch.setattr(cogger, "LOGGER", cogger.get_logger())
+    monkeypatch.setattr(cogger, "process_date", fake_process_date)
+
+    result = cogger.lambda_handler(
+        _event("2024-01-01", "2024-01-02", "2024-01-03"), FakeLambdaContext(900)
+    )
+
+    assert processed == ["2024-01-01", "2024-01-02", "2024-01-03"]
+    assert result == {"batchItemFailures": [{"itemIdentifier": "message-2024-01-02"}]}
+
+
+def test_batch_returns_dates_without_time(monkeypatch):
+    monkeypatch.setattr(cogger, "LOGGER", cogger.get_logger())
+
+    result = cogger.lambda_handler(_event("2024-01-01"), FakeLambdaContext(60))
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "message-2024-01-01"}]}
+
+
+def test_unknown_profile_fails_before_processing(monkeypatch):
+    def fake_process_date(*args, **kwargs):
+        raise AssertionError("No date should be started")
+
+    monkeypatch.setattr(cogger, "LOGGER", cogger.get_logger())
+    monkeypatch.setattr(cogger, "process_date", fake_process_date)
+    monkeypatch.setenv("COG_PROFILE", "smallest")
+
+    with pytest.raises(cogger.GHRSSTException, match="Unknown profile"):
+        cogger.lambda_handler(_event("2024-01-01"), FakeLambdaContext(900))
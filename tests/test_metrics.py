@@ -0,0 +1,34 @@
+import json
+
+from ghrsst.cogger import get_logger, process_date
+
+from tests.conftest import SYNTHETIC_DATE
+
+
+def test_process_date_metrics(synthetic_folder, tmp_path):
+    metrics_file = tmp_path / "metrics.jsonl"
+    process_date(
+        SYNTHETIC_DATE,
+        str(synthetic_folder),
+        tmp_path / "output",
+        log=get_logger(),
+        workers=2,
+        metrics_file=str(metrics_file),
+    )
+
+    lines = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    stages = {(line["Stage"], line.get("Variable")) for line in lines}
+
+    for step in ["load_data", "process_data", "write_data", "write_stac"]:
+        assert (step, None) in stages
+    assert ("encode", "analysed_sst") in stages
+    assert ("upload", "mask") in stages
+
+    # The whole date is the last line, and it wrote the COGs
+    total = lines[-1]
+    assert total["Stage"] == "process_date"
+    assert total["BytesWritten"] > 0
+
+    metric = total["_aws"]["CloudWatchMetrics"][0]
+    assert metric["Dimensions"] == [["Stage"]]
+    assert {m["Name"] for m in metric["Metrics"]} <= set(total)
@@ -0,0 +1,18 @@
+from ghrsst.cogger import get_output_path, load_data
+from ghrsst.reader import REFERENCES_EXTENSION
+
+from tests.conftest import SYNTHETIC_DATE
+
+
+def test_range_read_matches(synthetic_folder, tmp_path):
+    expected = load_data(SYNTHETIC_DATE, str(synthetic_folder)).load()
+    ranged = load_data(
+        SYNTHETIC_DATE,
+        str(synthetic_folder),
+        range_read=True,
+        references_location=tmp_path,
+    )
+
+    assert "dt_1km_data" not in ranged.data_vars
+    assert get_output_path(tmp_path, SYNTHETIC_DATE, REFERENCES_EXTENSION).exists()
+    assert ranged.load().identical(expected)
@@ -0,0 +1,84 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ghrsst.session import get_http_filesystem
+
+TOKEN = "Bearer token"
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Serve files like Earthdata does, redirecting authorised requests to
+    a signed URL on another host that refuses the Authorization header
+    """
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            requests.append(path)
+            authorization = self.headers.get("Authorization")
+            if path.startswith("/protected/"):
+                if authorization != TOKEN:
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+                port = self.server.server_port
+                self.send_response(307)
+                self.send_header(
+                    "Location",
+                    f"http://localhost:{port}/signed/{path[11:]}?X-Amz-Expires=3600",
+                )
+                self.end_headers()
+                return
+
+            if authorization is not None:
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            data = (tmp_path / path[8:]).read_bytes()
+            start, end = 0, len(data) - 1
+            if "Range" in self.headers:
+                start, end = self.headers["Range"][6:].split("-")
+                start, end = int(start), min(int(end), len(data) - 1)
+            self.send_response(206 if "Range" in self.headers else 200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            self.end_headers()
+            self.wfile.write(data[start : end + 1])
+
+        do_HEAD = do_GET
+
+    (tmp_path / "file.nc").write_bytes(bytes(range(256)) * 16)
+    http_server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{http_server.server_port}/protected/file.nc", requests
+    http_server.shutdown()
+
+
+def test_redirect_is_reused(server):
+    url, requests = server
+    fs = get_http_filesystem({"Authorization": TOKEN})
+
+    assert fs.cat_file(url, start=0, end=4) == bytes(range(4))
+    assert fs.cat_file(url, start=256, end=260) == bytes(range(4))
+    with fs.open(url, "rb") as f:
+        assert len(f.read()) == 4096
+
+    # Only the first request goes through the redirect
+    assert requests.count("/protected/file.nc") == 1
+
+
+def test_filesystem_is_shared():
+    headers = {"Authorization": TOKEN}
+
+    assert get_http_filesystem(headers) is get_http_filesystem(dict(headers))
+    assert get_http_filesystem(headers) is not get_http_filesystem(
+        headers, asynchronous=True
+    )
@@ -0,0 +1,304 @@
+import json
+
+import numpy as np
+import pytest
+import rasterio
+
+from ghrsst import cogger
+from ghrsst.cogger import (
+    COARSE_PRODUCTS,
+    GHRSSTException,
+    coarsen_data,
+    create_item,
+    get_cog_options,
+    get_logger,
+    get_output_path,
+    get_roi,
+    get_roi_location,
+    load_data,
+    memmap_data,
+    process_data,
+    process_date,
+    write_data,
+)
+
+from ghrsst.compare import compare_profiles
+
+from tests.conftest import SYNTHETIC_DATE, SYNTHETIC_SHAPE
+
+
+def test_parallel_write_is_identical(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+
+    serial = write_data(data, SYNTHETIC_DATE, tmp_path / "serial", log=log)
+    parallel = write_data(
+        data, SYNTHETIC_DATE, tmp_path / "parallel", log=log, workers=5
+    )
+
+    assert [var for var, _ in serial] == [var for var, _ in parallel]
+    for (_, serial_file), (_, parallel_file) in zip(serial, parallel):
+        assert serial_file.read_bytes() == parallel_file.read_bytes()
+
+
+def test_streamed_write_matches(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+
+    in_memory = write_data(data, SYNTHETIC_DATE, tmp_path / "memory", log=log)
+    streamed = write_data(
+        data, SYNTHETIC_DATE, tmp_path / "stream", log=log, stream=True
+    )
+
+    for (_, memory_file), (_, stream_file) in zip(in_memory, streamed):
+        with rasterio.open(memory_file) as expected, rasterio.open(stream_file) as cog:
+            assert cog.transform == expected.transform
+            assert cog.nodata == expected.nodata
+            assert cog.scales == expected.scales
+            assert cog.offsets == expected.offsets
+            assert cog.units == expected.units
+            assert (cog.read() == expected.read()).all()
+
+
+def test_memmap_write_matches(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = load_data(SYNTHETIC_DATE, str(synthetic_folder))
+    folder = tmp_path / "memmaps"
+    folder.mkdir()
+    mapped = process_data(memmap_data(data, folder=folder))
+
+    # The files are gone once they're mapped, and the flip undoes the one
+    # they were stored with
+    assert list(folder.iterdir()) == []
+    pixels = mapped["analysed_sst"].data
+    assert isinstance(pixels, np.memmap)
+    assert pixels.flags.c_contiguous
+
+    loaded = write_data(
+        process_data(data), SYNTHETIC_DATE, tmp_path / "loaded", log=log, coarse=True
+    )
+    statistics = {}
+    memmapped = write_data(
+        mapped,
+        SYNTHETIC_DATE,
+        tmp_path / "memmap",
+        log=log,
+        coarse=True,
+        statistics=statistics,
+    )
+
+    assert set(statistics) == set(data.data_vars)
+    for (_, loaded_file), (_, memmap_file) in zip(loaded, memmapped):
+        assert loaded_file.read_bytes() == memmap_file.read_bytes()
+
+
+def test_item_from_memory(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+
+    in_memory, streamed = {}, {}
+    written = write_data(
+        data, SYNTHETIC_DATE, tmp_path / "memory", log=log, statistics=in_memory
+    )
+    write_data(
+        data,
+        SYNTHETIC_DATE,
+        tmp_path / "stream",
+        log=log,
+        stream=True,
+        statistics=streamed,
+    )
+    assert in_memory == streamed
+
+    item = create_item(
+        data, written, SYNTHETIC_DATE, "item", statistics=in_memory
+    ).to_dict()
+
+    # The projection matches what's in the COG, without reading it back
+    with rasterio.open(written[0][1]) as cog:
+        assert item["properties"]["proj:shape"] == [cog.height, cog.width]
+        assert item["properties"]["proj:transform"] == list(cog.transform)
+        assert item["bbox"] == list(cog.bounds)
+
+    band = item["assets"]["analysed_sst"]["raster:bands"][0]
+    values = data["analysed_sst"].values
+    valid = values[values != -32768]
+    assert band["statistics"]["valid_percent"] == round(
+        100 * valid.size / values.size, 2
+    )
+    assert band["statistics"]["minimum"] == valid.min()
+    assert band["statistics"]["maximum"] == valid.max()
+    assert valid.size < SYNTHETIC_SHAPE[0] * SYNTHETIC_SHAPE[1]
+
+
+def test_coarse_block_mean(synthetic_folder):
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+    coarse = coarsen_data(data)
+
+    sst = data["analysed_sst"].values[0]
+    fill = data["analysed_sst"].attrs["_FillValue"]
+    for name, factor in COARSE_PRODUCTS.items():
+        # Check the first full block in each direction against numpy
+        block = sst[:factor, factor : 2 * factor]
+        valid = block[block != fill]
+        expected = np.round(valid.mean()) if valid.size else fill
+
+        assert coarse[name]["analysed_sst"].values[0, 0, 1] == expected
+        assert coarse[name]["analysed_sst"].shape[1] == -(-sst.shape[0] // factor)
+        assert coarse[name]["analysed_sst"].dtype == sst.dtype
+
+
+def test_coarse_assets(synthetic_folder, tmp_path):
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+    written = write_data(data, SYNTHETIC_DATE, tmp_path, log=get_logger(), coarse=True)
+
+    item = create_item(data, written, SYNTHETIC_DATE, "item").to_dict()
+    asset = item["assets"]["analysed_sst_0p25"]
+    assert asset["roles"] == ["overview"]
+
+    with rasterio.open(asset["href"]) as cog:
+        assert asset["proj:shape"] == [cog.height, cog.width]
+        assert asset["proj:transform"] == list(cog.transform)
+        assert cog.nodata == -32768
+
+
+def test_multiband_layout(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+
+    for stream in (False, True):
+        statistics = {}
+        written = write_data(
+            data,
+            SYNTHETIC_DATE,
+            tmp_path / str(stream),
+            log=log,
+            stream=stream,
+            statistics=statistics,
+            layout="multiband",
+        )
+        assert [key for key, _ in written] == ["int16", "int8"]
+
+        item = create_item(
+            data, written, SYNTHETIC_DATE, "item", statistics=statistics
+        ).to_dict()
+        asset = item["assets"]["int16"]
+        names = [band["name"] for band in asset["raster:bands"]]
+        assert names == ["analysed_sst", "analysis_error", "sst_anomaly"]
+
+        with rasterio.open(asset["href"]) as cog:
+            assert cog.count == 3
+            assert cog.scales == tuple(b["scale"] for b in asset["raster:bands"])
+            assert cog.offsets == tuple(b["offset"] for b in asset["raster:bands"])
+            assert (cog.read(2) == data["analysis_error"].values[0]).all()
+
+
+def test_profiles(synthetic_folder, tmp_path):
+    log = get_logger()
+    data = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+
+    assert get_cog_options([data["analysed_sst"]])["predictor"] == 2
+    assert get_cog_options([data["mask"]])["predictor"] == 2
+    assert get_cog_options([data["mask"]], "archive")["predictor"] == 1
+    # Flags are never averaged
+    assert get_cog_options([data["mask"]], "archive")["overview_resampling"] == (
+        "nearest"
+    )
+
+    fast = write_data(data, SYNTHETIC_DATE, tmp_path / "fast", log=log, profile="fast")
+    archive = write_data(
+        data, SYNTHETIC_DATE, tmp_path / "archive", log=log, profile="archive"
+    )
+    for (_, fast_file), (_, archive_file) in zip(fast, archive):
+        with rasterio.open(fast_file) as a, rasterio.open(archive_file) as b:
+            assert (a.read() == b.read()).all()
+        assert archive_file.stat().st_size < fast_file.stat().st_size
+
+    results = compare_profiles(data[["mask"]].load(), ["fast", "balanced"])
+    assert [result["profile"] for result in results] == ["fast", "balanced"]
+    assert all(result["megabytes"] > 0 for result in results)
+
+
+def test_retry_reads_only_missing(synthetic_folder, tmp_path, monkeypatch):
+    log = get_logger()
+    process_date(SYNTHETIC_DATE, str(synthetic_folder), tmp_path, log=log)
+
+    stac_file = get_output_path(tmp_path, SYNTHETIC_DATE, ".stac-item.json")
+    mask_file = get_output_path(tmp_path, SYNTHETIC_DATE, "_mask.tif")
+    sst_file = get_output_path(tmp_path, SYNTHETIC_DATE, "_analysed_sst.tif")
+    sst_modified = sst_file.stat().st_mtime_ns
+
+    loaded = []
+
+    def spy_load_data(*args, **kwargs):
+        loaded.append(kwargs["variables"])
+        return load_data(*args, **kwargs)
+
+    def no_download(*args, **kwargs):
+        raise AssertionError("Nothing should be downloaded")
+
+    monkeypatch.setattr(cogger, "load_data", spy_load_data)
+    monkeypatch.setattr(cogger, "cache_data", no_download)
+
+    # As if the date failed after writing all but the mask
+    stac_file.unlink()
+    mask_file.unlink()
+    process_date(SYNTHETIC_DATE, str(synthetic_folder), tmp_path, log=log)
+    assert loaded[-1] == ["mask"]
+    assert mask_file.exists()
+    assert sst_file.stat().st_mtime_ns == sst_modified
+
+    # Only the STAC item is missing, so don't download anything
+    stac_file.unlink()
+    process_date(
+        SYNTHETIC_DATE, str(synthetic_folder), tmp_path, log=log, cache_local=True
+    )
+    assert loaded[-1] == []
+    assert len(json.loads(stac_file.read_text())["assets"]) == 5
+
+
+def test_roi_output(synthetic_folder, tmp_path):
+    # The synthetic grid starts at -180, 90, with 0.01 degree pixels
+    roi = get_roi("-179,85,-175,88", "box")
+    process_date(
+        SYNTHETIC_DATE,
+        str(synthetic_folder),
+        tmp_path,
+        range_read=True,
+        roi=roi,
+    )
+
+    full = process_data(load_data(SYNTHETIC_DATE, str(synthetic_folder)))
+    roi_location = get_roi_location(tmp_path, "box")
+    cog_file = get_output_path(roi_location, SYNTHETIC_DATE, "_analysed_sst.tif")
+    with rasterio.open(cog_file) as src:
+        # Pixel edges are half way between hundredths of a degree, so the
+        # pixels that the edges of the region go through are included
+        assert (src.height, src.width) == (301, 401)
+        assert tuple(src.bounds) == pytest.approx((-179.005, 84.995, -174.995, 88.005))
+        expected = full["analysed_sst"].isel(time=0, lat=slice(199, 500))
+        np.testing.assert_array_equal(src.read(1), expected.isel(lon=slice(99, 500)))
+
+    item = json.loads(
+        get_output_path(roi_location, SYNTHETIC_DATE, ".stac-item.json").read_text()
+    )
+    assert item["id"].endswith("_box")
+    assert item["bbox"] == pytest.approx([-179.005, 84.995, -174.995, 88.005])
+    # Nothing is written for the whole grid
+    assert list(tmp_path.glob("20*")) == []
+
+
+def test_get_roi(tmp_path):
+    geojson = {
+        "type": "Feature",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[140, -50], [150, -50], [145, -40], [140, -50]]],
+        },
+    }
+    (tmp_path / "tasman.geojson").write_text(json.dumps(geojson))
+
+    assert get_roi(str(tmp_path / "tasman.geojson")) == ("tasman", (140, -50, 150, -40))
+    assert get_roi(json.dumps(geojson), "tasman")[1] == (140, -50, 150, -40)
+    with pytest.raises(GHRSSTException):
+        get_roi("10,0,5,1")